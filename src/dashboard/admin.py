@@ -3,11 +3,41 @@ Register models for admin views
 """
 
 from django.contrib import admin
-from .models import Keyword, Feed, Post, Subscription, UserPost, Comment
+from django.core.exceptions import PermissionDenied
+from rsscatcher.tasks import remove_feed
+from .models import Keyword, Feed, Post, Subscription, UserPost, Comment, Profile
+
+
+class FeedAdmin(admin.ModelAdmin):
+
+    """
+    Feeds are removed by a background task, the admin delete views would
+    load every post, user post and comment of the feeds
+    """
+
+    actions = ['remove_in_background']
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def remove_in_background(self, request, queryset):
+
+        if not request.user.has_perm('dashboard.delete_feed'):
+            raise PermissionDenied
+
+        feed_ids = list(queryset.values_list('id', flat=True))
+        for feed_id in feed_ids:
+            remove_feed.delay(feed_id)
+
+        self.message_user(request, "{} feeds will be removed in the background".format(len(feed_ids)))
+
+    remove_in_background.short_description = "Remove selected feeds in the background"
+
 
 admin.site.register(Keyword)
-admin.site.register(Feed)
+admin.site.register(Feed, FeedAdmin)
 admin.site.register(Subscription)
 admin.site.register(Post)
 admin.site.register(UserPost)
 admin.site.register(Comment)
+admin.site.register(Profile)
@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_migrate
+
+
+class DashboardConfig(AppConfig):
+    name = 'dashboard'
+
+    def ready(self):
+        from .indexes import create_partial_indexes, create_pattern_indexes
+        from .search import create_search_index
+        post_migrate.connect(create_partial_indexes, sender=self)
+        post_migrate.connect(create_pattern_indexes, sender=self)
+        post_migrate.connect(create_search_index, sender=self)
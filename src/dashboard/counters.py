@@ -0,0 +1,122 @@
+"""
+Sidebar counters, cached per user
+"""
+
+import hashlib
+import json
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+from .dates import today_range
+from .models import Feed, Post, UserPost
+
+
+def cache_key(user_id):
+
+    """
+    Key of the counters of a user
+    """
+
+    return "sidebar-counters-{}".format(user_id)
+
+
+def feed_counts(user, today):
+
+    """
+    Posts of each followed feed counted by state, one row per feed
+
+    One query grouped by feed, with a conditional count for each state.
+
+    :param user: User or id of a user
+    :param today: Range of the current day of the user
+    """
+
+    start, end = today
+
+    return Post.objects.for_user(user).values('feed_id').annotate(
+        posts=Count('id'),
+        today=Count('id', filter=Q(
+            state=UserPost.UNREAD,
+            published_date__gte=start,
+            published_date__lt=end
+        )),
+        read=Count('id', filter=Q(state=UserPost.READ)),
+        unread=Count('id', filter=Q(state=UserPost.UNREAD)),
+        readlater=Count('id', filter=Q(state=UserPost.READLATER)),
+        favorite=Count('id', filter=Q(state=UserPost.FAVORITE))
+    ).order_by()
+
+
+def compute_sidebar_counters(user, today=None):
+
+    """
+    Count posts of each followed feed and posts of the user in each state
+
+    Counters are computed by feed_counts and summed over feeds.
+
+    :param today: Range of the current day of the user
+    """
+
+    counts_by_feed = {
+        counts['feed_id']: counts for counts in feed_counts(user, today or today_range(user))
+    }
+
+    def total(state):
+        return sum(counts[state] for counts in counts_by_feed.values())
+
+    return {
+        'feeds': [
+            {
+                'name': feed['name'],
+                'slug': feed['slug'],
+                'posts_count': counts_by_feed.get(feed['id'], {}).get('posts', 0)
+            }
+            for feed in Feed.objects.filter(
+                subscription__user=user
+            ).values('id', 'name', 'slug')
+        ],
+        'today-posts-count': total('today'),
+        'read-posts-count': total('read'),
+        'unread-posts-count': total('unread'),
+        'readlater-posts-count': total('readlater'),
+        'favorite-posts-count': total('favorite')
+    }
+
+
+def get_sidebar_counters(user):
+
+    """
+    Return the cached counters of a user with their ETag
+
+    The today count changes at midnight of the user, cached counters
+    expire at the latest at the end of the day of the user.
+
+    :return: (counters, etag)
+    """
+
+    cached = cache.get(cache_key(user.id))
+
+    if cached is None:
+        today = today_range(user)
+        counters = compute_sidebar_counters(user, today)
+        etag = hashlib.md5(
+            json.dumps(counters, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+        cached = (counters, etag)
+        until_midnight = (today[1] - timezone.now()).total_seconds()
+        cache.set(
+            cache_key(user.id), cached,
+            max(1, min(settings.SIDEBAR_CACHE_TIMEOUT, int(until_midnight)))
+        )
+
+    return cached
+
+
+def invalidate_sidebar_counters(user_ids):
+
+    """
+    Drop cached counters after posts were ingested or a state changed
+    """
+
+    cache.delete_many([cache_key(user_id) for user_id in user_ids])
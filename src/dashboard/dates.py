@@ -0,0 +1,46 @@
+"""
+Day boundaries in the timezone of a user
+"""
+
+from datetime import datetime, time, timedelta
+import pytz
+from django.conf import settings
+from django.utils import timezone
+from .models import Profile
+
+
+def user_timezone(user):
+
+    """
+    Timezone chosen by the user, the site timezone by default
+    """
+
+    name = Profile.objects.filter(user=user).values_list('timezone', flat=True).first()
+
+    return pytz.timezone(name or settings.TIME_ZONE)
+
+
+def local_day_range(tz, now=None):
+
+    """
+    Half-open range [start, end) of the current day in a timezone
+
+    Bounds are aware datetimes, so filtering on published_date__gte=start
+    and published_date__lt=end can use an index on published_date.
+    """
+
+    today = (now or timezone.now()).astimezone(tz).date()
+
+    start = tz.localize(datetime.combine(today, time()))
+    end = tz.localize(datetime.combine(today + timedelta(days=1), time()))
+
+    return start, end
+
+
+def today_range(user, now=None):
+
+    """
+    Half-open range of the current day of a user
+    """
+
+    return local_day_range(user_timezone(user), now)
@@ -0,0 +1,19 @@
+"""
+Query expressions missing from Django 2.0
+"""
+
+from django.db.models.expressions import RawSQL
+
+
+class RawSubquery(RawSQL):
+
+    """
+    Raw SQL subquery of ids, used by an id__in filter
+
+    The in lookup already wraps its subquery in parentheses, RawSQL adding
+    its own makes SQLite read a scalar subquery returning one row and
+    PostgreSQL reject the rows after the first.
+    """
+
+    def as_sql(self, compiler, connection):
+        return self.sql, self.params
@@ -0,0 +1,13 @@
+from django import forms
+from .models import Profile
+
+
+class ProfileForm(forms.ModelForm):
+
+    """
+        Preferences of a user
+    """
+
+    class Meta:
+        model = Profile
+        fields = ['timezone']
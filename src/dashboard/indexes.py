@@ -0,0 +1,119 @@
+"""
+Indexes the model Meta options cannot describe
+
+Partial indexes are not supported by Index before Django 2.2, and
+trigram and pattern indexes are specific to PostgreSQL. They are created
+after each migration of the dashboard instead, concurrently on
+PostgreSQL.
+"""
+
+import logging
+from django.db import DatabaseError, connections, transaction
+from .models import Comment, Feed, Keyword, Post
+
+# (name, model, columns, condition)
+PARTIAL_INDEXES = [
+    ('dashboard_comment_root_idx', Comment, ['post_id'], 'parent_id IS NULL'),
+    ('dashboard_post_unsanitized_idx', Post, ['id'], 'NOT sanitized'),
+]
+
+# (name, model, expression) indexed for LIKE patterns on PostgreSQL:
+# icontains and istartswith compare UPPER(column), keywords are matched
+# by prefix and the counter is included for index only scans of
+# suggestions. Feed names are matched by prefix for terms too short for
+# trigrams.
+POSTGRESQL_PATTERN_INDEXES = [
+    ('dashboard_keyword_name_prefix_idx', Keyword, 'btree (name varchar_pattern_ops, feeds_count)'),
+    ('dashboard_feed_name_prefix_idx', Feed, 'btree (UPPER(name) text_pattern_ops)'),
+]
+
+# Same, requiring the pg_trgm extension: feed names match anywhere
+POSTGRESQL_TRIGRAM_INDEXES = [
+    ('dashboard_feed_name_trgm_idx', Feed, 'gin (UPPER(name) gin_trgm_ops)'),
+]
+
+logger = logging.getLogger(__name__)
+
+
+def tables_exist(connection, *models):
+
+    """
+    Whether the tables of models exist, migrations are generated at deploy
+    time so a database can be migrated before they were made
+    """
+
+    tables = connection.introspection.table_names()
+
+    return all(model._meta.db_table in tables for model in models)
+
+
+def create_index(connection, name, model, definition):
+
+    """
+    Create an index unless it exists
+
+    On PostgreSQL, outside of a transaction, the index is built
+    concurrently so that writes to large tables are not locked during
+    deployments. A concurrent build which failed leaves an invalid index,
+    dropped to be built again.
+
+    :param definition: Method, columns and condition of the index
+    """
+
+    quote = connection.ops.quote_name
+    concurrently = connection.vendor == 'postgresql' and not connection.in_atomic_block
+
+    with connection.cursor() as cursor:
+        if concurrently:
+            cursor.execute(
+                "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+                "WHERE pg_class.relname = %s AND NOT pg_index.indisvalid", [name]
+            )
+            if cursor.fetchone():
+                cursor.execute("DROP INDEX CONCURRENTLY {}".format(quote(name)))
+
+        cursor.execute("CREATE INDEX {}IF NOT EXISTS {} ON {} {}".format(
+            "CONCURRENTLY " if concurrently else "", quote(name),
+            quote(model._meta.db_table), definition
+        ))
+
+
+def create_partial_indexes(sender, using='default', **kwargs):
+
+    """
+    Create the missing partial indexes on the migrated database
+    """
+
+    connection = connections[using]
+    if not tables_exist(connection, *(index[1] for index in PARTIAL_INDEXES)):
+        return
+
+    quote = connection.ops.quote_name
+
+    for name, model, columns, condition in PARTIAL_INDEXES:
+        create_index(connection, name, model, "({}) WHERE {}".format(
+            ", ".join(quote(column) for column in columns), condition
+        ))
+
+
+def create_pattern_indexes(sender, using='default', **kwargs):
+
+    """
+    Create the trigram and prefix indexes used by feed discovery
+    """
+
+    connection = connections[using]
+    if connection.vendor != 'postgresql' or not tables_exist(connection, Feed, Keyword):
+        return
+
+    indexes = list(POSTGRESQL_PATTERN_INDEXES)
+
+    try:
+        with transaction.atomic(using=using), connection.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        indexes += POSTGRESQL_TRIGRAM_INDEXES
+    except DatabaseError as error:
+        logger.warning("Trigram indexes are not created: %s", error)
+
+    for name, model, expression in indexes:
+        create_index(connection, name, model, "USING {}".format(expression))
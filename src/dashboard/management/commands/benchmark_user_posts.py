@@ -0,0 +1,111 @@
+"""
+Compare materialized user posts with watermark based states
+"""
+
+import random
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from dashboard.models import Feed, Post, Subscription, UserPost
+from dashboard.services import create_user_posts
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Build a synthetic data set in a rolled back transaction and compare "
+        "the user post table size and the unread query latency of both state models"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--feeds', type=int, default=10)
+        parser.add_argument('--posts', type=int, default=200, help="Posts per feed")
+        parser.add_argument(
+            '--marked', type=float, default=0.05,
+            help="Ratio of posts marked read, favorite or read later"
+        )
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self.benchmark(options)
+                raise Rollback()
+        except Rollback:
+            pass
+
+    def benchmark(self, options):
+
+        User.objects.bulk_create([
+            User(username="benchmark-{}".format(i)) for i in range(options['users'])
+        ])
+        users = list(User.objects.filter(username__startswith="benchmark-"))
+
+        Feed.objects.bulk_create([
+            Feed(name="Benchmark {}".format(i), slug="benchmark-{}".format(i), url="http://upidev.fr")
+            for i in range(options['feeds'])
+        ])
+        feeds = list(Feed.objects.filter(slug__startswith="benchmark-"))
+
+        Post.objects.bulk_create([
+            Post(name=str(i), slug=str(i), content="", feed=feed, url="http://upidev.fr")
+            for feed in feeds for i in range(options['posts'])
+        ])
+        post_ids = list(Post.objects.filter(feed__in=feeds).values_list('id', flat=True))
+
+        Subscription.objects.bulk_create([
+            Subscription(user=user, feed=feed) for user in users for feed in feeds
+        ])
+
+        states = [UserPost.READ, UserPost.FAVORITE, UserPost.READLATER]
+        sample_size = int(len(post_ids) * options['marked'])
+        UserPost.objects.bulk_create([
+            UserPost(user=user, post_id=post_id, state=random.choice(states))
+            for user in users for post_id in random.sample(post_ids, sample_size)
+        ])
+
+        self.report("watermark", users, options['repeat'], lambda user: Post.objects.for_user(
+            user, UserPost.UNREAD
+        ))
+
+        create_user_posts(Post.objects.filter(feed__in=feeds), User.objects.filter(id__in=[
+            user.id for user in users
+        ]))
+
+        self.report("materialized", users, options['repeat'], lambda user: Post.objects.filter(
+            userpost__user=user, userpost__state=UserPost.UNREAD
+        ))
+
+    def report(self, name, users, repeat, unread_posts):
+
+        rows = UserPost.objects.count()
+
+        size = "n/a"
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE")
+                # Size of live rows, rolled back runs leave dead ones behind
+                cursor.execute(
+                    "SELECT pg_size_pretty(SUM(pg_column_size(t.*))) FROM {} t".format(
+                        connection.ops.quote_name(UserPost._meta.db_table)
+                    )
+                )
+                size = cursor.fetchone()[0]
+
+        started = time.perf_counter()
+        for user in random.sample(users, min(repeat, len(users))):
+            unread_posts(user).count()
+            list(unread_posts(user)[:20])
+        latency = (time.perf_counter() - started) * 1000 / min(repeat, len(users))
+
+        self.stdout.write(
+            "{:<13} rows: {:>9}  size: {:>8}  unread count + first page: {:.2f} ms".format(
+                name, rows, size, latency
+            )
+        )
@@ -0,0 +1,148 @@
+"""
+Check that the queries of the views are served by indexes
+"""
+
+import json
+import pytz
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from dashboard.counters import feed_counts
+from dashboard.dates import local_day_range
+from dashboard.models import Comment, Feed, Post, Subscription, UserPost
+from dashboard.pagination import KeysetPaginator, older_than
+from dashboard.search import search_posts
+from dashboard.views.discover import listed_feeds
+
+LARGE_TABLES = [
+    model._meta.db_table for model in (Feed, Subscription, Post, UserPost, Comment)
+]
+
+
+def view_queries(user_id, feed_slug, post_slug):
+
+    """
+    Query shapes run by the dashboard views, by name
+    """
+
+    feed = Feed.objects.filter(slug=feed_slug).values('id')
+    post = Post.objects.filter(feed__slug=feed_slug, slug=post_slug).values('id')
+    start, end = local_day_range(pytz.utc)
+
+    return [
+        ('feed by slug', Feed.objects.filter(slug=feed_slug)),
+        ('subscribed feed', Feed.objects.filter(subscription__user=user_id, slug=feed_slug)),
+        ('subscription', Subscription.objects.filter(user=user_id, feed__in=feed)),
+        ('feed posts', Post.objects.filter(feed__slug=feed_slug).order_by(
+            '-published_date', '-id'
+        )[:10]),
+        ('feed posts after a cursor', KeysetPaginator(
+            Post.objects.filter(feed__slug=feed_slug).for_list(), 10
+        ).queryset.filter(older_than((timezone.now(), 0)))[:11]),
+        ('post', Post.objects.for_user(user_id).filter(feed__in=feed, slug=post_slug)),
+        ('unread posts', Post.objects.for_user(user_id, UserPost.UNREAD)[:10]),
+        ('today posts', Post.objects.for_user(user_id, UserPost.UNREAD).filter(
+            published_date__gte=start, published_date__lt=end
+        )[:10]),
+        ('favorite posts', Post.objects.for_user(user_id, UserPost.FAVORITE)[:10]),
+        ('user post', UserPost.objects.filter(user=user_id, post__in=post)),
+        ('root comments', Comment.objects.filter(post__in=post, parent__isnull=True)),
+        ('comment tree', Comment.objects.filter(post__in=post).select_related('user')),
+        ('search', search_posts(Post.objects.for_user(user_id), 'python')[:10]),
+        ('discover feeds', listed_feeds(Feed.objects.all(), user_id)[:10]),
+        ('sidebar counters', feed_counts(user_id, (start, end))),
+    ]
+
+
+def postgresql_seq_scans(cursor, sql, params):
+
+    """
+    Tables read by a sequential scan in the PostgreSQL plan of a query
+
+    Sequential scans are disabled for the planner so that one is only
+    chosen when no index can serve the query, whatever the table size.
+    """
+
+    cursor.execute("SET LOCAL enable_seqscan = off")
+    cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    tables = []
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if node['Node Type'] == 'Seq Scan':
+            tables.append(node['Relation Name'])
+        nodes.extend(node.get('Plans', []))
+    return tables
+
+
+def sqlite_seq_scans(cursor, sql, params):
+
+    """
+    Tables read by a full scan in the SQLite plan of a query
+    """
+
+    cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+
+    tables = []
+    for row in cursor.fetchall():
+        words = row[-1].split()
+        if words[0] == 'SCAN' and 'INDEX' not in words:
+            # "SCAN TABLE name" before SQLite 3.36, "SCAN name" after
+            tables.append(words[2] if words[1] == 'TABLE' else words[1])
+    return tables
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Run EXPLAIN on the queries of the views and fail if one of them "
+        "reads a large table with a sequential scan"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help="Id of the user running the queries")
+        parser.add_argument('--feed', default='python-planet', help="Slug of a feed")
+        parser.add_argument('--post', default='python-2-7-countdown', help="Slug of a post")
+
+    def handle(self, *args, **options):
+
+        if connection.vendor == 'postgresql':
+            seq_scans = postgresql_seq_scans
+        elif connection.vendor == 'sqlite':
+            seq_scans = sqlite_seq_scans
+        else:
+            raise CommandError("Unsupported database: {}".format(connection.vendor))
+
+        user_id = options['user']
+        if user_id is None:
+            user_id = User.objects.order_by('id').values_list('id', flat=True).first() or 0
+
+        failures = []
+        for name, queryset in view_queries(user_id, options['feed'], options['post']):
+            sql, params = queryset.query.get_compiler(connection=connection).as_sql()
+
+            with transaction.atomic(), connection.cursor() as cursor:
+                tables = [
+                    table for table in seq_scans(cursor, sql, params)
+                    if table in LARGE_TABLES
+                ]
+
+            if tables:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(
+                    "{}: sequential scan on {}".format(name, ", ".join(tables))
+                ))
+            else:
+                self.stdout.write("{}: ok".format(name))
+
+        if failures:
+            raise CommandError(
+                "Sequential scans in {} queries: {}".format(len(failures), ", ".join(failures))
+            )
+
+        self.stdout.write(self.style.SUCCESS("All queries use indexes"))
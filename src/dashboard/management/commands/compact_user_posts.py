@@ -0,0 +1,47 @@
+"""
+Migrate materialized user posts to the watermark based state model
+"""
+
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from dashboard.models import UserPost
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Delete user posts storing the default state of a post, "
+        "which is now derived from the subscription read watermark"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+
+        # Conditions on the subscription must share a single join
+        default_states = [
+            UserPost.objects.filter(
+                post__feed__subscription__user=F('user'),
+                state=UserPost.UNREAD,
+                post__id__gt=F('post__feed__subscription__read_watermark')
+            ),
+            UserPost.objects.filter(
+                post__feed__subscription__user=F('user'),
+                state=UserPost.READ,
+                post__id__lte=F('post__feed__subscription__read_watermark')
+            ),
+        ]
+
+        deleted = 0
+        for userposts in default_states:
+            while True:
+                ids = list(userposts.values_list('id', flat=True)[:options['batch_size']])
+                if not ids:
+                    break
+                deleted += UserPost.objects.filter(id__in=ids).delete()[0]
+                self.stdout.write("{} user posts deleted".format(deleted))
+
+        self.stdout.write(self.style.SUCCESS(
+            "Done, {} user posts left".format(UserPost.objects.count())
+        ))
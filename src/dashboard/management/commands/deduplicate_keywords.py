@@ -0,0 +1,69 @@
+"""
+Merge keywords having the same normalized name
+"""
+
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from dashboard.models import Feed, Keyword
+from dashboard.services import refresh_keyword_counts
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Merge keywords with the same normalized name into the oldest one, "
+        "before keyword names are made unique, then count their feeds"
+    )
+
+    def handle(self, *args, **options):
+
+        if Keyword._meta.db_table not in connection.introspection.table_names():
+            self.stdout.write("Nothing to deduplicate before the first migration")
+            return
+
+        FeedKeyword = Feed.keywords.through
+
+        with transaction.atomic():
+            # Only id and name are read, the counter may not be migrated yet
+            ids_by_name = defaultdict(list)
+            for keyword_id, name in Keyword.objects.order_by('id').values_list('id', 'name'):
+                ids_by_name[Keyword.normalize(name)].append(keyword_id)
+
+            merged = 0
+            for name, ids in ids_by_name.items():
+                keep, duplicates = ids[0], ids[1:]
+
+                if duplicates:
+                    linked = set(
+                        FeedKeyword.objects.filter(keyword_id=keep).values_list('feed_id', flat=True)
+                    )
+                    feed_ids = set(
+                        FeedKeyword.objects.filter(keyword_id__in=duplicates)
+                        .values_list('feed_id', flat=True)
+                    )
+                    FeedKeyword.objects.bulk_create([
+                        FeedKeyword(feed_id=feed_id, keyword_id=keep)
+                        for feed_id in feed_ids - linked
+                    ])
+                    FeedKeyword.objects.filter(keyword_id__in=duplicates).delete()
+                    Keyword.objects.filter(id__in=duplicates).only('id').delete()
+                    merged += len(duplicates)
+
+                Keyword.objects.filter(id=keep).exclude(name=name).update(name=name)
+
+        self.stdout.write("{} duplicate keywords merged".format(merged))
+
+        with connection.cursor() as cursor:
+            columns = [
+                column.name for column in
+                connection.introspection.get_table_description(cursor, Keyword._meta.db_table)
+            ]
+
+        if 'feeds_count' in columns:
+            refresh_keyword_counts()
+            self.stdout.write(self.style.SUCCESS("Feeds of keywords counted"))
+        else:
+            self.stdout.write(self.style.WARNING(
+                "Run this command again after migrating to count feeds of keywords"
+            ))
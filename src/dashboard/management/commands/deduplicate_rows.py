@@ -0,0 +1,96 @@
+"""
+Remove the duplicates rejected by the unique constraints of the dashboard
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Max, Min
+from dashboard.models import Feed, Post, Subscription, UserPost
+
+
+def duplicate_groups(model, fields, keep):
+
+    """
+    Rows sharing the same values of fields, with the id of the row to keep
+
+    Only the fields and the ids are read, columns added by migrations
+    which did not run yet are never selected.
+
+    :param keep: Min or Max, the aggregate choosing the row to keep
+    :return: List of (values, kept id)
+    """
+
+    return [
+        (tuple(group[field] for field in fields), group['keep'])
+        for group in model.objects.order_by().values(*fields).annotate(
+            count=Count('id'), keep=keep('id')
+        ).filter(count__gt=1)
+    ]
+
+
+def rename_duplicate_slugs(model, fields, max_length):
+
+    """
+    Suffix the slugs of duplicates with their id, the oldest row keeps its slug
+
+    :param fields: Fields unique together, the slug last
+    :return: Number of renamed rows
+    """
+
+    renamed = 0
+
+    for values, keep in duplicate_groups(model, fields, Min):
+        rows = model.objects.filter(**dict(zip(fields, values))).exclude(id=keep)
+        for row_id, slug in rows.values_list('id', 'slug'):
+            suffix = "-{}".format(row_id)
+            model.objects.filter(id=row_id).update(slug=slug[:max_length - len(suffix)] + suffix)
+            renamed += 1
+
+    return renamed
+
+
+def delete_duplicates(model, fields, keep):
+
+    """
+    Delete the duplicates of rows sharing the same values of fields
+
+    :return: Number of deleted rows
+    """
+
+    deleted = 0
+
+    for values, kept_id in duplicate_groups(model, fields, keep):
+        deleted += model.objects.filter(
+            **dict(zip(fields, values))
+        ).exclude(id=kept_id).only('id').delete()[0]
+
+    return deleted
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Rename duplicate slugs of feeds and posts, and delete duplicate "
+        "subscriptions and user posts, before migrating to unique constraints"
+    )
+
+    def handle(self, *args, **options):
+
+        tables = connection.introspection.table_names()
+        if Feed._meta.db_table not in tables:
+            self.stdout.write("Nothing to deduplicate before the first migration")
+            return
+
+        with transaction.atomic():
+            feeds = rename_duplicate_slugs(Feed, ['slug'], Feed._meta.get_field('slug').max_length)
+            posts = rename_duplicate_slugs(
+                Post, ['feed_id', 'slug'], Post._meta.get_field('slug').max_length
+            )
+            # The oldest subscription and the latest state of a post are kept
+            subscriptions = delete_duplicates(Subscription, ['user_id', 'feed_id'], Min)
+            user_posts = delete_duplicates(UserPost, ['user_id', 'post_id'], Max)
+
+        self.stdout.write(self.style.SUCCESS(
+            "Renamed {} feed slugs and {} post slugs, deleted {} subscriptions "
+            "and {} user posts".format(feeds, posts, subscriptions, user_posts)
+        ))
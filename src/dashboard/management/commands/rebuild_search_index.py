@@ -0,0 +1,23 @@
+"""
+Index posts created before the search triggers
+"""
+
+from django.core.management.base import BaseCommand
+from dashboard.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+
+    help = "Fill the full-text search index with posts created before its triggers"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+
+        indexed = rebuild_search_index(options['batch_size'])
+
+        if indexed is None:
+            self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
+        else:
+            self.stdout.write(self.style.SUCCESS("{} posts indexed".format(indexed)))
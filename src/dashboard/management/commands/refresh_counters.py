@@ -0,0 +1,18 @@
+"""
+Recount the cached counters of feeds and keywords
+"""
+
+from django.core.management.base import BaseCommand
+from dashboard.services import refresh_keyword_counts, refresh_subscriber_counts
+
+
+class Command(BaseCommand):
+
+    help = "Recount the subscribers of every feed and the feeds of every keyword"
+
+    def handle(self, *args, **options):
+
+        refresh_subscriber_counts()
+        refresh_keyword_counts()
+
+        self.stdout.write(self.style.SUCCESS("Counters refreshed"))
@@ -0,0 +1,58 @@
+"""
+Sanitize posts ingested before their content was sanitized
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from dashboard.models import Post
+from dashboard.sanitize import sanitize
+
+
+class Command(BaseCommand):
+
+    help = (
+        "Sanitize the content and extract the summary of posts ingested "
+        "before contents were sanitized, run it before serving them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        # Served by a partial index, cheap enough for every deployment
+        parser.add_argument(
+            '--unsanitized', action='store_true',
+            help="Only sanitize posts not marked as sanitized"
+        )
+
+    def handle(self, *args, **options):
+
+        last_id, updated = 0, 0
+
+        posts_to_sanitize = Post.objects.all()
+        if options['unsanitized']:
+            posts_to_sanitize = posts_to_sanitize.filter(sanitized=False)
+
+        while True:
+            posts = list(
+                posts_to_sanitize.filter(id__gt=last_id).order_by('id')
+                .values_list('id', 'content', 'summary', 'sanitized')[:options['batch_size']]
+            )
+            if not posts:
+                break
+
+            with transaction.atomic():
+                unchanged = []
+                for post_id, content, summary, marked in posts:
+                    sanitized = sanitize(content)
+                    if sanitized != (content, summary):
+                        Post.objects.filter(id=post_id).update(
+                            content=sanitized[0], summary=sanitized[1], sanitized=True
+                        )
+                        updated += 1
+                    elif not marked:
+                        unchanged.append(post_id)
+                Post.objects.filter(id__in=unchanged).update(sanitized=True)
+
+            last_id = posts[-1][0]
+            self.stdout.write("{} posts sanitized".format(updated))
+
+        self.stdout.write(self.style.SUCCESS("Done, {} posts sanitized".format(updated)))
@@ -1,19 +1,36 @@
+import pytz
+from django.conf import settings
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import Case, F, FilteredRelation, Q, Value, When
 from django.contrib.auth.models import User
+from django.core.validators import MinValueValidator
+from django.utils import timezone
+from django.utils.text import slugify
 from django.utils.translation import ugettext_lazy as _
 
 
 class Keyword(models.Model):
 
-    name = models.CharField(max_length=100, verbose_name=_("Name"))
+    """
+        Keywords are shared by feeds, their name is normalized by
+        Keyword.normalize and counts the feeds using it
+    """
+
+    name = models.CharField(max_length=100, unique=True, verbose_name=_("Name"))
+    feeds_count = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.name
 
+    @staticmethod
+    def normalize(name):
+        return slugify(name)[:100]
+
 
 class Feed(models.Model):
     name = models.CharField(max_length=60, verbose_name=_("Name"))
-    slug = models.CharField(max_length=60, verbose_name=_("Slug"))
+    slug = models.CharField(max_length=60, unique=True, verbose_name=_("Slug"))
     keywords = models.ManyToManyField(Keyword, default=[])
     DAILY = 'everyday'
     WEEKLY = 'everyweek'
@@ -28,34 +45,159 @@ class Feed(models.Model):
     )
     url = models.URLField()
 
+    # Number of users following the feed, see services.refresh_subscriber_counts
+    subscribers_count = models.PositiveIntegerField(default=0)
+
+    # HTTP validators and hash of the last downloaded document
+    etag = models.CharField(max_length=255, blank=True, default='')
+    last_modified = models.CharField(max_length=64, blank=True, default='')
+    content_hash = models.CharField(max_length=40, blank=True, default='')
+
+    # Lease taken by the worker synchronizing the feed
+    sync_lock = models.CharField(max_length=32, blank=True, default='')
+    sync_locked_until = models.DateTimeField(null=True, blank=True)
+
+    # Schedule of the next download, learned from the entries of the feed
+    next_fetch_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    post_interval = models.PositiveIntegerField(null=True, blank=True)
+    fetch_failures = models.PositiveSmallIntegerField(default=0)
+
+    # Days posts are kept after their publication, POST_RETENTION_DAYS
+    # when empty, see services.prune_posts
+    retention_days = models.PositiveIntegerField(
+        null=True, blank=True, validators=[MinValueValidator(1)]
+    )
+
     def __str__(self):
         return self.name
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["-subscribers_count", "id"]),
+        ]
+
+
+class Profile(models.Model):
+
+    """
+        Preferences of a user
+    """
+
+    TIMEZONE_CHOICES = [(name, name) for name in pytz.common_timezones]
+
+    user = models.OneToOneField(User, on_delete=models.CASCADE)
+    timezone = models.CharField(
+        max_length=64, choices=TIMEZONE_CHOICES, default=settings.TIME_ZONE
+    )
+
+    def __str__(self):
+        return "{} - {}".format(self.user.username, self.timezone)
+
 
 class Subscription(models.Model):
+
+    """
+        Posts of the feed with an id up to the read watermark are read,
+        newer posts are unread, unless a user post says otherwise
+    """
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     feed = models.ForeignKey(Feed, on_delete=models.CASCADE)
+    read_watermark = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return "{} - {}".format(self.user.username, self.feed.name)
 
+    class Meta:
+        unique_together = ("user", "feed")
+
+
+class PostQuerySet(models.QuerySet):
+
+    def for_user(self, user, state=None):
+
+        """
+        Posts of the feeds followed by a user, annotated with their state
+
+        Only states differing from the default one are stored as user
+        posts. Without a user post, a post is unread if its id is above
+        the read watermark of the subscription and read otherwise.
+
+        :param user: Subscriber
+        :param state: Only return posts in this state
+        """
+
+        posts = self.filter(feed__subscription__user=user).annotate(
+            read_watermark=F('feed__subscription__read_watermark'),
+            user_state=FilteredRelation('userpost', condition=Q(userpost__user=user))
+        ).annotate(
+            state=Case(
+                When(user_state__isnull=False, then=F('user_state__state')),
+                When(id__gt=F('read_watermark'), then=Value(UserPost.UNREAD)),
+                default=Value(UserPost.READ),
+                output_field=models.CharField()
+            )
+        )
+
+        if state in (UserPost.UNREAD, UserPost.READ):
+            posts = posts.filter(state=state)
+        elif state is not None:
+            # Stored states are found through the (user, state) user posts
+            posts = posts.filter(userpost__user=user, userpost__state=state)
+
+        return posts
+
+    def for_list(self):
+
+        """
+        Posts without the columns only needed to display a single post
+        """
+
+        return self.defer('content', 'search_vector')
+
 
 class Post(models.Model):
     name = models.CharField(max_length=200, verbose_name=_("Name"))
     slug = models.CharField(max_length=200, verbose_name=_("Slug"))
+    # Sanitized HTML body and plain text summary, see dashboard.sanitize,
+    # posts ingested before contents were sanitized are not marked
     content = models.TextField()
-    published_date = models.DateTimeField(auto_now_add=True)
+    summary = models.CharField(max_length=200, blank=True, default='')
+    sanitized = models.BooleanField(default=False)
+    # Publication date of the entry, see rsscatcher.tasks.entry_published_date
+    published_date = models.DateTimeField(default=timezone.now)
     feed = models.ForeignKey(Feed, on_delete=models.CASCADE)
     url = models.URLField()
 
+    # Identifier of the entry in the feed and hash of its stored fields,
+    # posts created before entries were identified have no guid
+    guid = models.CharField(max_length=255, null=True, blank=True)
+    content_hash = models.CharField(max_length=40, blank=True, default='')
+
+    # Filled by a database trigger, see dashboard.search
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = PostQuerySet.as_manager()
+
     def __str__(self):
         return "{} - {}".format(self.name, self.feed.name)
 
     class Meta:
         ordering = ["-id"]
+        unique_together = (("feed", "slug"), ("feed", "guid"))
+        indexes = [
+            models.Index(fields=["feed", "-published_date", "-id"]),
+            models.Index(fields=["-published_date", "-id"]),
+        ]
 
 
 class UserPost(models.Model):
+
+    """
+        State of a post for a user, only stored when it differs from
+        the default state given by the subscription read watermark
+    """
+
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     post = models.ForeignKey(Post, on_delete=models.CASCADE)
     READ = 'read'
@@ -75,6 +217,10 @@ class UserPost(models.Model):
     def __str__(self):
         return "{} - {}".format(self.user.username, self.post.name)
 
+    class Meta:
+        unique_together = ("user", "post")
+        indexes = [models.Index(fields=["user", "state"])]
+
 
 class Comment(models.Model):
 
@@ -91,5 +237,8 @@ class Comment(models.Model):
     )
     created_date = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=["post", "parent"])]
+
     def __str__(self):
         return "{} - {}".format(self.user.username, self.content)
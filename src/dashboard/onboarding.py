@@ -0,0 +1,107 @@
+"""
+Onboarding of feeds for unknown urls
+
+The feed is downloaded and created by a celery task while the page polls
+its status. The status of a url is kept in the cache: a pending status
+coalesces concurrent requests for the same url into a single download,
+and urls which are not feeds are remembered for a while.
+"""
+
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError
+from django.utils.text import slugify
+from .models import Feed
+
+PENDING = 'pending'
+READY = 'ready'
+INVALID = 'invalid'
+UNKNOWN = 'unknown'
+
+
+def onboarding_key(url):
+    return "feed-onboarding-{}".format(hashlib.md5(url.encode('utf-8')).hexdigest())
+
+
+def get_onboarding_status(url):
+
+    """
+    Return the onboarding status of a url, as a dict with a status key
+    """
+
+    return cache.get(onboarding_key(url)) or {'status': UNKNOWN}
+
+
+def set_onboarding_status(url, status, **data):
+
+    """
+    Store the outcome of an onboarding, invalid urls are kept longer
+    """
+
+    timeout = {
+        PENDING: settings.ONBOARDING_PENDING_TIMEOUT,
+        READY: settings.ONBOARDING_READY_TIMEOUT,
+        INVALID: settings.ONBOARDING_INVALID_TIMEOUT,
+    }[status]
+
+    data['status'] = status
+    cache.set(onboarding_key(url), data, timeout)
+
+
+def start_onboarding(url):
+
+    """
+    Enqueue the onboarding of a url unless one is pending or known
+
+    :return: Status of the url
+    """
+
+    from rsscatcher.tasks import onboard_feed
+
+    pending = {'status': PENDING}
+    if cache.add(onboarding_key(url), pending, settings.ONBOARDING_PENDING_TIMEOUT):
+        onboard_feed.delay(url)
+
+    return get_onboarding_status(url)
+
+
+def unique_feed_slug(name):
+
+    """
+    Slug of a new feed, suffixed by a number if already taken
+    """
+
+    base = slugify(name)[:50] or 'feed'
+    taken = set(
+        Feed.objects.filter(slug__startswith=base).values_list('slug', flat=True)
+    )
+
+    slug, number = base, 1
+    while slug in taken:
+        number += 1
+        slug = "{}-{}".format(base, number)
+
+    return slug
+
+
+def get_or_create_feed(url, name, attempts=3, **fields):
+
+    """
+    Return the feed of a url, created with a unique slug if there is none
+
+    Another onboarding can take the slug between its lookup and the
+    insert, another slug is then looked up.
+
+    :param fields: Other fields of the created feed
+    :return: (feed, created)
+    """
+
+    for attempt in range(attempts):
+        try:
+            return Feed.objects.get_or_create(
+                url=url, defaults=dict(fields, name=name[:60], slug=unique_feed_slug(name))
+            )
+        except IntegrityError:
+            if attempt == attempts - 1:
+                raise
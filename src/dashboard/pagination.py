@@ -0,0 +1,293 @@
+"""
+Pagination of lists without COUNT(*)
+
+Post lists use a keyset pagination: pages are delimited by the
+(published_date, id) key of their first and last posts instead of an
+offset, so the cost of a page does not depend on its depth. The position
+in the list is carried by an opaque cursor in the query string.
+
+Shorter lists, such as the feed catalog, are paginated by page numbers
+without counting their rows.
+"""
+
+import base64
+import binascii
+import json
+from django.core.paginator import Page
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+NEXT = 'next'
+PREVIOUS = 'prev'
+
+
+def encode_cursor(post, direction):
+
+    """
+    Opaque token of the position after or before a post
+    """
+
+    data = json.dumps([post.published_date.isoformat(), post.id, direction])
+
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+
+    """
+    Return the (published_date, id) key and the direction of a cursor
+
+    :raise ValueError: If the token was not made by encode_cursor
+    """
+
+    try:
+        padding = '=' * (-len(token) % 4)
+        published, post_id, direction = json.loads(
+            base64.urlsafe_b64decode(token + padding).decode('utf-8')
+        )
+        published_date = parse_datetime(published)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as error:
+        raise ValueError("Invalid cursor: {}".format(error))
+
+    if published_date is None or not isinstance(post_id, int) or direction not in (NEXT, PREVIOUS):
+        raise ValueError("Invalid cursor")
+
+    return (published_date, post_id), direction
+
+
+def older_than(key):
+
+    """
+    Condition on posts listed after a key, newest posts coming first
+    """
+
+    published_date, post_id = key
+    after = Q(published_date__lt=published_date) | Q(published_date=published_date, id__lt=post_id)
+
+    # The redundant bound is where the index range scan starts, PostgreSQL
+    # cannot derive it from the OR alone
+    return Q(published_date__lte=published_date) & after
+
+
+def newer_than(key):
+
+    """
+    Condition on posts listed before a key, newest posts coming first
+    """
+
+    published_date, post_id = key
+    before = Q(published_date__gt=published_date) | Q(published_date=published_date, id__gt=post_id)
+
+    return Q(published_date__gte=published_date) & before
+
+
+class KeysetPage(Page):
+
+    """
+    Page of posts with the cursors of its neighbours
+    """
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None, number=None):
+        super().__init__(object_list, number, paginator)
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return '<Page of {} posts>'.format(len(self))
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+
+class KeysetPaginator(object):
+
+    """
+    Paginate a queryset of posts from the newest to the oldest
+
+    :param queryset: Posts to paginate
+    :param per_page: Number of posts on a page
+    """
+
+    ordering = ('-published_date', '-id')
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset.order_by(*self.ordering)
+        self.per_page = per_page
+
+    @cached_property
+    def estimated_count(self):
+
+        """
+        Number of posts estimated by the PostgreSQL planner
+
+        Return None on other databases, where there is no cheap estimate.
+        """
+
+        connection = connections[self.queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+
+        sql, params = self.queryset.query.get_compiler(connection=connection).as_sql()
+        with connection.cursor() as cursor:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        return plan[0]['Plan']['Plan Rows']
+
+    def page(self, cursor=None):
+
+        """
+        Return the page at a cursor, the first page without cursor
+        """
+
+        if cursor is None:
+            rows = list(self.queryset[:self.per_page + 1])
+            return self._build_page(rows[:self.per_page], len(rows) > self.per_page, False)
+
+        key, direction = decode_cursor(cursor)
+
+        if direction == NEXT:
+            rows = list(self.queryset.filter(older_than(key))[:self.per_page + 1])
+            return self._build_page(rows[:self.per_page], len(rows) > self.per_page, True)
+
+        rows = list(
+            self.queryset.filter(newer_than(key))
+            .order_by('published_date', 'id')[:self.per_page + 1]
+        )
+        rows.reverse()
+        return self._build_page(rows[-self.per_page:], True, len(rows) > self.per_page)
+
+    def page_number(self, number):
+
+        """
+        Return a page by its number, for links made before cursors
+
+        The page is found with an offset, following pages use cursors.
+        """
+
+        if number < 1:
+            raise ValueError("Page {} does not exist".format(number))
+
+        offset = (number - 1) * self.per_page
+        rows = list(self.queryset[offset:offset + self.per_page + 1])
+        if not rows and number > 1:
+            raise ValueError("Page {} is empty".format(number))
+
+        return self._build_page(rows[:self.per_page], len(rows) > self.per_page, number > 1)
+
+    def _build_page(self, rows, has_next, has_previous):
+
+        if not rows:
+            return KeysetPage([], self)
+
+        first, last = rows[0], rows[-1]
+
+        return KeysetPage(
+            rows, self,
+            next_cursor=encode_cursor(last, NEXT) if has_next else None,
+            previous_cursor=encode_cursor(first, PREVIOUS) if has_previous else None
+        )
+
+
+class KeysetPaginationMixin(object):
+
+    """
+    Paginate a ListView of posts with cursors
+
+    The cursor is read from the "cursor" parameter, the legacy "page"
+    parameter is still accepted.
+    """
+
+    def paginate_queryset(self, queryset, page_size):
+
+        paginator = KeysetPaginator(queryset, page_size)
+        cursor = self.request.GET.get('cursor')
+        number = self.request.GET.get('page')
+
+        try:
+            if cursor:
+                page = paginator.page(cursor)
+            elif number:
+                page = paginator.page_number(int(number))
+            else:
+                page = paginator.page()
+        except ValueError as error:
+            raise Http404(str(error))
+
+        return (paginator, page, page.object_list, page.has_other_pages())
+
+
+class UncountedPage(Page):
+
+    """
+    Page of a list whose length is unknown
+    """
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+
+class UncountedPaginator(object):
+
+    """
+    Paginate a queryset by page numbers without counting its rows
+
+    One more row than a page is read to know if a next page exists.
+
+    :param queryset: Ordered queryset to paginate
+    :param per_page: Number of objects on a page
+    """
+
+    estimated_count = None
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def page(self, number=1):
+
+        if number < 1:
+            raise ValueError("Page {} does not exist".format(number))
+
+        offset = (number - 1) * self.per_page
+        rows = list(self.queryset[offset:offset + self.per_page + 1])
+        if not rows and number > 1:
+            raise ValueError("Page {} is empty".format(number))
+
+        return UncountedPage(rows[:self.per_page], number, self, len(rows) > self.per_page)
+
+
+class UncountedPaginationMixin(object):
+
+    """
+    Paginate a ListView by page numbers without counting its rows
+    """
+
+    def paginate_queryset(self, queryset, page_size):
+
+        paginator = UncountedPaginator(queryset, page_size)
+
+        try:
+            page = paginator.page(int(self.request.GET.get('page') or 1))
+        except ValueError as error:
+            raise Http404(str(error))
+
+        return (paginator, page, page.object_list, page.has_other_pages())
@@ -0,0 +1,128 @@
+"""
+Sanitization of the HTML of feed entries
+
+Entries are sanitized once, when they are ingested: only an allowlist of
+tags and attributes is kept, links must be web urls and the content of
+scripts and styles is dropped, so the stored body can be rendered as is.
+A plain text summary is extracted in the same pass so that lists of
+posts never parse HTML.
+"""
+
+from html import escape
+from html.parser import HTMLParser
+from django.utils.text import Truncator
+
+SUMMARY_LENGTH = 200
+
+ALLOWED_TAGS = {
+    'a', 'abbr', 'b', 'blockquote', 'br', 'code', 'dd', 'del', 'div', 'dl', 'dt',
+    'em', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'hr', 'i', 'li', 'ol', 'p', 'pre',
+    'q', 's', 'small', 'span', 'strong', 'sub', 'sup', 'u', 'ul',
+}
+
+ALLOWED_ATTRIBUTES = {
+    'a': {'href', 'title'},
+    'abbr': {'title'},
+}
+
+VOID_TAGS = {'br', 'hr'}
+
+# Tags whose content is dropped with them
+DROPPED_TAGS = {'script', 'style', 'iframe', 'object', 'embed', 'noscript', 'template', 'title'}
+
+# Tags separating words in the summary
+BLOCK_TAGS = {
+    'blockquote', 'br', 'dd', 'div', 'dl', 'dt', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6',
+    'hr', 'li', 'ol', 'p', 'pre', 'td', 'th', 'tr', 'ul',
+}
+
+
+class Sanitizer(HTMLParser):
+
+    """
+    Rebuild allowed tags and escaped text while collecting plain text
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.body = []
+        self.text = []
+        self.open_tags = []
+        self.dropping = 0
+
+    def attributes(self, tag, attrs):
+        allowed = ALLOWED_ATTRIBUTES.get(tag, ())
+        result = []
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name == 'href' and not value.strip().lower().startswith(('http://', 'https://')):
+                continue
+            result.append(' {}="{}"'.format(name, escape(value.strip())))
+        if tag == 'a':
+            result.append(' rel="nofollow noopener" target="_blank"')
+        return ''.join(result)
+
+    def handle_starttag(self, tag, attrs):
+        if tag in DROPPED_TAGS:
+            self.dropping += 1
+            return
+        if self.dropping:
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append(' ')
+        if tag not in ALLOWED_TAGS:
+            return
+        self.body.append('<{}{}>'.format(tag, self.attributes(tag, attrs)))
+        if tag not in VOID_TAGS:
+            self.open_tags.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in DROPPED_TAGS:
+            self.dropping = max(self.dropping - 1, 0)
+            return
+        if self.dropping:
+            return
+        if tag in BLOCK_TAGS:
+            self.text.append(' ')
+        if tag not in self.open_tags:
+            return
+        # Tags left open inside the closed one are closed with it
+        while self.open_tags:
+            open_tag = self.open_tags.pop()
+            self.body.append('</{}>'.format(open_tag))
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self.dropping:
+            return
+        self.body.append(escape(data, quote=False))
+        self.text.append(data)
+
+    def close(self):
+        super().close()
+        while self.open_tags:
+            self.body.append('</{}>'.format(self.open_tags.pop()))
+
+
+def sanitize(html):
+
+    """
+    Sanitized HTML body and plain text summary of the HTML of an entry
+
+    :return: Tuple of the body and the summary
+    """
+
+    sanitizer = Sanitizer()
+    sanitizer.feed(html or '')
+    sanitizer.close()
+
+    text = ' '.join(''.join(sanitizer.text).split())
+
+    return ''.join(sanitizer.body), Truncator(text).chars(SUMMARY_LENGTH)
@@ -0,0 +1,168 @@
+"""
+Full-text search over post names and contents
+
+On PostgreSQL a trigger keeps a weighted tsvector of each post in the
+search_vector column, served by a GIN index. On SQLite, used by the
+tests, an external content FTS5 table is kept up to date by triggers.
+Both are created after each migration of the dashboard.
+"""
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F, FloatField
+from django.db.models.expressions import RawSQL
+from .expressions import RawSubquery
+from .indexes import create_index, tables_exist
+from .models import Post
+
+SEARCH_CONFIG = 'english'
+
+POSTGRESQL_SEARCH_SQL = [
+    """
+    CREATE OR REPLACE FUNCTION {table}_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{config}', coalesce(NEW.name, '')), 'A') ||
+            setweight(to_tsvector('{config}', coalesce(NEW.content, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    "DROP TRIGGER IF EXISTS {table}_search_vector ON {table}",
+    """
+    CREATE TRIGGER {table}_search_vector BEFORE INSERT OR UPDATE OF name, content
+    ON {table} FOR EACH ROW EXECUTE PROCEDURE {table}_search_vector_update()
+    """,
+]
+
+SQLITE_SEARCH_SQL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS {table}_fts
+    USING fts5(name, content, content='{table}', content_rowid='id')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN
+        INSERT INTO {table}_fts(rowid, name, content) VALUES (new.id, new.name, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN
+        INSERT INTO {table}_fts({table}_fts, rowid, name, content)
+        VALUES ('delete', old.id, old.name, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF name, content ON {table} BEGIN
+        INSERT INTO {table}_fts({table}_fts, rowid, name, content)
+        VALUES ('delete', old.id, old.name, old.content);
+        INSERT INTO {table}_fts(rowid, name, content) VALUES (new.id, new.name, new.content);
+    END
+    """,
+]
+
+
+def create_search_index(sender, using='default', **kwargs):
+
+    """
+    Create the search triggers and index on the migrated database
+    """
+
+    connection = connections[using]
+    if not tables_exist(connection, Post):
+        return
+
+    if connection.vendor == 'postgresql':
+        statements = POSTGRESQL_SEARCH_SQL
+    elif connection.vendor == 'sqlite':
+        statements = SQLITE_SEARCH_SQL
+    else:
+        return
+
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement.format(table=Post._meta.db_table, config=SEARCH_CONFIG))
+
+    if connection.vendor == 'postgresql':
+        create_index(
+            connection, '{}_search_idx'.format(Post._meta.db_table), Post, "USING gin (search_vector)"
+        )
+
+
+def fts5_query(terms):
+
+    """
+    FTS5 query matching posts containing every word of the terms
+
+    Each word is quoted so that the FTS5 syntax is never interpreted.
+    """
+
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in terms.split())
+
+
+def search_posts(posts, terms, limit=None):
+
+    """
+    Posts matching the search terms, the most relevant first
+
+    :param posts: Queryset of posts to search in
+    :param terms: Words typed by the user
+    :param limit: Only rank this number of the newest matching posts, so
+                  that common words do not rank the whole table
+    """
+
+    connection = connections[posts.db]
+    table = Post._meta.db_table
+
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(terms, config=SEARCH_CONFIG)
+        matches = posts.filter(search_vector=query)
+        rank = SearchRank(F('search_vector'), query)
+    else:
+        match = fts5_query(terms)
+        if not match:
+            return posts.none()
+        # Matches are selected by an uncorrelated subquery, which stays right
+        # when Django aliases the table inside the limit subquery
+        matches = posts.filter(id__in=RawSubquery(
+            "SELECT rowid FROM {0}_fts WHERE {0}_fts MATCH %s".format(table), [match]
+        ))
+        # Only the outer query ranks, bm25 is lower for better matches
+        rank = RawSQL(
+            "SELECT -bm25({0}_fts) FROM {0}_fts WHERE {0}_fts MATCH %s "
+            "AND {0}_fts.rowid = {0}.id".format(table), [match], output_field=FloatField()
+        )
+
+    if limit is not None:
+        newest = matches.order_by('-id').values('id')[:limit]
+        matches = posts.filter(id__in=newest)
+
+    return matches.annotate(rank=rank).order_by('-rank', '-id')
+
+
+def rebuild_search_index(batch_size=10000):
+
+    """
+    Index posts created before the search triggers
+
+    :return: Number of posts indexed, None when the index was rebuilt at once
+    """
+
+    connection = connections[Post.objects.db]
+    table = Post._meta.db_table
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute("INSERT INTO {0}_fts({0}_fts) VALUES ('rebuild')".format(table))
+            return None
+
+        indexed = 0
+        while True:
+            # Touching the name fires the trigger filling search_vector
+            cursor.execute(
+                "UPDATE {0} SET name = name WHERE id IN "
+                "(SELECT id FROM {0} WHERE search_vector IS NULL LIMIT %s)".format(table),
+                [batch_size]
+            )
+            if not cursor.rowcount:
+                return indexed
+            indexed += cursor.rowcount
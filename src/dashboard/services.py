@@ -0,0 +1,516 @@
+"""
+Set-based write operations shared by views and celery tasks
+"""
+
+import logging
+from datetime import timedelta
+from itertools import islice, product
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count, Exists, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+from .counters import invalidate_sidebar_counters
+from .models import Comment, Feed, Keyword, Post, Subscription, UserPost
+
+logger = logging.getLogger(__name__)
+
+
+def bulk_create_ignoring_duplicates(model, objs, batch_size=None):
+
+    """
+    Insert objects in bulk, skipping rows rejected by a unique constraint
+
+    The whole batch is inserted in a savepoint. If another worker inserted
+    one of the rows first, the batch is rolled back and the objects are
+    inserted one by one so only the duplicates are dropped.
+
+    :param model: Model class of the objects
+    :param objs: Unsaved instances
+    :param batch_size: Number of rows per INSERT, defaults to the
+        largest batch supported by the database
+    :return: Number of inserted objects
+    """
+
+    if not objs:
+        return 0
+
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(objs, batch_size=batch_size)
+        return len(objs)
+    except IntegrityError:
+        inserted = 0
+        for obj in objs:
+            obj.pk = None
+            try:
+                with transaction.atomic():
+                    obj.save(force_insert=True)
+                inserted += 1
+            except IntegrityError:
+                pass
+        return inserted
+
+
+def delete_in_batches(queryset, batch_size=None):
+
+    """
+    Delete the rows of a queryset with set-based DELETEs of bounded size
+
+    Unlike QuerySet.delete, rows are not loaded in Python to send signals
+    and follow cascades, rows referencing them must be deleted first.
+    Outside of a transaction every batch is committed on its own, so
+    locks are only held for a batch.
+
+    :param batch_size: Number of rows per DELETE, DELETE_BATCH_SIZE by default
+    :return: Number of deleted rows
+    """
+
+    batch_size = batch_size or settings.DELETE_BATCH_SIZE
+    model = queryset.model
+    deleted = 0
+
+    while True:
+        ids = list(queryset.order_by().values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        deleted += model.objects.filter(pk__in=ids)._raw_delete(queryset.db)
+
+
+def delete_posts(posts, batch_size=None):
+
+    """
+    Delete posts with their user posts and comments, in batches
+
+    Replies attached to another post than their parent are kept as root
+    comments.
+
+    :param posts: Queryset of posts
+    :return: Number of deleted posts
+    """
+
+    batch_size = batch_size or settings.DELETE_BATCH_SIZE
+    deleted = 0
+
+    while True:
+        ids = list(posts.order_by().values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return deleted
+        delete_in_batches(UserPost.objects.filter(post_id__in=ids), batch_size)
+        # Replies are detached first, so a batch never deletes a parent before its replies
+        Comment.objects.filter(parent__post_id__in=ids).update(parent=None)
+        delete_in_batches(Comment.objects.filter(post_id__in=ids), batch_size)
+        deleted += Post.objects.filter(id__in=ids)._raw_delete(posts.db)
+
+
+def delete_feed(feed_id):
+
+    """
+    Delete a feed, its subscriptions and its posts in batches
+
+    Subscriptions are deleted first so the feed is neither listed to its
+    followers nor synchronized while its posts are deleted.
+
+    :return: Number of deleted posts
+    """
+
+    user_ids = list(Subscription.objects.filter(feed_id=feed_id).values_list('user_id', flat=True))
+    keyword_ids = list(
+        Feed.keywords.through.objects.filter(feed_id=feed_id).values_list('keyword_id', flat=True)
+    )
+
+    delete_in_batches(Subscription.objects.filter(feed_id=feed_id))
+    invalidate_sidebar_counters(user_ids)
+
+    deleted = delete_posts(Post.objects.filter(feed_id=feed_id))
+
+    Feed.keywords.through.objects.filter(feed_id=feed_id).delete()
+    Feed.objects.filter(id=feed_id).delete()
+    refresh_keyword_counts(keyword_ids)
+
+    return deleted
+
+
+def retention_cutoff(feed, now=None):
+
+    """
+    Date before which the posts of a feed expire
+
+    The retention of the feed overrides POST_RETENTION_DAYS. Both apply to
+    the publication date of the entries, which is stored on the posts and
+    checked before new entries are ingested.
+
+    A retention shorter than a day is rejected by the validation of the
+    feed. One stored before, such as the 0 which used to mean forever, is
+    logged and the posts of the feed are kept, so that pruning and
+    synchronization go on for the other feeds.
+
+    :return: Datetime, or None if the posts are kept forever
+    """
+
+    days = feed.retention_days if feed.retention_days is not None else settings.POST_RETENTION_DAYS
+    if days is None:
+        return None
+    if days < 1:
+        logger.warning("Posts of feed %s are kept, invalid retention of %s days", feed.id, days)
+        return None
+
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+def expired_posts(feed, cutoff):
+
+    """
+    Posts of a feed published before a date which nobody keeps
+
+    Posts are kept while a user has them in favorites or to read later,
+    or while they have comments.
+    """
+
+    kept_states = UserPost.objects.filter(
+        post=OuterRef('pk'), state__in=(UserPost.FAVORITE, UserPost.READLATER)
+    )
+
+    return Post.objects.filter(feed=feed, published_date__lt=cutoff).annotate(
+        kept=Exists(kept_states),
+        commented=Exists(Comment.objects.filter(post=OuterRef('pk')))
+    ).filter(kept=False, commented=False)
+
+
+def prune_posts(feed, now=None, batch_size=None):
+
+    """
+    Delete the expired posts of a feed in batches
+
+    :return: Number of deleted posts
+    """
+
+    cutoff = retention_cutoff(feed, now)
+    if cutoff is None:
+        return 0
+
+    deleted = delete_posts(expired_posts(feed, cutoff), batch_size)
+    if deleted:
+        invalidate_sidebar_counters(
+            Subscription.objects.filter(feed=feed).values_list('user_id', flat=True)
+        )
+
+    return deleted
+
+
+def create_user_posts(posts, users, state=UserPost.UNREAD, batch_size=400):
+
+    """
+    Create a user post for every pair of posts and users
+
+    On PostgreSQL a single INSERT ... SELECT does the whole fan-out in the
+    database. Other databases insert batches of pairs which do not exist
+    yet. Pairs already attached are skipped either way.
+
+    :param posts: Queryset of posts
+    :param users: Queryset of users
+    :param state: State of the created user posts
+    :param batch_size: Number of pairs inserted at once
+    """
+
+    post_ids = posts.order_by().values('id')
+    user_ids = users.order_by().values('id')
+
+    if connection.vendor == 'postgresql':
+        posts_sql, posts_params = post_ids.query.sql_with_params()
+        users_sql, users_params = user_ids.query.sql_with_params()
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO {table} (user_id, post_id, state) "
+                "SELECT users.id, posts.id, %s FROM ({users}) users, ({posts}) posts "
+                "ON CONFLICT (user_id, post_id) DO NOTHING".format(
+                    table=connection.ops.quote_name(UserPost._meta.db_table), users=users_sql, posts=posts_sql
+                ),
+                [state] + list(users_params) + list(posts_params)
+            )
+        return
+
+    user_ids = list(user_ids.values_list('id', flat=True))
+    if not user_ids:
+        return
+
+    pairs = product(post_ids.values_list('id', flat=True), user_ids)
+
+    while True:
+        batch = list(islice(pairs, batch_size))
+        if not batch:
+            break
+
+        existing = set(UserPost.objects.filter(
+            post_id__in=set(post_id for post_id, _ in batch),
+            user_id__in=set(user_id for _, user_id in batch)
+        ).values_list('post_id', 'user_id'))
+
+        bulk_create_ignoring_duplicates(UserPost, [
+            UserPost(post_id=post_id, user_id=user_id, state=state)
+            for post_id, user_id in batch if (post_id, user_id) not in existing
+        ])
+
+
+def supports_upsert(connection):
+
+    """
+    Whether the database supports INSERT ... ON CONFLICT DO UPDATE
+    """
+
+    if connection.vendor == 'sqlite':
+        return connection.Database.sqlite_version_info >= (3, 24)
+
+    return connection.vendor == 'postgresql'
+
+
+def set_post_state(user, post, state):
+
+    """
+    Store the state of a post for a user
+
+    A user post is only kept when the state differs from the default
+    state given by the read watermark of the subscription. A change is a
+    single conditional statement, whose row count tells if the state
+    changed, so concurrent changes of a post never read a stale state: a
+    DELETE back to the default state, or an INSERT ... ON CONFLICT DO
+    UPDATE WHERE the state differs. Databases without ON CONFLICT run an
+    UPDATE WHERE the state differs, then an INSERT when it missed.
+
+    :param post: Post annotated with its read watermark
+    :return: True if the state changed
+    """
+
+    default_state = UserPost.UNREAD if post.id > post.read_watermark else UserPost.READ
+    user_posts = UserPost.objects.filter(user=user, post_id=post.id)
+
+    if state == default_state:
+        changed = user_posts.delete()[0] > 0
+    elif supports_upsert(connection):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO {table} AS user_post (user_id, post_id, state) VALUES (%s, %s, %s) "
+                "ON CONFLICT (user_id, post_id) DO UPDATE SET state = EXCLUDED.state "
+                "WHERE user_post.state <> EXCLUDED.state".format(
+                    table=connection.ops.quote_name(UserPost._meta.db_table)
+                ),
+                [user.id, post.id, state]
+            )
+            changed = cursor.rowcount > 0
+    else:
+        changed = user_posts.exclude(state=state).update(state=state) > 0
+        if not changed:
+            try:
+                with transaction.atomic():
+                    UserPost.objects.create(user=user, post_id=post.id, state=state)
+                changed = True
+            except IntegrityError:
+                # The post already has this state
+                pass
+
+    post.state = state
+    if changed:
+        invalidate_sidebar_counters([user.id])
+
+    return changed
+
+
+def mark_feeds_read(user, feeds=None):
+
+    """
+    Mark every post of followed feeds as read
+
+    The read watermarks of the subscriptions move to the newest post of
+    their feed in a single UPDATE, then the unread and read user posts
+    made redundant by the new watermarks are deleted. Favorite and read
+    later posts keep their state.
+
+    :param feeds: Feeds or queryset of feeds, all followed feeds by default
+    """
+
+    subscriptions = Subscription.objects.filter(user=user)
+    if feeds is not None:
+        subscriptions = subscriptions.filter(feed__in=feeds)
+
+    newest_posts = Post.objects.filter(feed=OuterRef('feed')).order_by('-id').values('id')[:1]
+
+    # Watermarks never move back, even if the newest posts were deleted
+    subscriptions.update(read_watermark=Greatest(
+        Coalesce(Subquery(newest_posts, output_field=IntegerField()), 0), F('read_watermark')
+    ))
+
+    # Conditions on the subscription must share a single join
+    user_posts = UserPost.objects.filter(
+        user=user,
+        state__in=(UserPost.UNREAD, UserPost.READ),
+        post__feed__subscription__user=user,
+        post__id__lte=F('post__feed__subscription__read_watermark')
+    )
+    if feeds is not None:
+        user_posts = user_posts.filter(post__feed__in=feeds)
+    user_posts.delete()
+
+    invalidate_sidebar_counters([user.id])
+
+
+def mark_posts_read(user, posts):
+
+    """
+    Mark unread posts of followed feeds as read with set-based writes
+
+    Unread user posts up to the read watermark are deleted, the others
+    are updated, and read user posts are inserted for posts above the
+    watermark without user post. Posts in another state are left as is.
+
+    :param posts: Queryset of posts, without state annotations
+    """
+
+    post_ids = posts.order_by().values('id')
+
+    UserPost.objects.filter(
+        user=user,
+        state=UserPost.UNREAD,
+        post__in=post_ids,
+        post__feed__subscription__user=user,
+        post__id__lte=F('post__feed__subscription__read_watermark')
+    ).delete()
+
+    UserPost.objects.filter(
+        user=user, state=UserPost.UNREAD, post__in=post_ids
+    ).update(state=UserPost.READ)
+
+    create_user_posts(
+        posts.filter(
+            feed__subscription__user=user,
+            id__gt=F('feed__subscription__read_watermark')
+        ),
+        User.objects.filter(id=user.id),
+        UserPost.READ
+    )
+
+    invalidate_sidebar_counters([user.id])
+
+
+def subscribe(user, feed):
+
+    """
+    Follow a feed, its posts are unread until the read watermark moves
+    """
+
+    Subscription.objects.get_or_create(user=user, feed=feed)
+    refresh_subscriber_counts([feed.id])
+    invalidate_sidebar_counters([user.id])
+
+
+def unsubscribe(user, feed):
+
+    """
+    Stop following a feed and forget the states of its posts
+
+    The posts of the feed are hidden as soon as the subscription is
+    deleted, their states are deleted by a background task.
+    """
+
+    from rsscatcher.tasks import forget_feed_states
+
+    Subscription.objects.filter(user=user, feed=feed).delete()
+    refresh_subscriber_counts([feed.id])
+    invalidate_sidebar_counters([user.id])
+
+    forget_feed_states.delay(user.id, feed.id)
+
+
+def delete_feed_states(user_id, feed_id):
+
+    """
+    Delete the states of the posts of a feed the user does not follow
+
+    States are kept if the user followed the feed again in the meantime.
+
+    :return: Number of deleted user posts
+    """
+
+    if Subscription.objects.filter(user_id=user_id, feed_id=feed_id).exists():
+        return 0
+
+    return delete_in_batches(UserPost.objects.filter(user_id=user_id, post__feed_id=feed_id))
+
+
+def refresh_subscriber_counts(feed_ids=None):
+
+    """
+    Recount the users following feeds in a single UPDATE
+
+    :param feed_ids: Feeds to recount, all feeds by default
+    """
+
+    subscriber_counts = Subscription.objects.filter(
+        feed=OuterRef('pk')
+    ).order_by().values('feed').annotate(count=Count('*')).values('count')
+
+    feeds = Feed.objects.all()
+    if feed_ids is not None:
+        feeds = feeds.filter(id__in=feed_ids)
+
+    feeds.update(subscribers_count=Coalesce(
+        Subquery(subscriber_counts, output_field=IntegerField()), 0
+    ))
+
+
+def refresh_keyword_counts(keyword_ids=None):
+
+    """
+    Recount the feeds using keywords in a single UPDATE
+
+    :param keyword_ids: Keywords to recount, all keywords by default
+    """
+
+    feed_counts = Feed.keywords.through.objects.filter(
+        keyword=OuterRef('pk')
+    ).order_by().values('keyword').annotate(count=Count('*')).values('count')
+
+    keywords = Keyword.objects.all()
+    if keyword_ids is not None:
+        keywords = keywords.filter(id__in=keyword_ids)
+
+    keywords.update(feeds_count=Coalesce(
+        Subquery(feed_counts, output_field=IntegerField()), 0
+    ))
+
+
+def add_feed_keywords(feed, tags):
+
+    """
+    Link a feed to the keywords of tags with a constant number of queries
+
+    Keywords are resolved in one query, missing ones are inserted in bulk
+    and links to the feed are inserted in bulk. Rows inserted at the same
+    time by another worker are skipped.
+
+    :param tags: Terms of the tags of entries
+    :return: Ids of the keywords newly linked to the feed
+    """
+
+    names = set(name for name in (Keyword.normalize(tag) for tag in tags) if name)
+    if not names:
+        return set()
+
+    keyword_ids = dict(Keyword.objects.filter(name__in=names).values_list('name', 'id'))
+    missing = names - set(keyword_ids)
+    if missing:
+        bulk_create_ignoring_duplicates(Keyword, [Keyword(name=name) for name in missing])
+        keyword_ids.update(Keyword.objects.filter(name__in=missing).values_list('name', 'id'))
+
+    FeedKeyword = Feed.keywords.through
+    linked = set(
+        FeedKeyword.objects.filter(feed_id=feed.id, keyword_id__in=keyword_ids.values())
+        .values_list('keyword_id', flat=True)
+    )
+    new_ids = set(keyword_ids.values()) - linked
+    bulk_create_ignoring_duplicates(FeedKeyword, [
+        FeedKeyword(feed_id=feed.id, keyword_id=keyword_id) for keyword_id in new_ids
+    ])
+
+    return new_ids
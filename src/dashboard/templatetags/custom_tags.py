@@ -1,90 +1,100 @@
+from collections import defaultdict
 from django import template
 from django.utils.safestring import mark_safe
-from ..models import Subscription, Comment
+from ..expressions import RawSubquery
+from ..models import Comment
 
 register = template.Library()
 
 
-@register.simple_tag()
-def is_followed(feed_id, user_id):
-
-    """
-    Return True if a feed is folowwing by the current user else False
-    """
-
-    return bool(Subscription.objects.filter(user__id=user_id, feed__id=feed_id).count())
-
-
 @register.simple_tag()
 def comments(comment_ids, height, is_root_call, current_user_id):
 
     """
     Create a tree of comments for each parent comment
     ( direct comment for the post )
+
+    Every comment of the trees is loaded with its user in one query,
+    following parents with a recursive subquery whatever the post of the
+    replies, and the tree is built in memory
+
+    :param comment_ids: List of root comment ids or a single comment id
     """
 
-    global_content = ""
-    for comment in comment_ids.split(','):
-        content = ""
-        global_content += create_comment_tree(
-            comment, height, is_root_call, content, current_user_id
+    if isinstance(comment_ids, int):
+        root_ids = [comment_ids]
+    else:
+        root_ids = list(comment_ids)
+
+    if not root_ids:
+        return ""
+
+    nodes = {}
+    children = defaultdict(list)
+
+    # UNION stops on a cycle of parents where UNION ALL would not
+    tree_ids = RawSubquery(
+        "WITH RECURSIVE tree(id) AS ("
+        "SELECT id FROM {table} WHERE id IN ({roots}) "
+        "UNION SELECT reply.id FROM {table} reply JOIN tree ON reply.parent_id = tree.id"
+        ") SELECT id FROM tree".format(
+            table=Comment._meta.db_table, roots=", ".join(["%s"] * len(root_ids))
+        ),
+        root_ids
+    )
+    for node in Comment.objects.filter(id__in=tree_ids).select_related('user').order_by('id'):
+        nodes[node.id] = node
+        children[node.parent_id].append(node)
+
+    content = []
+    for root_id in root_ids:
+        create_comment_tree(
+            nodes[root_id], height, is_root_call, content, current_user_id, children
         )
 
-    return mark_safe(global_content)
+    return mark_safe("".join(content))
 
 
-def create_comment_tree(node_id, height, is_root_call, content, current_user_id):
+def create_comment_tree(node, height, is_root_call, content, current_user_id, children):
 
     """
     Create a tree of comments.
     Comments can have an infinite number of comment children
 
-    :param node_id: Post id
+    :param node: Comment
     :param height:
     :param is_root_call:
-    :param content:
+    :param content: List of markup chunks, extended in place
     :param current_user_id:
-    :return: content
+    :param children: Comments of the post grouped by parent id
     """
 
-    node = Comment.objects.get(id=node_id)
-
     if is_root_call:
         is_root_call = False
     else:
         height += 1
 
-    line = "<div class='comment comment-" + str(height) + "'>"
-    comment_block = "<b>{}</b>".format(node.user.username)
+    line = ["<div class='comment comment-", str(height), "'>"]
+    line.append("<b>{}</b>".format(node.user.username))
 
     if current_user_id == node.user_id:
 
         link = " | <a href='{}'> Edit </a>".format(
             "/dashboard/comments/" + str(node.id) + "/edit"
         )
-        comment_block += link
+        line.append(link)
     else:
 
         link = " | <a href='{}'> Reply </a>".format(
             "/dashboard/comments/" + str(node.id) + "/reply"
         )
-        comment_block += link
-
-    comment_block += "<br>"
-    comment_block += "<div class='comment-content'>" + node.content + "</div>"
-
-    line += comment_block
-
-    content += "</div>"
-    content += line
+        line.append(link)
 
-    if node.comment_set.count():
-        children = node.comment_set.all()
+    line.append("<br>")
+    line.extend(["<div class='comment-content'>", node.content, "</div>"])
 
-        for child in children:
-            if child is not None:
-                content = create_comment_tree(
-                    child.id, height, is_root_call, content, current_user_id
-                )
+    content.append("</div>")
+    content.extend(line)
 
-    return content
+    for child in children[node.id]:
+        create_comment_tree(child, height, is_root_call, content, current_user_id, children)
@@ -0,0 +1,217 @@
+from io import StringIO
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Max
+from django.test import TestCase
+from dashboard.management.commands.deduplicate_rows import delete_duplicates, rename_duplicate_slugs
+from dashboard.models import Comment, Feed, Keyword, Post, Subscription, UserPost
+from dashboard.search import search_posts
+from .test_models import create_a_feed
+
+
+class CompactUserPostsTests(TestCase):
+
+    """
+    Test the migration to watermark based states
+    """
+
+    def setUp(self):
+        feed = create_a_feed()
+        self.user = User.objects.create_user("alex", password="passpass")
+        self.posts = [
+            Post.objects.create(
+                name=str(i), slug=str(i), content="", feed=feed, url="http://upidev.fr"
+            )
+            for i in range(3)
+        ]
+        Subscription.objects.create(user=self.user, feed=feed)
+
+        for post, state in zip(self.posts, [UserPost.UNREAD, UserPost.READ, UserPost.FAVORITE]):
+            UserPost.objects.create(user=self.user, post=post, state=state)
+
+    def test_only_keep_non_default_states(self):
+
+        """
+        Unread user posts are deleted and states are unchanged
+        """
+
+        states = dict(Post.objects.for_user(self.user).values_list('id', 'state'))
+
+        call_command('compact_user_posts', stdout=StringIO())
+
+        self.assertEqual(
+            list(UserPost.objects.values_list('state', flat=True).order_by('state')),
+            [UserPost.FAVORITE, UserPost.READ]
+        )
+        self.assertEqual(
+            dict(Post.objects.for_user(self.user).values_list('id', 'state')), states
+        )
+
+
+class CheckQueryPlansTests(TestCase):
+
+    """
+    Test the query plans of the views
+    """
+
+    def test_views_do_not_scan_large_tables(self):
+
+        """
+        Every query of the views is served by an index
+        """
+
+        out = StringIO()
+
+        call_command('check_query_plans', stdout=out)
+
+        self.assertIn("All queries use indexes", out.getvalue())
+
+    def test_partial_indexes_are_created(self):
+
+        """
+        Partial indexes are created after the migration
+        """
+
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, Comment._meta.db_table
+            )
+
+        self.assertIn("dashboard_comment_root_idx", constraints)
+
+
+class RebuildSearchIndexTests(TestCase):
+
+    """
+    Test indexing of posts created before the search triggers
+    """
+
+    def test_rebuild(self):
+        feed = create_a_feed()
+        post = Post.objects.create(
+            name="Django", slug="django", content="", feed=feed, url="http://upidev.fr"
+        )
+
+        call_command('rebuild_search_index', stdout=StringIO())
+
+        self.assertEqual(list(search_posts(Post.objects.all(), "django")), [post])
+
+
+class SanitizePostsTests(TestCase):
+
+    """
+    Test the sanitization of posts ingested before contents were sanitized
+    """
+
+    def test_sanitize(self):
+        feed = create_a_feed()
+        post = Post.objects.create(
+            name="Django", slug="django", feed=feed, url="http://upidev.fr",
+            content="<p onclick='x()'>Django<script>x()</script></p>"
+        )
+
+        call_command('sanitize_posts', batch_size=1, stdout=StringIO())
+
+        post.refresh_from_db()
+        self.assertEqual((post.content, post.summary), ("<p>Django</p>", "Django"))
+
+    def test_only_sanitize_unsanitized_posts(self):
+
+        """
+        Posts marked as sanitized are skipped, even without summary
+        """
+
+        feed = create_a_feed()
+        for slug, sanitized in (("legacy", False), ("sanitized", True)):
+            Post.objects.create(
+                name=slug, slug=slug, feed=feed, url="http://upidev.fr",
+                content="<b>Django</b><script>x()</script>", sanitized=sanitized
+            )
+
+        call_command('sanitize_posts', unsanitized=True, stdout=StringIO())
+
+        self.assertEqual(
+            dict(Post.objects.values_list('slug', 'content')),
+            {'legacy': "<b>Django</b>", 'sanitized': "<b>Django</b><script>x()</script>"}
+        )
+        self.assertFalse(Post.objects.filter(sanitized=False).exists())
+
+
+class RefreshCountersTests(TestCase):
+
+    """
+    Test the recount of cached counters
+    """
+
+    def test_refresh(self):
+        feed = create_a_feed()
+        user = User.objects.create_user("alex", password="passpass")
+        Subscription.objects.create(user=user, feed=feed)
+
+        call_command('refresh_counters', stdout=StringIO())
+
+        self.assertEqual(Feed.objects.get(id=feed.id).subscribers_count, 1)
+        self.assertEqual(set(Keyword.objects.values_list('feeds_count', flat=True)), {1})
+
+
+class DeduplicateKeywordsTests(TestCase):
+
+    """
+    Test the merge of keywords with the same normalized name
+    """
+
+    def test_merge_keywords(self):
+        create_a_feed()
+        other_feed = Feed.objects.create(name="Other", slug="other", url="http://upidev.fr")
+        other_feed.keywords.create(name="Python")
+        other_feed.keywords.create(name="Machine Learning")
+
+        call_command('deduplicate_keywords', stdout=StringIO())
+
+        self.assertEqual(
+            dict(Keyword.objects.values_list('name', 'feeds_count')),
+            {'django': 1, 'python': 2, 'flask': 1, 'machine-learning': 1}
+        )
+        self.assertEqual(
+            set(other_feed.keywords.values_list('name', flat=True)),
+            {'python', 'machine-learning'}
+        )
+
+
+class DeduplicateRowsTests(TestCase):
+
+    """
+    Test duplicates are removed before unique constraints are migrated
+
+    The constraints are already migrated in tests, the helpers are run on
+    fields without constraint instead.
+    """
+
+    def setUp(self):
+        feed = create_a_feed()
+        other_feed = Feed.objects.create(name="Other", slug="other", url="http://upidev.fr")
+        self.posts = [
+            Post.objects.create(name="a", slug=slug, content="", feed=a_feed, url="http://upidev.fr")
+            for a_feed, slug in ((feed, "a"), (other_feed, "a"), (feed, "b"))
+        ]
+
+    def test_rename_duplicate_slugs(self):
+        self.assertEqual(rename_duplicate_slugs(Post, ['slug'], 200), 1)
+
+        self.assertEqual(
+            list(Post.objects.order_by('id').values_list('slug', flat=True)),
+            ["a", "a-{}".format(self.posts[1].id), "b"]
+        )
+
+    def test_delete_duplicates(self):
+        self.assertEqual(delete_duplicates(Post, ['feed_id', 'name'], Max), 1)
+
+        self.assertEqual(
+            set(Post.objects.values_list('id', flat=True)), {self.posts[1].id, self.posts[2].id}
+        )
+
+    def test_command_keeps_unique_rows(self):
+        call_command('deduplicate_rows', stdout=StringIO())
+
+        self.assertEqual(Post.objects.count(), 3)
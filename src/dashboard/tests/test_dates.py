@@ -0,0 +1,54 @@
+from datetime import datetime
+import pytz
+from django.contrib.auth.models import User
+from django.test import TestCase
+from dashboard.dates import local_day_range, user_timezone
+from dashboard.models import Profile
+
+
+class DatesTests(TestCase):
+
+    """
+    Test day boundaries in the timezone of a user
+    """
+
+    def test_local_day_range(self):
+
+        """
+        The range covers the local day of the given instant
+        """
+
+        tz = pytz.timezone("America/New_York")
+        now = pytz.utc.localize(datetime(2018, 7, 1, 2, 30))
+
+        start, end = local_day_range(tz, now)
+
+        self.assertEqual(start, pytz.utc.localize(datetime(2018, 6, 30, 4)))
+        self.assertEqual(end, pytz.utc.localize(datetime(2018, 7, 1, 4)))
+
+    def test_local_day_range_on_daylight_saving_change(self):
+
+        """
+        A day can last 23 hours
+        """
+
+        tz = pytz.timezone("Europe/Paris")
+        now = pytz.utc.localize(datetime(2018, 3, 25, 12))
+
+        start, end = local_day_range(tz, now)
+
+        self.assertEqual((end - start).total_seconds(), 23 * 3600)
+
+    def test_user_timezone(self):
+
+        """
+        The site timezone is used until the user chooses one
+        """
+
+        user = User.objects.create_user("alex", password="passpass")
+
+        self.assertEqual(user_timezone(user).zone, "UTC")
+
+        Profile.objects.create(user=user, timezone="Europe/Paris")
+
+        self.assertEqual(user_timezone(user).zone, "Europe/Paris")
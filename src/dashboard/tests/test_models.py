@@ -1,7 +1,11 @@
 from datetime import date
+from unittest.mock import patch
+from django.db import IntegrityError, connection
 from django.test import TestCase
 from django.contrib.auth.models import User
+from dashboard.indexes import create_partial_indexes, create_pattern_indexes
 from dashboard.models import Keyword, Feed, Subscription, Post, UserPost, Comment
+from dashboard.search import create_search_index
 
 
 class KeywordModelTests(TestCase):
@@ -19,6 +23,13 @@ class KeywordModelTests(TestCase):
     def test_string_representation(self):
         self.assertEqual(str(self.keyword), self.keyword.name)
 
+    def test_name_is_unique(self):
+        with self.assertRaises(IntegrityError):
+            Keyword.objects.create(name="python")
+
+    def test_normalize(self):
+        self.assertEqual(Keyword.normalize(" Machine Learning "), "machine-learning")
+
 
 def create_a_feed():
 
@@ -133,6 +144,15 @@ class PostModelTests(TestCase):
             "{} - {}".format(self.post.name, self.post.feed.name)
         )
 
+    def test_slug_is_unique_for_a_feed(self):
+
+        """
+        Cannot create two posts with the same slug for a feed
+        """
+
+        with self.assertRaises(IntegrityError):
+            init_post(self.post.feed)
+
 
 class UserPostModelTests(TestCase):
 
@@ -165,6 +185,67 @@ class UserPostModelTests(TestCase):
         )
 
 
+class PostStateTests(TestCase):
+
+    """
+    Test states of posts derived from the subscription read watermark
+    """
+
+    def setUp(self):
+        self.feed = create_a_feed()
+        self.user = User.objects.create_user('alex', password='passpass')
+        self.posts = [
+            Post.objects.create(
+                name=str(i), slug=str(i), content="", feed=self.feed, url="http://upidev.fr"
+            )
+            for i in range(4)
+        ]
+        self.subscription = Subscription.objects.create(user=self.user, feed=self.feed)
+
+    def states(self):
+        return dict(
+            Post.objects.for_user(self.user).values_list('slug', 'state')
+        )
+
+    def test_posts_are_unread_by_default(self):
+        self.assertEqual(set(self.states().values()), {UserPost.UNREAD})
+
+    def test_posts_up_to_the_watermark_are_read(self):
+        self.subscription.read_watermark = self.posts[1].id
+        self.subscription.save()
+        Subscription.objects.create(
+            user=User.objects.create_user('alex2', password='passpass'),
+            feed=self.feed, read_watermark=self.posts[3].id
+        )
+
+        self.assertEqual(self.states(), {
+            '0': UserPost.READ, '1': UserPost.READ,
+            '2': UserPost.UNREAD, '3': UserPost.UNREAD
+        })
+
+    def test_stored_states_override_the_watermark(self):
+        self.subscription.read_watermark = self.posts[1].id
+        self.subscription.save()
+        UserPost.objects.create(user=self.user, post=self.posts[0], state=UserPost.UNREAD)
+        UserPost.objects.create(user=self.user, post=self.posts[3], state=UserPost.FAVORITE)
+
+        self.assertEqual(
+            list(Post.objects.for_user(self.user, UserPost.UNREAD).values_list('slug', flat=True)),
+            ['2', '0']
+        )
+        self.assertEqual(
+            list(Post.objects.for_user(self.user, UserPost.FAVORITE).values_list('slug', flat=True)),
+            ['3']
+        )
+
+    def test_only_return_posts_of_followed_feeds(self):
+        other_user = User.objects.create_user('alex2', password='passpass')
+        UserPost.objects.create(user=other_user, post=self.posts[0], state=UserPost.FAVORITE)
+
+        self.assertFalse(Post.objects.for_user(other_user).exists())
+        self.assertEqual(Post.objects.for_user(self.user).count(), 4)
+
+
 class CommentModelTests(TestCase):
 
     """
@@ -233,3 +314,27 @@ class CommentModelTests(TestCase):
             str(self.parent_comment),
             "{} - {}".format(self.user.username, self.parent_comment.content)
         )
+
+
+class PostMigrateIndexTests(TestCase):
+
+    """
+    Test the indexes created after each migration of the dashboard
+    """
+
+    handlers = (create_partial_indexes, create_pattern_indexes, create_search_index)
+
+    def test_indexes_are_created_once(self):
+        for handler in self.handlers:
+            handler(sender=None)
+
+    def test_skip_tables_not_migrated_yet(self):
+
+        """
+        Nothing is created before the migrations of the dashboard exist
+        """
+
+        with patch.object(connection.introspection, 'table_names', return_value=[]):
+            with self.assertNumQueries(0):
+                for handler in self.handlers:
+                    handler(sender=None)
@@ -0,0 +1,142 @@
+from datetime import datetime
+import pytz
+from django.contrib.auth.models import User
+from django.test import TestCase
+from dashboard.models import Post, Subscription
+from dashboard.pagination import KeysetPaginator, decode_cursor
+from .test_models import create_a_feed
+
+
+class KeysetPaginatorTests(TestCase):
+
+    """
+    Test cursor based pagination of posts
+    """
+
+    def setUp(self):
+        self.feed = create_a_feed()
+        for i in range(8):
+            Post.objects.create(
+                name=str(i), slug=str(i), content="", feed=self.feed, url="http://upidev.fr"
+            )
+
+        # Posts published at the same time are ordered by id
+        Post.objects.filter(slug__in=["3", "4", "5"]).update(
+            published_date=pytz.utc.localize(datetime(2018, 7, 1))
+        )
+
+        self.expected = list(
+            Post.objects.order_by('-published_date', '-id').values_list('id', flat=True)
+        )
+
+    def walk(self, paginator, page, cursor_name):
+        ids = []
+        while page is not None:
+            ids.append([post.id for post in page])
+            cursor = getattr(page, cursor_name)
+            page = paginator.page(cursor) if cursor else None
+        return ids
+
+    def test_walk_forward_and_back(self):
+
+        """
+        Following cursors lists each post once, in both directions
+        """
+
+        paginator = KeysetPaginator(Post.objects.all(), 3)
+
+        forward = self.walk(paginator, paginator.page(), 'next_cursor')
+
+        self.assertEqual([len(ids) for ids in forward], [3, 3, 2])
+        self.assertEqual(sum(forward, []), self.expected)
+
+        last_page = paginator.page(paginator.page().next_cursor)
+        last_page = paginator.page(last_page.next_cursor)
+        backward = self.walk(paginator, last_page, 'previous_cursor')
+
+        self.assertEqual(backward, list(reversed(forward)))
+
+    def test_first_page_has_no_previous_page(self):
+        page = KeysetPaginator(Post.objects.all(), 3).page()
+
+        self.assertFalse(page.has_previous())
+        self.assertTrue(page.has_next())
+
+    def test_page_in_one_query(self):
+
+        """
+        A page is one query, no count is run
+        """
+
+        paginator = KeysetPaginator(Post.objects.all(), 3)
+        cursor = paginator.page().next_cursor
+
+        with self.assertNumQueries(1):
+            page = paginator.page(cursor)
+            list(page.object_list)
+            len(page)
+
+    def test_page_number(self):
+
+        """
+        Pages can still be found by number
+        """
+
+        paginator = KeysetPaginator(Post.objects.all(), 3)
+
+        page = paginator.page_number(2)
+
+        self.assertEqual([post.id for post in page], self.expected[3:6])
+        self.assertTrue(page.has_previous())
+        self.assertEqual(
+            [post.id for post in paginator.page(page.next_cursor)], self.expected[6:]
+        )
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(ValueError):
+            decode_cursor("not-a-cursor")
+
+
+class KeysetPaginationViewTests(TestCase):
+
+    """
+    Test paginated post lists
+    """
+
+    def setUp(self):
+        feed = create_a_feed()
+        for i in range(5):
+            Post.objects.create(
+                name=str(i), slug=str(i), content="", feed=feed, url="http://upidev.fr"
+            )
+
+        user = User.objects.create_user("alex", password="passpass")
+        Subscription.objects.create(user=user, feed=feed)
+        self.client.login(username="alex", password="passpass")
+
+    def test_follow_next_cursor(self):
+        response = self.client.get('/dashboard/feed/python-planet/')
+        page = response.context['page_obj']
+
+        response = self.client.get(
+            '/dashboard/feed/python-planet/', {'cursor': page.next_cursor}
+        )
+
+        self.assertEqual(
+            [post.slug for post in response.context['posts']], ["1", "0"]
+        )
+        self.assertContains(response, "?cursor={}".format(
+            response.context['page_obj'].previous_cursor
+        ))
+
+    def test_legacy_page_number(self):
+        response = self.client.get('/dashboard/filter/unread', {'page': 2})
+
+        self.assertEqual(
+            [post.slug for post in response.context['posts']], ["1", "0"]
+        )
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get('/dashboard/filter/unread', {'cursor': "abc"})
+
+        self.assertEqual(response.status_code, 404)
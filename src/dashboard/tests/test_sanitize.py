@@ -0,0 +1,77 @@
+from django.test import SimpleTestCase
+from dashboard.sanitize import sanitize
+
+
+class SanitizeTests(SimpleTestCase):
+
+    """
+    Test the sanitization of the HTML of entries
+    """
+
+    def test_keep_allowed_tags(self):
+
+        """
+        Allowed tags are kept, other tags are dropped with their attributes
+        """
+
+        body, summary = sanitize(
+            '<p class="intro" onclick="steal()">Hello <b>world</b></p><font>!</font>'
+        )
+
+        self.assertEqual(body, '<p>Hello <b>world</b></p>!')
+        self.assertEqual(summary, 'Hello world !')
+
+    def test_drop_scripts_and_styles(self):
+
+        """
+        Scripts and styles are dropped with their content
+        """
+
+        body, summary = sanitize(
+            'A<script>alert("x")</script><style>p {}</style><img src=x onerror=alert(1)>B'
+        )
+
+        self.assertEqual((body, summary), ('AB', 'AB'))
+
+    def test_only_keep_web_links(self):
+
+        """
+        Links must be web urls and open in a new tab without referrer access
+        """
+
+        body, summary = sanitize(
+            '<a href="https://upidev.fr?a=1&amp;b=2">Web</a>'
+            '<a href=" JavaScript:alert(1)">Script</a>'
+            '<a href="java&#9;script:alert(1)">Entity</a>'
+        )
+
+        self.assertEqual(
+            body,
+            '<a href="https://upidev.fr?a=1&amp;b=2" rel="nofollow noopener" '
+            'target="_blank">Web</a>'
+            '<a rel="nofollow noopener" target="_blank">Script</a>'
+            '<a rel="nofollow noopener" target="_blank">Entity</a>'
+        )
+
+    def test_escape_text_and_close_tags(self):
+
+        """
+        Text is escaped and tags left open are closed
+        """
+
+        body, summary = sanitize('<ul><li>1 &lt; 2 &amp; <em>3</ul><p>"quoted"')
+
+        self.assertEqual(body, '<ul><li>1 &lt; 2 &amp; <em>3</em></li></ul><p>"quoted"</p>')
+        self.assertEqual(summary, '1 < 2 & 3 "quoted"')
+
+    def test_truncate_the_summary(self):
+
+        """
+        The summary is a plain text of at most 200 characters
+        """
+
+        body, summary = sanitize("<p>{}</p>".format("word " * 100))
+
+        self.assertEqual(len(summary), 200)
+        self.assertTrue(summary.endswith("..."))
+        self.assertEqual(sanitize(None), ('', ''))
@@ -0,0 +1,126 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from dashboard.models import Feed, Post, Subscription
+from dashboard.search import fts5_query, search_posts
+from .test_models import create_a_feed
+
+
+class SearchTests(TestCase):
+
+    """
+    Test full-text search over posts
+    """
+
+    def setUp(self):
+        feed = create_a_feed()
+        other_feed = Feed.objects.create(
+            name="Other", slug="other", url="http://upidev.fr/other"
+        )
+
+        self.user = User.objects.create_user("alex", password="passpass")
+        Subscription.objects.create(user=self.user, feed=feed)
+
+        self.in_content = Post.objects.create(
+            name="Weekly news", slug="weekly-news", feed=feed, url="http://upidev.fr",
+            content="<p>A new release of Django is out</p>"
+        )
+        self.in_name = Post.objects.create(
+            name="Django 2.1 released", slug="django-2-1", feed=feed, url="http://upidev.fr",
+            content="<p>Read the release notes</p>"
+        )
+        Post.objects.create(
+            name="Flask", slug="flask", feed=feed, url="http://upidev.fr",
+            content="<p>Nothing to see</p>"
+        )
+        Post.objects.create(
+            name="Django elsewhere", slug="django-elsewhere", feed=other_feed,
+            url="http://upidev.fr", content="<p>Django</p>"
+        )
+
+    def search(self, terms):
+        return list(search_posts(Post.objects.for_user(self.user), terms))
+
+    def test_search_posts_of_subscriptions_by_relevance(self):
+
+        """
+        Only subscribed feeds are searched, matches in names come first
+        """
+
+        self.assertEqual(self.search("django"), [self.in_name, self.in_content])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.search("django notes"), [self.in_name])
+
+    def test_search_follows_updates(self):
+        self.in_content.content = "<p>Nothing new</p>"
+        self.in_content.save()
+
+        self.assertEqual(self.search("django"), [self.in_name])
+
+        self.in_name.delete()
+
+        self.assertEqual(self.search("django"), [])
+
+    def test_only_the_newest_matches_are_ranked(self):
+        """
+        The limit keeps the newest matching posts, not the newest posts
+        """
+
+        feed = self.in_name.feed
+        newest = [
+            Post.objects.create(
+                name="Django {}".format(i), slug="django-{}".format(i), feed=feed,
+                url="http://upidev.fr", content="<p>Django</p>"
+            )
+            for i in range(2)
+        ]
+        for i in range(3):
+            Post.objects.create(
+                name="Flask {}".format(i), slug="flask-{}".format(i), feed=feed,
+                url="http://upidev.fr", content="<p>Nothing to see</p>"
+            )
+
+        matches = search_posts(Post.objects.for_user(self.user), "django", limit=2)
+
+        self.assertEqual(set(matches), set(newest))
+
+    def test_search_syntax_is_escaped(self):
+        self.assertEqual(self.search('django" OR "flask'), [])
+        self.assertEqual(self.search("  "), [])
+
+    def test_fts5_query(self):
+        self.assertEqual(fts5_query('django "2.1"'), '"django" """2.1"""')
+
+
+class SearchViewTests(TestCase):
+
+    """
+    Test the search page
+    """
+
+    def setUp(self):
+        feed = create_a_feed()
+        self.user = User.objects.create_user("alex", password="passpass")
+        Subscription.objects.create(user=self.user, feed=feed)
+        for i in range(4):
+            Post.objects.create(
+                name="Django {}".format(i), slug=str(i), feed=feed,
+                url="http://upidev.fr", content=""
+            )
+        self.client.login(username="alex", password="passpass")
+
+    def test_search_is_paginated(self):
+        response = self.client.get('/dashboard/search/', {'q': "django"})
+
+        self.assertEqual(len(response.context['posts']), 3)
+        self.assertContains(response, "?q=django&amp;page=2")
+
+        response = self.client.get('/dashboard/search/', {'q': "django", 'page': 2})
+
+        self.assertEqual(len(response.context['posts']), 1)
+
+    def test_empty_search(self):
+        response = self.client.get('/dashboard/search/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['posts'])
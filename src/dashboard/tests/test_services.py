@@ -0,0 +1,471 @@
+from datetime import timedelta
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from django.contrib.auth.models import User
+from dashboard.models import Comment, Feed, Keyword, Post, Subscription, UserPost
+from dashboard.services import (
+    add_feed_keywords, bulk_create_ignoring_duplicates, create_user_posts, delete_feed,
+    delete_in_batches, delete_posts, mark_feeds_read, mark_posts_read, prune_posts,
+    refresh_keyword_counts, refresh_subscriber_counts, retention_cutoff, set_post_state,
+    subscribe, unsubscribe
+)
+from .test_models import create_a_feed
+
+
+class BulkCreateIgnoringDuplicatesTests(TestCase):
+
+    """
+    Test bulk inserts tolerating concurrent inserts
+    """
+
+    def setUp(self):
+        self.feed = create_a_feed()
+
+    def new_post(self, slug):
+        return Post(name=slug, slug=slug, content="", feed=self.feed, url="http://upidev.fr")
+
+    def test_insert_all_objects(self):
+
+        """
+        Insert every object of the batch
+        """
+
+        inserted = bulk_create_ignoring_duplicates(Post, [self.new_post("a"), self.new_post("b")])
+
+        self.assertEqual(inserted, 2)
+        self.assertEqual(Post.objects.count(), 2)
+
+    def test_skip_duplicates_and_keep_other_objects(self):
+
+        """
+        Rows already inserted by another worker are skipped
+        """
+
+        self.new_post("a").save()
+
+        inserted = bulk_create_ignoring_duplicates(Post, [self.new_post("a"), self.new_post("b")])
+
+        self.assertEqual(inserted, 1)
+        self.assertEqual(
+            sorted(Post.objects.values_list('slug', flat=True)), ["a", "b"]
+        )
+
+
+class CreateUserPostsTests(TestCase):
+
+    """
+    Test the fan-out of posts to users
+    """
+
+    def setUp(self):
+        self.feed = create_a_feed()
+        for i in range(5):
+            Post.objects.create(
+                name=str(i), slug=str(i), content="", feed=self.feed, url="http://upidev.fr"
+            )
+        for i in range(3):
+            User.objects.create_user("user{}".format(i), password="passpass")
+
+    def test_create_a_user_post_for_each_pair(self):
+
+        """
+        Every user gets an unread user post for every post
+        """
+
+        create_user_posts(Post.objects.all(), User.objects.all(), batch_size=4)
+
+        self.assertEqual(UserPost.objects.count(), 15)
+        self.assertFalse(UserPost.objects.exclude(state=UserPost.UNREAD).exists())
+
+    def test_is_idempotent(self):
+
+        """
+        Existing user posts are kept and not duplicated
+        """
+
+        user = User.objects.get(username="user0")
+        post = Post.objects.first()
+        UserPost.objects.create(user=user, post=post, state=UserPost.FAVORITE)
+
+        create_user_posts(Post.objects.all(), User.objects.all())
+        create_user_posts(Post.objects.all(), User.objects.all())
+
+        self.assertEqual(UserPost.objects.count(), 15)
+        self.assertEqual(UserPost.objects.get(user=user, post=post).state, UserPost.FAVORITE)
+
+    def test_run_a_constant_number_of_queries(self):
+
+        """
+        The fan-out does not run a query per user post
+        """
+
+        expected_queries = 1 if connection.vendor == 'postgresql' else 6
+
+        with self.assertNumQueries(expected_queries):
+            create_user_posts(Post.objects.all(), User.objects.all(), batch_size=100)
+
+
+class SetPostStateTests(TestCase):
+
+    """
+    Test only non default states are stored
+    """
+
+    def setUp(self):
+        self.feed = create_a_feed()
+        self.user = User.objects.create_user("alex", password="passpass")
+        self.post = Post.objects.create(
+            name="a", slug="a", content="", feed=self.feed, url="http://upidev.fr"
+        )
+        self.subscription = Subscription.objects.create(user=self.user, feed=self.feed)
+
+    def annotated_post(self):
+        return Post.objects.for_user(self.user).get(id=self.post.id)
+
+    def test_store_a_non_default_state(self):
+        set_post_state(self.user, self.annotated_post(), UserPost.FAVORITE)
+
+        self.assertEqual(UserPost.objects.get().state, UserPost.FAVORITE)
+
+    def test_remove_the_user_post_for_the_default_state(self):
+        post = self.annotated_post()
+        set_post_state(self.user, post, UserPost.READ)
+        set_post_state(self.user, post, UserPost.UNREAD)
+
+        self.assertFalse(UserPost.objects.exists())
+
+    def test_store_unread_below_the_watermark(self):
+        self.subscription.read_watermark = self.post.id
+        self.subscription.save()
+
+        set_post_state(self.user, self.annotated_post(), UserPost.UNREAD)
+
+        self.assertEqual(UserPost.objects.get().state, UserPost.UNREAD)
+
+    def test_update_a_stored_state_in_place(self):
+        post = self.annotated_post()
+        set_post_state(self.user, post, UserPost.FAVORITE)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(set_post_state(self.user, post, UserPost.READLATER))
+
+        self.assertFalse(set_post_state(self.user, post, UserPost.READLATER))
+        self.assertEqual(UserPost.objects.get().state, UserPost.READLATER)
+
+    def test_change_a_state_read_before_another_change(self):
+
+        """
+        The statement decides if the state changed, not the state read
+        """
+
+        post = self.annotated_post()
+        stale = self.annotated_post()
+        set_post_state(self.user, post, UserPost.FAVORITE)
+
+        self.assertFalse(set_post_state(self.user, stale, UserPost.FAVORITE))
+        self.assertTrue(set_post_state(self.user, stale, UserPost.UNREAD))
+        self.assertFalse(UserPost.objects.exists())
+
+    def test_insert_a_state_in_one_query(self):
+        post = self.annotated_post()
+
+        with self.assertNumQueries(1):
+            self.assertTrue(set_post_state(self.user, post, UserPost.FAVORITE))
+
+
+class MarkReadTests(TestCase):
+
+    """
+    Test posts are marked as read in bulk, keeping other states
+    """
+
+    def setUp(self):
+        self.feed = create_a_feed()
+        self.user = User.objects.create_user("alex", password="passpass")
+        self.posts = [
+            Post.objects.create(
+                name=slug, slug=slug, content="", feed=self.feed, url="http://upidev.fr"
+            )
+            for slug in ("a", "b", "c", "d")
+        ]
+        self.subscription = Subscription.objects.create(
+            user=self.user, feed=self.feed, read_watermark=self.posts[0].id
+        )
+        # Unread below the watermark, favorite and read above it
+        UserPost.objects.create(user=self.user, post=self.posts[0], state=UserPost.UNREAD)
+        UserPost.objects.create(user=self.user, post=self.posts[1], state=UserPost.FAVORITE)
+        UserPost.objects.create(user=self.user, post=self.posts[2], state=UserPost.READ)
+
+    def states(self):
+        return dict(Post.objects.for_user(self.user).values_list('slug', 'state'))
+
+    def test_mark_feeds_read_moves_the_watermark(self):
+        with self.assertNumQueries(2):
+            mark_feeds_read(self.user)
+
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.read_watermark, self.posts[-1].id)
+        self.assertEqual(self.states(), {
+            "a": UserPost.READ, "b": UserPost.FAVORITE, "c": UserPost.READ, "d": UserPost.READ
+        })
+        # Only the favorite state differs from the watermark
+        self.assertEqual(UserPost.objects.count(), 1)
+
+    def test_mark_feeds_read_keeps_other_feeds(self):
+        other_feed = Feed.objects.create(name="other", slug="other", url="http://other.fr")
+        Subscription.objects.create(user=self.user, feed=other_feed)
+
+        mark_feeds_read(self.user, Feed.objects.filter(id=other_feed.id))
+
+        self.subscription.refresh_from_db()
+        self.assertEqual(self.subscription.read_watermark, self.posts[0].id)
+        self.assertEqual(self.states()["d"], UserPost.UNREAD)
+
+    def test_mark_posts_read(self):
+        mark_posts_read(self.user, Post.objects.filter(slug__in=("a", "b", "d")))
+
+        self.assertEqual(self.states(), {
+            "a": UserPost.READ, "b": UserPost.FAVORITE, "c": UserPost.READ, "d": UserPost.READ
+        })
+        self.assertFalse(UserPost.objects.filter(post=self.posts[0]).exists())
+
+    def test_mark_posts_read_ignores_unfollowed_feeds(self):
+        other_feed = Feed.objects.create(name="other", slug="other", url="http://other.fr")
+        other_post = Post.objects.create(
+            name="e", slug="e", content="", feed=other_feed, url="http://upidev.fr"
+        )
+
+        mark_posts_read(self.user, Post.objects.filter(id=other_post.id))
+
+        self.assertFalse(UserPost.objects.filter(post=other_post).exists())
+
+
+class DeleteTests(TestCase):
+
+    """
+    Test rows are deleted in batches with their dependent rows
+    """
+
+    def setUp(self):
+        self.feed = create_a_feed()
+        Keyword.objects.update(feeds_count=1)
+        self.user = User.objects.create_user("alex", password="passpass")
+        Subscription.objects.create(user=self.user, feed=self.feed)
+        for slug in ("a", "b", "c"):
+            post = Post.objects.create(
+                name=slug, slug=slug, content="", feed=self.feed, url="http://upidev.fr"
+            )
+            UserPost.objects.create(user=self.user, post=post, state=UserPost.FAVORITE)
+            comment = Comment.objects.create(user=self.user, post=post, content="")
+            Comment.objects.create(user=self.user, post=post, parent=comment, content="")
+
+    def test_delete_in_batches(self):
+        # Select and delete each batch, then an empty select
+        with self.assertNumQueries(5):
+            self.assertEqual(delete_in_batches(UserPost.objects.all(), batch_size=2), 3)
+
+        self.assertFalse(UserPost.objects.exists())
+
+    def test_delete_posts_with_their_states_and_comments(self):
+        self.assertEqual(delete_posts(Post.objects.filter(slug__in=("a", "b")), batch_size=2), 2)
+
+        self.assertEqual(list(Post.objects.values_list('slug', flat=True)), ["c"])
+        self.assertEqual(UserPost.objects.get().post.slug, "c")
+        self.assertEqual(set(Comment.objects.values_list('post__slug', flat=True)), {"c"})
+
+    def test_delete_a_feed(self):
+        other_feed = Feed.objects.create(name="other", slug="other", url="http://other.fr")
+        Post.objects.create(name="d", slug="d", content="", feed=other_feed, url="http://upidev.fr")
+
+        self.assertEqual(delete_feed(self.feed.id), 3)
+
+        self.assertEqual(list(Feed.objects.all()), [other_feed])
+        self.assertEqual(Post.objects.get().feed, other_feed)
+        self.assertFalse(Subscription.objects.exists())
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(set(Keyword.objects.values_list('feeds_count', flat=True)), {0})
+
+
+class DeleteCommentTreesTests(TransactionTestCase):
+
+    """
+    Test batches of threaded comments are deleted with foreign keys checked
+
+    Each DELETE is committed, unlike in a TestCase where checks are deferred
+    """
+
+    def test_delete_replies_before_their_parents(self):
+        feed = create_a_feed()
+        user = User.objects.create_user("alex", password="passpass")
+        post = Post.objects.create(name="a", slug="a", content="", feed=feed, url="http://upidev.fr")
+        other_post = Post.objects.create(name="b", slug="b", content="", feed=feed, url="http://upidev.fr")
+        parent = Comment.objects.create(user=user, post=post, content="")
+        reply = Comment.objects.create(user=user, post=post, parent=parent, content="")
+        Comment.objects.create(user=user, post=post, parent=reply, content="")
+        # A reply attached to another post than its parent
+        Comment.objects.create(user=user, post=other_post, parent=parent, content="")
+
+        with override_settings(DELETE_BATCH_SIZE=1):
+            self.assertEqual(delete_posts(Post.objects.filter(id=post.id)), 1)
+
+        self.assertEqual(Comment.objects.get().post, other_post)
+
+
+class RetentionTests(TestCase):
+
+    """
+    Test expired posts are pruned unless a user keeps them
+    """
+
+    def setUp(self):
+        self.feed = create_a_feed()
+        self.user = User.objects.create_user("alex", password="passpass")
+        Subscription.objects.create(user=self.user, feed=self.feed)
+        for slug in ("read", "favorite", "readlater", "commented", "recent"):
+            Post.objects.create(name=slug, slug=slug, content="", feed=self.feed, url="http://upidev.fr")
+        Post.objects.exclude(slug="recent").update(
+            published_date=timezone.now() - timedelta(days=40)
+        )
+        for state in (UserPost.READ, UserPost.FAVORITE, UserPost.READLATER):
+            UserPost.objects.create(user=self.user, post=Post.objects.get(slug=state), state=state)
+        Comment.objects.create(user=self.user, post=Post.objects.get(slug="commented"), content="")
+
+    def test_keep_posts_forever_by_default(self):
+        self.assertIsNone(retention_cutoff(self.feed))
+        self.assertEqual(prune_posts(self.feed), 0)
+
+    @override_settings(POST_RETENTION_DAYS=30)
+    def test_prune_posts_nobody_keeps(self):
+        self.assertEqual(prune_posts(self.feed, batch_size=1), 1)
+
+        self.assertEqual(
+            set(Post.objects.values_list('slug', flat=True)),
+            {"favorite", "readlater", "commented", "recent"}
+        )
+        self.assertFalse(UserPost.objects.filter(state=UserPost.READ).exists())
+
+    @override_settings(POST_RETENTION_DAYS=30)
+    def test_the_retention_of_the_feed_overrides_the_setting(self):
+        self.feed.retention_days = 60
+
+        self.assertEqual(prune_posts(self.feed), 0)
+
+    def test_reject_a_retention_shorter_than_a_day(self):
+        self.feed.retention_days = 0
+
+        with self.assertRaises(ValidationError):
+            self.feed.full_clean()
+
+    @override_settings(POST_RETENTION_DAYS=30)
+    def test_keep_posts_of_a_stored_retention_shorter_than_a_day(self):
+
+        """
+        A retention of 0 days stored before validation keeps the posts
+        """
+
+        Feed.objects.filter(id=self.feed.id).update(retention_days=0)
+        self.feed.refresh_from_db()
+
+        with self.assertLogs('dashboard.services', 'WARNING'):
+            self.assertIsNone(retention_cutoff(self.feed))
+            self.assertEqual(prune_posts(self.feed), 0)
+
+
+class SubscribeTests(TestCase):
+
+    """
+    Test subscriptions and the count of subscribers of feeds
+    """
+
+    def test_subscribe_and_unsubscribe(self):
+        feed = create_a_feed()
+        user = User.objects.create_user("alex", password="passpass")
+        other_user = User.objects.create_user("alex2", password="passpass")
+
+        subscribe(user, feed)
+        subscribe(user, feed)
+        subscribe(other_user, feed)
+        self.assertEqual(Feed.objects.get(id=feed.id).subscribers_count, 2)
+
+        unsubscribe(user, feed)
+        unsubscribe(user, feed)
+        self.assertEqual(Feed.objects.get(id=feed.id).subscribers_count, 1)
+
+    def test_unsubscribe_forgets_the_states_of_posts(self):
+        feed = create_a_feed()
+        user = User.objects.create_user("alex", password="passpass")
+        post = Post.objects.create(name="a", slug="a", content="", feed=feed, url="http://upidev.fr")
+
+        subscribe(user, feed)
+        UserPost.objects.create(user=user, post=post, state=UserPost.FAVORITE)
+
+        # Celery tasks run eagerly in tests
+        unsubscribe(user, feed)
+
+        self.assertFalse(UserPost.objects.exists())
+
+    def test_count_subscribers_of_feeds(self):
+        feed = create_a_feed()
+        Feed.objects.create(
+            name="Other", slug="other", url="http://upidev.fr", subscribers_count=3
+        )
+        Subscription.objects.create(user=User.objects.create_user("alex"), feed=feed)
+
+        with self.assertNumQueries(1):
+            refresh_subscriber_counts()
+
+        self.assertEqual(
+            dict(Feed.objects.values_list('slug', 'subscribers_count')),
+            {'python-planet': 1, 'other': 0}
+        )
+
+
+class RefreshKeywordCountsTests(TestCase):
+
+    """
+    Test the count of feeds using a keyword
+    """
+
+    def test_count_feeds_of_keywords(self):
+        create_a_feed()
+        other_feed = Feed.objects.create(name="Other", slug="other", url="http://upidev.fr")
+        other_feed.keywords.add(Keyword.objects.get(name="python"))
+        Keyword.objects.create(name="unused", feeds_count=3)
+
+        with self.assertNumQueries(1):
+            refresh_keyword_counts()
+
+        self.assertEqual(
+            dict(Keyword.objects.values_list('name', 'feeds_count')),
+            {'django': 1, 'python': 2, 'flask': 1, 'unused': 0}
+        )
+
+
+class AddFeedKeywordsTests(TestCase):
+
+    """
+    Test the bulk link of a feed to the keywords of tags
+    """
+
+    def test_link_existing_and_new_keywords(self):
+        create_a_feed()
+        other_feed = Feed.objects.create(name="Other", slug="other", url="http://upidev.fr")
+
+        # Inserts run in savepoints
+        with self.assertNumQueries(9):
+            new_ids = add_feed_keywords(other_feed, ["Python", "Machine Learning", "python", "!"])
+
+        self.assertEqual(
+            set(other_feed.keywords.values_list('name', flat=True)),
+            {'python', 'machine-learning'}
+        )
+        self.assertEqual(new_ids, set(other_feed.keywords.values_list('id', flat=True)))
+        self.assertEqual(Keyword.objects.count(), 4)
+
+    def test_skip_linked_keywords(self):
+        feed = create_a_feed()
+
+        self.assertEqual(add_feed_keywords(feed, ["Django", "Flask"]), set())
+        self.assertEqual(add_feed_keywords(feed, []), set())
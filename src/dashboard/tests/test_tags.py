@@ -0,0 +1,93 @@
+from django.contrib.auth.models import User
+from django.test import TestCase
+from dashboard.models import Comment, Post
+from dashboard.templatetags.custom_tags import comments
+from .test_models import create_a_feed, init_post
+
+
+class CommentsTagTests(TestCase):
+
+    """
+    Test the comment tree template tag
+    """
+
+    def setUp(self):
+        post = init_post(create_a_feed())
+        self.alex = User.objects.create_user('alex', password='passpass')
+        bob = User.objects.create_user('bob', password='passpass')
+
+        self.first = Comment.objects.create(user=self.alex, post=post, content="<p>first</p>")
+        self.reply = Comment.objects.create(
+            user=bob, post=post, content="<p>reply</p>", parent=self.first
+        )
+        self.deep = Comment.objects.create(
+            user=self.alex, post=post, content="<p>deep</p>", parent=self.reply
+        )
+        self.second_reply = Comment.objects.create(
+            user=self.alex, post=post, content="<p>second reply</p>", parent=self.first
+        )
+        self.second = Comment.objects.create(user=bob, post=post, content="<p>second</p>")
+        self.post = post
+
+    def test_render_the_tree(self):
+
+        """
+        Render nested comments with their height and actions
+        """
+
+        expected = (
+            "</div><div class='comment comment-0'><b>alex</b> | <a href='/dashboard/comments/{first}/edit'> Edit </a>"
+            "<br><div class='comment-content'><p>first</p></div>"
+            "</div><div class='comment comment-1'><b>bob</b> | <a href='/dashboard/comments/{reply}/reply'> Reply </a>"
+            "<br><div class='comment-content'><p>reply</p></div>"
+            "</div><div class='comment comment-2'><b>alex</b> | <a href='/dashboard/comments/{deep}/edit'> Edit </a>"
+            "<br><div class='comment-content'><p>deep</p></div>"
+            "</div><div class='comment comment-1'><b>alex</b> | <a href='/dashboard/comments/{second_reply}/edit'> Edit </a>"
+            "<br><div class='comment-content'><p>second reply</p></div>"
+            "</div><div class='comment comment-0'><b>bob</b> | <a href='/dashboard/comments/{second}/reply'> Reply </a>"
+            "<br><div class='comment-content'><p>second</p></div>"
+        ).format(
+            first=self.first.id, reply=self.reply.id, deep=self.deep.id,
+            second_reply=self.second_reply.id, second=self.second.id
+        )
+
+        ids = [self.first.id, self.second.id]
+
+        self.assertEqual(comments(ids, 0, True, self.alex.id), expected)
+
+    def test_render_the_tree_in_one_query(self):
+
+        """
+        The number of queries does not depend on the number of comments
+        """
+
+        ids = [self.first.id, self.second.id]
+
+        with self.assertNumQueries(1):
+            comments(ids, 0, True, self.alex.id)
+
+    def test_render_a_single_comment(self):
+
+        """
+        Render the subtree of a single comment
+        """
+
+        content = comments(self.deep.id, 0, True, self.alex.id)
+
+        self.assertIn("<p>deep</p>", content)
+        self.assertNotIn("<p>first</p>", content)
+
+    def test_render_replies_posted_on_another_post(self):
+
+        """
+        Replies are found by their parent, whatever their post
+        """
+
+        other_post = Post.objects.create(
+            name="Other", slug="other", content="", feed=self.post.feed, url="http://upidev.fr"
+        )
+        Comment.objects.create(
+            user=self.alex, post=other_post, content="<p>elsewhere</p>", parent=self.deep
+        )
+
+        self.assertIn("<p>elsewhere</p>", comments(self.first.id, 0, True, self.alex.id))
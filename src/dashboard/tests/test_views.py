@@ -1,12 +1,20 @@
-from datetime import datetime, date
-from django.test import TestCase
+from datetime import datetime, date, timedelta
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.cache import cache
 from django.shortcuts import reverse
 from django.core.exceptions import ObjectDoesNotExist
-from django.db.models.query import QuerySet
 from django.contrib.auth.models import User
 from django.core.paginator import Page
 import pytz
-from dashboard.models import Feed, Subscription, Post, UserPost, Comment
+from unittest.mock import patch
+from rsscatcher.fetcher import FetchResult
+from rsscatcher.tasks import onboard_feed
+from dashboard.counters import cache_key
+from dashboard.dates import today_range, user_timezone
+from dashboard.onboarding import PENDING, get_onboarding_status, set_onboarding_status
+from dashboard.models import Feed, Keyword, Subscription, Post, UserPost, Comment, Profile
 
 
 def init_feed():
@@ -117,9 +125,38 @@ class DashboardViewTests(TestCase):
         self.assertRedirects(response, "/dashboard/filter/today")
 
 
+RSS_DOCUMENT = b"""<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"><channel>
+    <title>Graphic Design</title>
+    <link>http://rss.marketingprofs.com/</link>
+    <item>
+        <title>Colors</title><link>http://rss.marketingprofs.com/colors</link>
+        <description>About colors</description><category>Design</category>
+        <pubDate>Mon, 02 Jul 2018 10:00:00 GMT</pubDate>
+    </item>
+    <item>
+        <title>Fonts</title><link>http://rss.marketingprofs.com/fonts</link>
+        <description>About fonts</description>
+        <pubDate>Sun, 01 Jul 2018 10:00:00 GMT</pubDate>
+    </item>
+</channel></rss>"""
+
+
+def fake_fetch(self, feed):
+
+    """
+    Fake download of a feed, any other url is a web page
+    """
+
+    if feed.url.startswith("http://rss.marketingprofs.com/"):
+        return FetchResult(feed, 200, RSS_DOCUMENT, {'etag': '"v1"'}, None)
+    return FetchResult(feed, 200, b"<html><body>Hello</body></html>", {}, None)
+
+
 class DiscoverViewTests(TestCase):
 
     def setUp(self):
+        cache.clear()
         self.feed = init_feed()
         self.users = init_users()
 
@@ -141,6 +178,59 @@ class DiscoverViewTests(TestCase):
         first_feed = response.context['sources'][0]
         self.assertEqual(first_feed.keywords.count(), 3)
 
+    def test_paginate_sources_the_most_followed_first(self):
+
+        """
+        Sources are paginated without counting them, the most followed first
+        """
+
+        for i in range(4):
+            Feed.objects.create(
+                name="Feed {}".format(i), slug="feed-{}".format(i),
+                url="http://upidev.fr", subscribers_count=i
+            )
+
+        response = self.client.get(reverse('dashboard-discover'))
+
+        self.assertEqual(
+            [feed.slug for feed in response.context['sources']], ["feed-3", "feed-2", "feed-1"]
+        )
+        self.assertContains(response, "?page=2")
+
+        response = self.client.get(reverse('dashboard-discover'), {'page': 2})
+
+        self.assertEqual(
+            [feed.slug for feed in response.context['sources']], ["python-planet", "feed-0"]
+        )
+        self.assertFalse(response.context['page_obj'].has_next())
+        self.assertEqual(
+            self.client.get(reverse('dashboard-discover'), {'page': 3}).status_code, 404
+        )
+
+    def test_list_sources_with_a_constant_number_of_queries(self):
+
+        """
+        Followed flags and keywords do not cost a query per source
+        """
+
+        Subscription.objects.create(user=self.users[0]['user'], feed=self.feed)
+
+        with CaptureQueriesContext(connection) as one:
+            response = self.client.get(reverse('dashboard-discover'))
+
+        self.assertContains(response, "Following", count=1)
+
+        for i in range(2):
+            feed = Feed.objects.create(name="Feed {}".format(i), slug="feed-{}".format(i))
+            feed.keywords.create(name="keyword-{}".format(i))
+
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(reverse('dashboard-discover'))
+
+        self.assertContains(response, "Following", count=1)
+        self.assertContains(response, "Follow Me", count=2)
+        self.assertEqual(len(one), len(many))
+
     def test_can_filter_feeds_for_a_keyword(self):
 
         """
@@ -163,6 +253,68 @@ class DiscoverViewTests(TestCase):
 
         self.assertEqual(len(response.context['sources']), python_feed_count)
 
+    def test_can_filter_feeds_for_a_partial_name_or_keyword(self):
+
+        """
+        Names match anywhere and keywords match by prefix
+        """
+
+        response = self.client.post(
+            reverse('dashboard-discover'), {'search-input': 'planet'})
+
+        self.assertEqual(list(response.context['sources']), [self.feed])
+
+        response = self.client.post(
+            reverse('dashboard-discover'), {'search-input': 'Fla'})
+
+        self.assertEqual(list(response.context['sources']), [self.feed])
+
+    def test_autocomplete(self):
+
+        """
+        Suggest feeds and keywords, the most used keywords first
+        """
+
+        feed2 = Feed.objects.create(
+            name="Flask Weekly", slug="flask-weekly", url="http://upidev.fr"
+        )
+        feed2.keywords.create(name="flask-tips", feeds_count=1)
+        Keyword.objects.filter(name="flask").update(feeds_count=2)
+
+        response = self.client.get(
+            reverse('dashboard-discover-autocomplete'), {'q': 'fla'})
+
+        self.assertEqual(response.json(), {
+            'feeds': [{'name': 'Flask Weekly', 'slug': 'flask-weekly'}],
+            'keywords': ['flask', 'flask-tips']
+        })
+
+        with self.assertNumQueries(2):
+            # Session and user lookups only
+            self.client.get(reverse('dashboard-discover-autocomplete'), {'q': 'FLA'})
+
+    def test_autocomplete_matches_short_terms_by_prefix(self):
+
+        """
+        Terms too short for trigrams match the beginning of feed names
+        """
+
+        Feed.objects.create(name="Flask Weekly", slug="flask-weekly", url="http://upidev.fr")
+        Feed.objects.create(name="Web news", slug="web-news", url="http://upidev.fr")
+
+        response = self.client.get(
+            reverse('dashboard-discover-autocomplete'), {'q': 'we'})
+
+        self.assertEqual(
+            response.json()['feeds'], [{'name': 'Web news', 'slug': 'web-news'}]
+        )
+
+    def test_autocomplete_needs_a_few_letters(self):
+        response = self.client.get(
+            reverse('dashboard-discover-autocomplete'), {'q': 'f'})
+
+        self.assertEqual(response.json(), {'feeds': [], 'keywords': []})
+
     def test_can_filter_feeds_for_a_name(self):
 
         """
@@ -193,6 +345,7 @@ class DiscoverViewTests(TestCase):
 
         self.assertEqual(len(response.context['sources']), python_feed_count)
 
+    @patch("rsscatcher.tasks.FeedFetcher.fetch", fake_fetch)
     def test_can_create_feed_for_an_unknown_url(self):
 
         """
@@ -212,6 +365,101 @@ class DiscoverViewTests(TestCase):
             len(response.context['sources'])
         )
 
+
+    @patch("rsscatcher.tasks.FeedFetcher.fetch", fake_fetch)
+    def test_ingest_entries_of_an_onboarded_feed(self):
+
+        """
+        Entries of the downloaded document are ingested at once
+        """
+
+        url = "http://rss.marketingprofs.com/marketingprofs/graphic-design"
+
+        self.client.post(reverse('dashboard-discover'), {'search-input': url})
+
+        feed = Feed.objects.get(url=url)
+        self.assertEqual(feed.slug, "graphic-design")
+        self.assertEqual(feed.etag, '"v1"')
+        self.assertEqual(
+            set(feed.post_set.values_list('slug', flat=True)), {"colors", "fonts"}
+        )
+        self.assertEqual(list(feed.keywords.values_list('name', flat=True)), ["design"])
+
+        response = self.client.get(reverse('dashboard-discover-onboarding'), {'url': url})
+
+        self.assertEqual(response.json(), {'status': 'ready', 'feed': feed.id})
+
+    def test_coalesce_onboardings_of_a_url(self):
+
+        """
+        A url is not downloaded again while its onboarding is pending
+        """
+
+        url = "http://rss.marketingprofs.com/pending"
+        set_onboarding_status(url, PENDING)
+
+        with patch("rsscatcher.tasks.onboard_feed.delay") as delay:
+            response = self.client.post(reverse('dashboard-discover'), {'search-input': url})
+
+        delay.assert_not_called()
+        self.assertEqual(response.context['onboarding']['status'], PENDING)
+        self.assertContains(response, 'data-status="pending"')
+
+    def test_remember_urls_which_are_not_feeds(self):
+
+        """
+        A web page is downloaded once and reported as invalid
+        """
+
+        url = "http://upidev.fr/about"
+
+        with patch("rsscatcher.tasks.FeedFetcher.fetch", autospec=True,
+                   side_effect=fake_fetch) as fetch:
+            self.client.post(reverse('dashboard-discover'), {'search-input': url})
+            response = self.client.post(reverse('dashboard-discover'), {'search-input': url})
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertFalse(Feed.objects.filter(url=url).exists())
+        self.assertEqual(response.context['onboarding']['status'], 'invalid')
+        self.assertContains(response, "is not a feed")
+
+    @patch("rsscatcher.tasks.FeedFetcher.fetch", fake_fetch)
+    def test_onboard_a_url_once(self):
+
+        """
+        A url onboarded again, once its status expired, keeps its feed
+        """
+
+        url = "http://rss.marketingprofs.com/marketingprofs/graphic-design"
+
+        feed_id = onboard_feed(url)['feed']
+        cache.clear()
+
+        self.assertEqual(onboard_feed(url), {'feed': feed_id, 'posts': 0})
+        self.assertEqual(Feed.objects.filter(url=url).count(), 1)
+        self.assertEqual(get_onboarding_status(url), {'status': 'ready', 'feed': feed_id})
+
+    @patch("rsscatcher.tasks.FeedFetcher.fetch", fake_fetch)
+    def test_look_up_another_slug_taken_meanwhile(self):
+        url = "http://rss.marketingprofs.com/marketingprofs/graphic-design"
+
+        with patch("dashboard.onboarding.unique_feed_slug",
+                   side_effect=[self.feed.slug, "graphic-design-2"]):
+            onboard_feed(url)
+
+        self.assertEqual(Feed.objects.get(url=url).slug, "graphic-design-2")
+
+    @patch("rsscatcher.tasks.FeedFetcher.fetch", fake_fetch)
+    def test_failed_onboarding_is_not_left_pending(self):
+        url = "http://rss.marketingprofs.com/marketingprofs/graphic-design"
+        set_onboarding_status(url, PENDING)
+
+        with patch("rsscatcher.tasks.synchronize_feed", side_effect=ValueError("broken")):
+            with self.assertRaises(ValueError):
+                onboard_feed(url)
+
+        self.assertEqual(get_onboarding_status(url)['status'], 'invalid')
+
     def test_can_subscribe_to_a_feed(self):
 
         """
@@ -234,8 +482,13 @@ class DiscoverViewTests(TestCase):
             user_subscriptions_count + 1,
             Subscription.objects.filter(user=user).count()
         )
+        self.assertEqual(Feed.objects.get(id=self.feed.id).subscribers_count, 1)
 
-        self.assertEqual(UserPost.objects.count(), posts_count)
+        # Posts of the feed are unread without storing user posts
+        self.assertEqual(UserPost.objects.count(), 0)
+        self.assertEqual(
+            Post.objects.for_user(user, UserPost.UNREAD).count(), posts_count
+        )
 
     def test_can_unsubscribe_for_a_feed(self):
 
@@ -280,6 +533,21 @@ class FeedViewTests(TestCase):
         response = self.client.get('/dashboard/feed/python-planet/')
         self.assertEqual(len(response.context['posts']), 2)
 
+    def test_list_summaries_without_contents(self):
+
+        """
+        Lists render the stored summary and do not load the content
+        """
+
+        Post.objects.filter(feed=self.feed).update(summary="Stored summary")
+
+        response = self.client.get('/dashboard/feed/python-planet/')
+
+        self.assertContains(response, "Stored summary", count=2)
+        self.assertNotContains(response, "Lorem Ipsum")
+        for post in response.context['posts']:
+            self.assertEqual(post.get_deferred_fields(), {'content', 'search_vector'})
+
     def test_can_display_feed_info_for_slug(self):
 
         """
@@ -288,7 +556,7 @@ class FeedViewTests(TestCase):
 
         response = self.client.get('/dashboard/feed/python-planet/')
         self.assertTrue(response.context['feed'])
-        self.assertIsInstance(response.context['posts'], QuerySet)
+        self.assertIsInstance(response.context['posts'], list)
         self.assertIsInstance(response.context['page_obj'], Page)
 
     def test_can_display_a_post(self):
@@ -352,9 +620,10 @@ class PostViewTests(TestCase):
             user=self.user, post__slug='python-2-7-countdown').state
         self.assertEqual(state, 'unread')
 
-        self.client.get(
+        response = self.client.post(
             '/dashboard/feed/python-planet/posts/python-2-7-countdown/read'
         )
+        self.assertEqual(response.json(), {'state': 'read', 'changed': True})
 
         state = UserPost.objects.get(
             user=self.user, post__slug='python-2-7-countdown').state
@@ -372,9 +641,10 @@ class PostViewTests(TestCase):
 
         self.assertEqual(state, 'unread')
 
-        self.client.get(
+        response = self.client.post(
             '/dashboard/feed/python-planet/posts/python-2-7-countdown/favorite'
         )
+        self.assertEqual(response.json(), {'state': 'favorite', 'changed': True})
 
         state = UserPost.objects.get(
             user=self.user, post__slug='python-2-7-countdown').state
@@ -392,15 +662,85 @@ class PostViewTests(TestCase):
 
         self.assertEqual(state, 'unread')
 
-        self.client.get(
+        response = self.client.post(
             '/dashboard/feed/python-planet/posts/python-2-7-countdown/readlater'
         )
+        self.assertEqual(response.json(), {'state': 'readlater', 'changed': True})
 
         state = UserPost.objects.get(
             user=self.user, post__slug='python-2-7-countdown').state
 
         self.assertEqual(state, 'readlater')
 
+    def test_change_a_state_with_a_single_write(self):
+
+        """
+        A state change is a single conditional write, which writes nothing
+        if the state is unchanged
+        """
+
+        url = '/dashboard/feed/python-planet/posts/python-2-7-countdown/favorite'
+        self.client.post(url)
+
+        # Session, user, post and conditional upsert
+        with self.assertNumQueries(4):
+            response = self.client.post(
+                '/dashboard/feed/python-planet/posts/python-2-7-countdown/readlater'
+            )
+        self.assertTrue(response.json()['changed'])
+
+        with self.assertNumQueries(4):
+            response = self.client.post(
+                '/dashboard/feed/python-planet/posts/python-2-7-countdown/readlater'
+            )
+        self.assertFalse(response.json()['changed'])
+
+    def test_reject_unknown_states_and_get_requests(self):
+
+        """
+        States are changed by a POST with a known state
+        """
+
+        url = '/dashboard/feed/python-planet/posts/python-2-7-countdown/'
+
+        self.assertEqual(self.client.post(url + 'deleted').status_code, 400)
+        self.assertEqual(self.client.get(url + 'read').status_code, 405)
+
+    def test_only_display_posts_of_followed_feeds(self):
+
+        """
+        A post of a feed the user does not follow is not found
+        """
+
+        Subscription.objects.filter(user=self.user).delete()
+
+        response = self.client.get('/dashboard/feed/python-planet/posts/python-2-7-countdown')
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.post(
+            '/dashboard/feed/python-planet/posts/python-2-7-countdown/read'
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_load_the_post_in_a_single_query(self):
+
+        """
+        The post is loaded with its feed and its state in one query
+        """
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(
+                '/dashboard/feed/python-planet/posts/python-2-7-countdown'
+            )
+
+        self.assertEqual(response.context['state'], 'unread')
+        post_queries = [
+            query for query in queries
+            if query['sql'].startswith('SELECT') and 'FROM "dashboard_post"' in query['sql']
+        ]
+        self.assertEqual(len(post_queries), 1)
+        self.assertIn('"dashboard_feed"."slug"', post_queries[0]['sql'])
+
     def test_can_return_comments_for_the_post(self):
 
         """
@@ -413,6 +753,32 @@ class PostViewTests(TestCase):
 
         self.assertTrue(response.context['root_comment_ids'])
 
+    def test_only_return_root_comments_of_the_post(self):
+
+        """
+        Replies and comments of other posts are not root comments of the post
+        """
+
+        post = Post.objects.get(slug='python-2-7-countdown')
+        root = Comment.objects.filter(post=post).first()
+        Comment.objects.create(
+            user=self.user, content="Reply", post=post, parent=root
+        )
+        Comment.objects.create(
+            user=self.user, content="Elsewhere",
+            post=Post.objects.exclude(pk=post.pk).first()
+        )
+
+        response = self.client.get(
+            '/dashboard/feed/python-planet/posts/python-2-7-countdown'
+        )
+
+        self.assertEqual(
+            response.context['root_comment_ids'],
+            list(Comment.objects.filter(post=post, parent__isnull=True)
+                 .order_by('id').values_list('id', flat=True))
+        )
+
     def test_can_add_a_comment(self):
 
         """
@@ -433,6 +799,273 @@ class PostViewTests(TestCase):
         )
 
 
+class SidebarViewTests(TestCase):
+
+    def setUp(self):
+
+        cache.clear()
+
+        self.feed = init_feed()
+
+        users = init_users()
+        self.user = users[0]['user']
+
+        Subscription.objects.create(feed=self.feed, user=self.user)
+
+        UserPost.objects.create(
+            user=self.user, post=Post.objects.get(slug="python-2-7-countdown"),
+            state="favorite"
+        )
+
+        self.client.login(
+            username=users[0]['username'], password=users[0]['password']
+        )
+
+    def test_can_return_counters(self):
+
+        """
+        Can return posts count of each feed and each state
+        """
+
+        # The unread post is published today
+        Post.objects.filter(slug="python-3-4-countdown").update(published_date=datetime.now(pytz.utc))
+
+        with self.assertNumQueries(5):
+            # Session, user, timezone, feeds and state counters
+            response = self.client.get(reverse('dashboard-sidebar'))
+
+        self.assertEqual(response.json(), {
+            'feeds': [{'name': 'Python Planet', 'slug': 'python-planet', 'posts_count': 2}],
+            'today-posts-count': 1,
+            'read-posts-count': 0,
+            'unread-posts-count': 1,
+            'readlater-posts-count': 0,
+            'favorite-posts-count': 1
+        })
+
+    def test_counters_are_cached(self):
+
+        """
+        Counters are computed once until they are invalidated
+        """
+
+        self.client.get(reverse('dashboard-sidebar'))
+
+        with self.assertNumQueries(2):
+            # Session and user lookups only
+            self.client.get(reverse('dashboard-sidebar'))
+
+    def test_counters_are_invalidated_by_a_state_change(self):
+
+        """
+        Changing the state of a post updates the counters
+        """
+
+        self.client.get(reverse('dashboard-sidebar'))
+
+        self.client.post(
+            '/dashboard/feed/python-planet/posts/python-3-4-countdown/readlater'
+        )
+
+        response = self.client.get(reverse('dashboard-sidebar'))
+
+        self.assertEqual(response.json()['readlater-posts-count'], 1)
+        self.assertEqual(response.json()['unread-posts-count'], 0)
+
+    def test_can_revalidate_counters_with_etag(self):
+
+        """
+        Unchanged counters are answered by a 304
+        """
+
+        response = self.client.get(reverse('dashboard-sidebar'))
+
+        response = self.client.get(
+            reverse('dashboard-sidebar'), HTTP_IF_NONE_MATCH=response['ETag']
+        )
+
+        self.assertEqual(response.status_code, 304)
+
+
+class ProfileViewTests(TestCase):
+
+    def setUp(self):
+
+        cache.clear()
+
+        users = init_users()
+        self.user = users[0]['user']
+
+        self.client.login(
+            username=users[0]['username'], password=users[0]['password']
+        )
+
+    def test_detect_the_timezone_until_a_profile_is_saved(self):
+
+        """
+        The browser timezone is preselected for users without profile
+        """
+
+        response = self.client.get(reverse('dashboard-profile'))
+
+        self.assertTrue(response.context['detect_timezone'])
+        self.assertContains(response, "resolvedOptions().timeZone")
+
+    def test_save_the_timezone_of_the_user(self):
+
+        """
+        The day of the user and the sidebar counters follow the saved timezone
+        """
+
+        self.client.get(reverse('dashboard-sidebar'))
+
+        response = self.client.post(reverse('dashboard-profile'), {'timezone': "Europe/Paris"})
+
+        self.assertRedirects(response, reverse('dashboard-profile'))
+        self.assertEqual(user_timezone(self.user).zone, "Europe/Paris")
+        self.assertIsNone(cache.get(cache_key(self.user.id)))
+
+        response = self.client.get(reverse('dashboard-profile'))
+        self.assertFalse(response.context['detect_timezone'])
+        self.assertEqual(response.context['form'].instance.timezone, "Europe/Paris")
+
+    def test_reject_an_unknown_timezone(self):
+        response = self.client.post(reverse('dashboard-profile'), {'timezone': "Mars/Olympus"})
+
+        self.assertTrue(response.context['form'].errors)
+        self.assertFalse(Profile.objects.filter(user=self.user).exists())
+
+
+class FeedAdminTests(TestCase):
+
+    def setUp(self):
+
+        self.feed = init_feed()
+        User.objects.create_superuser("admin", "admin@upidev.fr", "adminadmin")
+        self.client.login(username="admin", password="adminadmin")
+
+    def test_can_remove_feeds_in_the_background(self):
+
+        """
+        Feeds are removed by a task instead of the admin delete views
+        """
+
+        response = self.client.post(reverse('admin:dashboard_feed_changelist'), {
+            'action': 'remove_in_background', '_selected_action': [self.feed.id]
+        })
+
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Feed.objects.exists())
+        self.assertFalse(Post.objects.exists())
+
+        response = self.client.get(reverse('admin:dashboard_feed_delete', args=[self.feed.id]))
+        self.assertEqual(response.status_code, 403)
+
+
+class MarkReadViewTests(TestCase):
+
+    def setUp(self):
+
+        cache.clear()
+
+        self.feed = init_feed()
+
+        users = init_users()
+        self.user = users[0]['user']
+
+        Subscription.objects.create(feed=self.feed, user=self.user)
+
+        self.client.login(
+            username=users[0]['username'], password=users[0]['password']
+        )
+
+    def test_can_mark_a_feed_as_read(self):
+
+        """
+        Marking a feed as read answers the updated counters
+        """
+
+        self.client.get(reverse('dashboard-sidebar'))
+
+        response = self.client.post(reverse('dashboard-mark-read'), {'feed': 'python-planet'})
+
+        self.assertEqual(response.json()['unread-posts-count'], 0)
+        self.assertEqual(response.json()['read-posts-count'], 2)
+        self.assertFalse(UserPost.objects.exists())
+
+    def test_can_mark_today_posts_as_read(self):
+
+        """
+        Only posts of the day are marked as read by the today filter
+        """
+
+        response = self.client.post(reverse('dashboard-mark-read'), {'filter': 'today'})
+
+        self.assertEqual(response.json()['today-posts-count'], 0)
+        self.assertEqual(response.json()['unread-posts-count'], 1)
+
+    def test_can_mark_a_time_range_as_read(self):
+
+        """
+        Posts published in a time range are marked as read
+        """
+
+        response = self.client.post(reverse('dashboard-mark-read'), {
+            'start': '2015-01-01T00:00:00', 'end': '2016-01-01T00:00:00+00:00'
+        })
+
+        self.assertEqual(response.json()['read-posts-count'], 1)
+        self.assertEqual(
+            Post.objects.for_user(self.user, UserPost.READ).get().slug, "python-3-4-countdown"
+        )
+
+    def test_reject_invalid_parameters(self):
+
+        """
+        Unknown filters and invalid dates are rejected, unfollowed feeds are not found
+        """
+
+        response = self.client.post(reverse('dashboard-mark-read'), {'filter': 'favorite'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(reverse('dashboard-mark-read'), {'start': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(reverse('dashboard-mark-read'), {'feed': 'unknown'})
+        self.assertEqual(response.status_code, 404)
+
+        self.assertEqual(self.client.get(reverse('dashboard-mark-read')).status_code, 405)
+
+    def test_can_mark_a_batch_of_posts_as_read(self):
+
+        """
+        Posts seen while scrolling are marked as read together
+        """
+
+        post = Post.objects.get(slug="python-2-7-countdown")
+
+        response = self.client.post(reverse('dashboard-read-posts'), {'ids': [post.id]})
+
+        self.assertEqual(response.json()['read-posts-count'], 1)
+        self.assertEqual(response.json()['unread-posts-count'], 1)
+        self.assertEqual(UserPost.objects.get(user=self.user).post, post)
+
+    @override_settings(READ_BATCH_MAX_POSTS=1)
+    def test_reject_invalid_batches(self):
+
+        """
+        Batches are limited in size and only contain post ids
+        """
+
+        response = self.client.post(reverse('dashboard-read-posts'), {'ids': ['a']})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(reverse('dashboard-read-posts'), {'ids': [1, 2]})
+        self.assertEqual(response.status_code, 400)
+
+        self.assertFalse(UserPost.objects.exists())
+
+
 class FilterViewTests(TestCase):
 
     def setUp(self):
@@ -470,12 +1103,37 @@ class FilterViewTests(TestCase):
         posts = response.context['posts']
         for post in posts:
             self.assertEqual(post.published_date.date(), date.today())
-            userpost = UserPost.objects.get(user=self.user, post=post)
-            self.assertEqual(userpost.state, "unread")
+            self.assertEqual(post.state, "unread")
 
-        self.assertIsInstance(response.context['posts'], QuerySet)
+        self.assertIsInstance(response.context['posts'], list)
         self.assertIsInstance(response.context['page_obj'], Page)
 
+    def test_day_posts_follow_the_timezone_of_the_user(self):
+
+        """
+        The day of the user starts at midnight in their timezone
+        """
+
+        Profile.objects.create(user=self.user, timezone="Pacific/Kiritimati")
+        start, end = today_range(self.user)
+
+        Post.objects.filter(slug="python-2-7-countdown").update(published_date=start)
+        Post.objects.exclude(slug="python-2-7-countdown").update(
+            published_date=start - timedelta(seconds=1)
+        )
+
+        response = self.client.get('/dashboard/filter/today')
+
+        self.assertEqual(
+            [post.slug for post in response.context['posts']], ["python-2-7-countdown"]
+        )
+
+        Post.objects.filter(slug="python-2-7-countdown").update(published_date=end)
+
+        response = self.client.get('/dashboard/filter/today')
+
+        self.assertFalse(response.context['posts'])
+
     def test_can_filter_read_posts(self):
 
         """
@@ -495,7 +1153,7 @@ class FilterViewTests(TestCase):
                 'read'
             )
 
-        self.assertIsInstance(response.context['posts'], QuerySet)
+        self.assertIsInstance(response.context['posts'], list)
         self.assertIsInstance(response.context['page_obj'], Page)
 
     def test_can_filter_unread_posts(self):
@@ -509,12 +1167,9 @@ class FilterViewTests(TestCase):
         posts = response.context['posts']
 
         for post in posts:
-            self.assertEqual(
-                UserPost.objects.get(user=self.user, post=post).state,
-                'unread'
-            )
+            self.assertEqual(post.state, 'unread')
 
-        self.assertIsInstance(response.context['posts'], QuerySet)
+        self.assertIsInstance(response.context['posts'], list)
         self.assertIsInstance(response.context['page_obj'], Page)
 
     def test_can_filter_favorite_posts(self):
@@ -536,7 +1191,7 @@ class FilterViewTests(TestCase):
                 'favorite'
             )
 
-        self.assertIsInstance(response.context['posts'], QuerySet)
+        self.assertIsInstance(response.context['posts'], list)
         self.assertIsInstance(response.context['page_obj'], Page)
 
 
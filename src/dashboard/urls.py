@@ -1,14 +1,21 @@
 from django.urls import path
 from .views import (
     dashboard, FilterPosts, FeedPosts,
-    FeedPost, PostChangeState, CommentView, DiscoverView, sidebar, FeedPostNewComment
+    FeedPost, PostChangeState, CommentView, DiscoverView, sidebar, FeedPostNewComment,
+    SearchPosts, discover_autocomplete, discover_onboarding, MarkPostsRead, ReadPosts, profile
 )
 
 urlpatterns = [
     path('', dashboard, name="dashboard"),
     path('filter/<filter_state>', FilterPosts.as_view(), name="dashboard-filter"),
     path('discover/', DiscoverView.as_view(), name="dashboard-discover"),
+    path('discover/autocomplete/', discover_autocomplete, name="dashboard-discover-autocomplete"),
+    path('discover/onboarding/', discover_onboarding, name="dashboard-discover-onboarding"),
+    path('search/', SearchPosts.as_view(), name="dashboard-search"),
     path('sidebar/', sidebar, name="dashboard-sidebar"),
+    path('settings/', profile, name="dashboard-profile"),
+    path('read/', MarkPostsRead.as_view(), name="dashboard-mark-read"),
+    path('posts/read/', ReadPosts.as_view(), name="dashboard-read-posts"),
     path('comments/<comment_id>/<action>', CommentView.as_view(), name="dashboard-comments"),
     path('feed/<slug>/', FeedPosts.as_view(), name='dashboard-feed-posts'),
     path('feed/<slug_feed>/posts/<slug_post>', FeedPost.as_view(), name='dashboard-feed-post'),
@@ -1,7 +1,8 @@
-from .discover import DiscoverView
+from .discover import DiscoverView, discover_autocomplete, discover_onboarding
 from .dashboard import dashboard
+from .profile import profile
 from .sidebar import sidebar
 from .views import (
-    FeedPosts, FeedPost, PostChangeState,
-    FilterPosts, CommentView, FeedPostNewComment
+    FeedPosts, FeedPost, PostChangeState, MarkPostsRead, ReadPosts,
+    FilterPosts, SearchPosts, CommentView, FeedPostNewComment
 )
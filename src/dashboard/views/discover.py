@@ -1,41 +1,115 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth.decorators import login_required
+from django.http import JsonResponse
 from django.shortcuts import render
-from django.db.models import Q
-from feedparser import parse
-from django.utils.text import slugify
+from django.db.models import Exists, OuterRef, Q
+from django.utils.cache import patch_cache_control
 from django.core.validators import URLValidator
 from django.core.exceptions import ValidationError
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.views.generic.list import ListView
-from ..models import Feed, Subscription, Post, UserPost
+from rsscatcher.settings import RESULTS_PER_PAGE
+from ..models import Feed, Keyword, Subscription
+from ..onboarding import PENDING, get_onboarding_status, start_onboarding
+from ..pagination import UncountedPaginationMixin
+from ..services import subscribe, unsubscribe
 
+# Trigram indexes only serve terms of at least three characters
+TRIGRAM_LENGTH = 3
+
+
+def feeds_matching(search_term):
+
+    """
+    Feeds whose name contains the term, whose url is the term
+    or with a keyword starting with the term
+
+    Keywords are matched in a subquery instead of a join on the
+    feed keywords, so no DISTINCT is needed.
+    """
+
+    condition = Q(name__icontains=search_term) | Q(url=search_term)
+
+    keyword = Keyword.normalize(search_term)
+    if keyword:
+        condition |= Q(id__in=Feed.keywords.through.objects.filter(
+            keyword__name__startswith=keyword
+        ).values('feed_id'))
+
+    return Feed.objects.filter(condition)
+
+
+def listed_feeds(feeds, user):
+
+    """
+    Feeds to list, the most followed first, flagged when followed by the user
+
+    The flag is a single EXISTS subquery and keywords are prefetched, so
+    listing a page of feeds runs the same queries whatever its length.
+    """
+
+    return feeds.annotate(
+        followed=Exists(Subscription.objects.filter(user=user, feed=OuterRef('pk')))
+    ).prefetch_related('keywords').order_by('-subscribers_count', 'id')
+
+
+@login_required()
+def discover_autocomplete(request):
 
-def create_a_feed(url):
     """
-    Create a feed for an unknown source
+    Suggest feeds and keywords for the beginning of a search
+
+    Suggestions are the same for every user and cached per term. Feed
+    names contain the term, or start with it when the term is too short
+    for the trigram index.
     """
 
-    new_feed = parse(url)
-    title = new_feed.feed.title
-    url = new_feed.url
+    term = request.GET.get('q', '').strip()
+    if len(term) < settings.AUTOCOMPLETE_MIN_LENGTH:
+        return JsonResponse({'feeds': [], 'keywords': []})
 
-    Feed.objects.create(
-        name=title,
-        slug=slugify(title),
-        url=url
+    key = "discover-autocomplete-{}".format(
+        hashlib.md5(term.lower().encode('utf-8')).hexdigest()
     )
+    suggestions = cache.get(key)
 
+    if suggestions is None:
+        keyword = Keyword.normalize(term)
+        if len(term) < TRIGRAM_LENGTH:
+            feeds = Feed.objects.filter(name__istartswith=term)
+        else:
+            feeds = Feed.objects.filter(name__icontains=term)
+        suggestions = {
+            'feeds': list(feeds.order_by('name').values('name', 'slug')[:10]),
+            'keywords': list(
+                Keyword.objects.filter(name__startswith=keyword)
+                .order_by('-feeds_count', 'name').values_list('name', flat=True)[:10]
+            ) if keyword else []
+        }
+        cache.set(key, suggestions, settings.AUTOCOMPLETE_CACHE_TIMEOUT)
 
-class DiscoverView(LoginRequiredMixin, ListView):
+    response = JsonResponse(suggestions)
+    patch_cache_control(response, private=True, max_age=settings.AUTOCOMPLETE_CACHE_TIMEOUT)
+
+    return response
+
+
+class DiscoverView(LoginRequiredMixin, UncountedPaginationMixin, ListView):
 
     """
     Discover view to manage feed user subscriptions
     """
 
     model = Feed
-    queryset = Feed.objects.all()
     context_object_name = 'sources'
+    paginate_by = RESULTS_PER_PAGE
     template_name = 'dashboard/discover.html'
 
+    def get_queryset(self):
+        return listed_feeds(Feed.objects.all(), self.request.user)
+
     def post(self, request):
 
         """
@@ -44,29 +118,30 @@ class DiscoverView(LoginRequiredMixin, ListView):
         """
 
         sources = []
+        onboarding = None
 
         if request.POST.get('search-input', False):
-            search_term = request.POST['search-input']
+            search_term = request.POST['search-input'].strip()
 
             # Check if a source exist for this term
-            sources = Feed.objects.filter(
-                Q(name__iexact=search_term) |
-                Q(url=search_term) |
-                Q(keywords__name=search_term)
-            ).distinct()
+            sources = list(
+                listed_feeds(feeds_matching(search_term), request.user)
+                [:settings.DISCOVER_MAX_RESULTS]
+            )
 
             if not sources:
                 val = URLValidator()
                 try:
                     val(search_term)
 
-                    # New feed from the valid URL
-                    create_a_feed(search_term)
+                    # New feed from the valid URL, created by a celery task
+                    onboarding = start_onboarding(search_term)
+                    onboarding['url'] = search_term
 
-                    # Filter on this new feed
-                    sources = Feed.objects.filter(
-                        url__iexact=search_term
-                    )
+                    # Already there if the task is done
+                    sources = list(listed_feeds(
+                        Feed.objects.filter(url=search_term), request.user
+                    ))
 
                 except ValidationError:
                     print("search_term is not a valid URL")
@@ -75,24 +150,27 @@ class DiscoverView(LoginRequiredMixin, ListView):
             feed_to_subscribe = Feed.objects.get(id=request.POST['feed-to-follow'])
 
             if request.POST['following'] == "no":
-                Subscription.objects.create(
-                    user=request.user,
-                    feed=feed_to_subscribe
-                )
-
-                # Attached user for posts of the feed
-                for post in Post.objects.filter(feed=feed_to_subscribe):
-                    UserPost.objects.create(
-                        post=post,
-                        user=request.user
-                    )
+                subscribe(request.user, feed_to_subscribe)
             else:
-                Subscription.objects.filter(
-                    user=request.user,
-                    feed=feed_to_subscribe
-                ).delete()
+                unsubscribe(request.user, feed_to_subscribe)
+
+        return render(request, 'dashboard/discover.html', {
+            'sources': sources,
+            'onboarding': onboarding if not sources else None
+        })
+
+
+@login_required()
+def discover_onboarding(request):
+
+    """
+    Status of the onboarding of a url, polled by the discover page
+    """
+
+    status = get_onboarding_status(request.GET.get('url', '').strip())
 
-                UserPost.objects.filter(
-                    user=request.user, post__feed__exact=feed_to_subscribe).delete()
+    response = JsonResponse(status)
+    if status['status'] == PENDING:
+        patch_cache_control(response, private=True, no_cache=True)
 
-        return render(request, 'dashboard/discover.html', {'sources': sources})
+    return response
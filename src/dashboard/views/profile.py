@@ -0,0 +1,38 @@
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import redirect, render
+from ..counters import invalidate_sidebar_counters
+from ..forms import ProfileForm
+from ..models import Profile
+
+
+@login_required()
+def profile(request):
+
+    """
+    Edit the preferences of the user
+
+    Until the user saved a profile, the page preselects the timezone
+    detected by the browser.
+    """
+
+    instance = Profile.objects.filter(user=request.user).first()
+    detect_timezone = instance is None
+    if instance is None:
+        instance = Profile(user=request.user)
+
+    if request.method == "POST":
+        form = ProfileForm(request.POST, instance=instance)
+        if form.is_valid():
+            form.save()
+            # The today counter depends on the timezone
+            invalidate_sidebar_counters([request.user.id])
+            messages.success(request, 'Your settings have been saved')
+            return redirect('dashboard-profile')
+    else:
+        form = ProfileForm(instance=instance)
+
+    return render(request, 'dashboard/profile.html', {
+        'form': form,
+        'detect_timezone': detect_timezone
+    })
@@ -1,44 +1,30 @@
-from datetime import date
 from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
-from ..models import Post, Feed
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from ..counters import get_sidebar_counters
+
+
+def sidebar_etag(request):
+    if not request.user.is_authenticated:
+        return None
+    return get_sidebar_counters(request.user)[1]
 
 
 @login_required()
+@condition(etag_func=sidebar_etag)
 def sidebar(request):
 
     """
     Render data to display in the sidebar
+
+    Counters are cached per user and the browser revalidates them
+    with their ETag
     """
 
-    today = date.today()
-
-    feeds = [
-        {
-            'name': feed.name, 'slug': feed.slug, 'posts_count': feed.post_set.count()
-        }
-        for feed in Feed.objects.filter(subscription__user=request.user)
-    ]
-
-    return JsonResponse({
-        'feeds': feeds,
-        'today-posts-count': Post.objects.filter(
-            userpost__user=request.user,
-            published_date__year=today.year,
-            published_date__month=today.month,
-            published_date__day=today.day,
-            userpost__state="unread",
-        ).count(),
-        'read-posts-count': Post.objects.filter(
-            userpost__user=request.user,
-            userpost__state__exact='read').count(),
-        'unread-posts-count': Post.objects.filter(
-            userpost__user=request.user,
-            userpost__state__exact='unread').count(),
-        'readlater-posts-count': Post.objects.filter(
-            userpost__user=request.user,
-            userpost__state__exact='readlater').count(),
-        'favorite-posts-count': Post.objects.filter(
-            userpost__user=request.user,
-            userpost__state__exact='favorite').count()
-    })
+    counters, _ = get_sidebar_counters(request.user)
+
+    response = JsonResponse(counters)
+    patch_cache_control(response, private=True, no_cache=True)
+
+    return response
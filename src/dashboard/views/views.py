@@ -1,5 +1,9 @@
-from datetime import date
-from django.shortcuts import render
+from urllib.parse import urlencode
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.shortcuts import get_object_or_404, render
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django_markup.markup import formatter
@@ -7,7 +11,26 @@ from django.views.generic.list import ListView
 from django.views.generic.base import View
 
 from rsscatcher.settings import RESULTS_PER_PAGE
+from ..counters import get_sidebar_counters
 from ..models import Feed, Post, UserPost, Comment
+from ..dates import today_range
+from ..pagination import KeysetPaginationMixin
+from ..search import search_posts
+from ..services import mark_feeds_read, mark_posts_read, set_post_state
+
+
+def get_post(user, slug_feed, slug_post):
+
+    """
+    Post of a feed followed by the user, with its feed and its state
+
+    The post is loaded in a single query, Http404 is raised if the user
+    does not follow its feed.
+    """
+
+    return get_object_or_404(
+        Post.objects.for_user(user).select_related('feed'), feed__slug=slug_feed, slug=slug_post
+    )
 
 
 def get_comment_root_ids(post):
@@ -16,14 +39,13 @@ def get_comment_root_ids(post):
     Get comments who have no parents for a specific post
     """
 
-    comments = Comment.objects.filter(parent__isnull=True)
-    root_comment_ids = ",".join(
-        [str(comment.id) for comment in comments if comment.post.id == post.id])
-
-    return root_comment_ids
+    return list(
+        Comment.objects.filter(post=post, parent__isnull=True)
+        .order_by('id').values_list('id', flat=True)
+    )
 
 
-class FeedPosts(LoginRequiredMixin, ListView):
+class FeedPosts(LoginRequiredMixin, KeysetPaginationMixin, ListView):
 
     """
     Return posts for a specific feed
@@ -45,7 +67,7 @@ class FeedPosts(LoginRequiredMixin, ListView):
         return context
 
     def get_queryset(self):
-        return Post.objects.filter(feed__slug=self.kwargs['slug'])
+        return Post.objects.filter(feed__slug=self.kwargs['slug']).for_list()
 
 
 class FeedPost(LoginRequiredMixin, View):
@@ -56,12 +78,11 @@ class FeedPost(LoginRequiredMixin, View):
 
     def get(self, request, slug_feed, slug_post=None):
 
-        feed = Feed.objects.get(slug=slug_feed)
-        post = Post.objects.get(slug=slug_post, feed=feed)
+        post = get_post(request.user, slug_feed, slug_post)
 
         return render(request, 'dashboard/post.html', {
             'post': post,
-            'state': post.userpost_set.get(user=request.user).state,
+            'state': post.state,
             'root_comment_ids': get_comment_root_ids(post)
         })
 
@@ -74,8 +95,7 @@ class FeedPostNewComment(LoginRequiredMixin, View):
 
     def post(self, request, slug_feed, slug_post=None):
 
-        feed = Feed.objects.get(slug=slug_feed)
-        post = Post.objects.get(slug=slug_post, feed=feed)
+        post = get_post(request.user, slug_feed, slug_post)
 
         if request.POST.get('comment-input'):
             content = request.POST.get('comment-input')
@@ -84,7 +104,7 @@ class FeedPostNewComment(LoginRequiredMixin, View):
 
         return render(request, 'dashboard/post.html', {
             'post': post,
-            'state': post.userpost_set.get(user=request.user).state,
+            'state': post.state,
             'root_comment_ids': get_comment_root_ids(post)
         })
 
@@ -92,27 +112,115 @@ class FeedPostNewComment(LoginRequiredMixin, View):
 class PostChangeState(LoginRequiredMixin, View):
 
     """
-    Update state for a user post
+    Update state for a user post, answered in JSON
     """
 
-    def get(self, request, slug_feed=None, slug_post=None, state=None):
+    def post(self, request, slug_feed=None, slug_post=None, state=None):
 
+        if state not in dict(UserPost.STATE_CHOICES):
+            return JsonResponse({'error': "Unknown state {}".format(state)}, status=400)
 
-        feed = Feed.objects.get(slug=slug_feed)
-        current_post = Post.objects.get(slug=slug_post, feed=feed)
+        # Only the columns needed to compare states
+        post = get_object_or_404(
+            Post.objects.for_user(request.user).only('id'), feed__slug=slug_feed, slug=slug_post
+        )
+        changed = set_post_state(request.user, post, state)
 
-        if state is not None:
-            userpost = UserPost.objects.get(user=request.user, post=current_post)
-            userpost.state = state
-            userpost.save()
+        return JsonResponse({'state': state, 'changed': changed})
 
-        return render(request, 'dashboard/post.html', {
-            'post': current_post, 'state': state,
-            'root_comment_ids': get_comment_root_ids(current_post)
-        })
 
+def parse_aware_datetime(value):
+
+    """
+    Parse an ISO 8601 datetime, naive ones are in the current timezone
+
+    :raise ValueError: if the value is not a datetime
+    """
+
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError("Invalid datetime {}".format(value))
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+
+    return parsed
 
-class FilterPosts(LoginRequiredMixin, ListView):
+
+class MarkPostsRead(LoginRequiredMixin, View):
+
+    """
+    Mark every unread post of a feed, a filter or a time range as read
+
+    Without a time range, the read watermarks of the subscriptions move
+    in a single UPDATE. The updated sidebar counters are answered in JSON.
+    """
+
+    def post(self, request):
+
+        user = request.user
+        feeds = None
+        start, end = None, None
+
+        if request.POST.get('feed'):
+            feeds = [get_object_or_404(Feed, subscription__user=user, slug=request.POST['feed'])]
+
+        filter_state = request.POST.get('filter', UserPost.UNREAD)
+        if filter_state == 'today':
+            start, end = today_range(user)
+        elif filter_state != UserPost.UNREAD:
+            return JsonResponse({'error': "Unknown filter {}".format(filter_state)}, status=400)
+
+        try:
+            if request.POST.get('start'):
+                start = parse_aware_datetime(request.POST['start'])
+            if request.POST.get('end'):
+                end = parse_aware_datetime(request.POST['end'])
+        except ValueError as error:
+            return JsonResponse({'error': str(error)}, status=400)
+
+        if start is None and end is None:
+            mark_feeds_read(user, feeds)
+        else:
+            posts = Post.objects.all()
+            if feeds is not None:
+                posts = posts.filter(feed__in=feeds)
+            if start is not None:
+                posts = posts.filter(published_date__gte=start)
+            if end is not None:
+                posts = posts.filter(published_date__lt=end)
+            mark_posts_read(user, posts)
+
+        return JsonResponse(get_sidebar_counters(user)[0])
+
+
+class ReadPosts(LoginRequiredMixin, View):
+
+    """
+    Mark as read a batch of posts seen while scrolling a list
+
+    The ids of the posts are sent in the repeated ids parameter, the
+    updated sidebar counters are answered in JSON.
+    """
+
+    def post(self, request):
+
+        try:
+            ids = set(int(post_id) for post_id in request.POST.getlist('ids'))
+        except ValueError:
+            return JsonResponse({'error': "Post ids must be integers"}, status=400)
+
+        if len(ids) > settings.READ_BATCH_MAX_POSTS:
+            return JsonResponse({
+                'error': "At most {} posts by batch".format(settings.READ_BATCH_MAX_POSTS)
+            }, status=400)
+
+        if ids:
+            mark_posts_read(request.user, Post.objects.filter(id__in=ids))
+
+        return JsonResponse(get_sidebar_counters(request.user)[0])
+
+
+class FilterPosts(LoginRequiredMixin, KeysetPaginationMixin, ListView):
 
     context_object_name = 'posts'
     paginate_by = RESULTS_PER_PAGE
@@ -123,21 +231,44 @@ class FilterPosts(LoginRequiredMixin, ListView):
         filter_state = self.kwargs['filter_state']
 
         if filter_state == "today":
-            today = date.today()
-            posts = Post.objects.filter(
-                feed__subscription__user=self.request.user,
-                published_date__year=today.year,
-                published_date__month=today.month,
-                published_date__day=today.day,
-                userpost__state="unread",
-                userpost__user=self.request.user
+            start, end = today_range(self.request.user)
+            posts = Post.objects.for_user(self.request.user, UserPost.UNREAD).filter(
+                published_date__gte=start, published_date__lt=end
             )
         else:
-            posts = Post.objects.filter(
-                userpost__user=self.request.user, userpost__state__exact=filter_state
-            )
+            posts = Post.objects.for_user(self.request.user, filter_state)
+
+        return posts.for_list()
+
+
+class SearchPosts(LoginRequiredMixin, ListView):
+
+    """
+    Search posts of the feeds followed by the user
+    """
+
+    context_object_name = 'posts'
+    paginate_by = RESULTS_PER_PAGE
+    template_name = 'dashboard/search.html'
+
+    def get_context_data(self, *, object_list=None, **kwargs):
+
+        context = super().get_context_data(**kwargs)
+
+        context['query'] = self.request.GET.get('q', '')
+        context['pagination_params'] = urlencode({'q': context['query']}) + '&'
+
+        return context
+
+    def get_queryset(self):
+
+        terms = self.request.GET.get('q', '').strip()
+        if not terms:
+            return Post.objects.none()
+
+        posts = Post.objects.for_user(self.request.user).for_list()
 
-        return posts
+        return search_posts(posts, terms, settings.SEARCH_MAX_RESULTS)
 
 
 class CommentView(LoginRequiredMixin, View):
@@ -0,0 +1,157 @@
+"""
+Download stage of the feed synchronization.
+
+Feeds are downloaded concurrently by a bounded pool of threads, with a
+limit on simultaneous connections to the same host and a timeout per
+request. Feeds of a busy host wait in a queue of their host instead of
+holding a thread of the pool. Responses larger than a maximum size, once
+decompressed, are reported as errors without being read further. Parsing
+and database writes are left to the caller, which receives each result
+as soon as its bytes have arrived.
+"""
+
+import zlib
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+from django.conf import settings
+
+NOT_MODIFIED = 304
+
+USER_AGENT = 'rsscatcher (+https://github.com/blancheta/rsscatcher)'
+
+FetchResult = namedtuple(
+    'FetchResult', ['feed', 'status', 'content', 'headers', 'error']
+)
+
+
+class ResponseTooLarge(ValueError):
+    pass
+
+
+def lower_keys(headers):
+
+    """
+    Return response headers as a dict with lowercase names
+    """
+
+    return {name.lower(): value for name, value in headers.items()}
+
+
+class FeedFetcher(object):
+
+    """
+    Fetch feeds concurrently
+
+    :param max_workers: Number of downloads running at the same time
+    :param per_host: Number of connections opened on the same host
+    :param timeout: Timeout in seconds for each request
+    :param max_size: Maximum size in bytes of a decompressed response
+    """
+
+    def __init__(self, max_workers=None, per_host=None, timeout=None, max_size=None):
+        self.max_workers = max_workers or settings.FEED_FETCH_WORKERS
+        self.per_host = per_host or settings.FEED_FETCH_PER_HOST
+        self.timeout = timeout or settings.FEED_FETCH_TIMEOUT
+        self.max_size = max_size or settings.FEED_FETCH_MAX_SIZE
+
+    def build_request(self, feed):
+
+        """
+        Build the HTTP request sent for a feed
+
+        Validators stored on the feed make the request conditional
+        """
+
+        headers = {
+            'User-Agent': USER_AGENT,
+            'Accept-Encoding': 'gzip',
+        }
+        if feed.etag:
+            headers['If-None-Match'] = feed.etag
+        if feed.last_modified:
+            headers['If-Modified-Since'] = feed.last_modified
+
+        return Request(feed.url, headers=headers)
+
+    def read(self, response, headers):
+
+        """
+        Read and decompress the body of a response up to the maximum size
+        """
+
+        too_large = ResponseTooLarge("Response larger than {} bytes".format(self.max_size))
+
+        length = headers.get('content-length', '')
+        if length.isdigit() and int(length) > self.max_size:
+            raise too_large
+
+        content = response.read(self.max_size + 1)
+        if len(content) > self.max_size:
+            raise too_large
+
+        if headers.get('content-encoding') == 'gzip':
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            content = decompressor.decompress(content, self.max_size + 1)
+            if len(content) > self.max_size:
+                raise too_large
+
+        return content
+
+    def fetch(self, feed):
+
+        """
+        Download a single feed and never raise on network errors
+        """
+
+        try:
+            with urlopen(self.build_request(feed), timeout=self.timeout) as response:
+                headers = lower_keys(response.headers)
+                status = response.status
+                content = self.read(response, headers)
+        except HTTPError as error:
+            # A 304 answers a conditional request, it is not a failure
+            message = None if error.code == NOT_MODIFIED else str(error)
+            return FetchResult(feed, error.code, None, lower_keys(error.headers), message)
+        except (URLError, OSError, EOFError, ValueError, zlib.error) as error:
+            return FetchResult(feed, None, None, {}, str(error))
+
+        return FetchResult(feed, status, content, headers, None)
+
+    def fetch_all(self, feeds):
+
+        """
+        Download feeds concurrently and yield results in completion order
+
+        At most per_host feeds of a host are handed to the pool at once,
+        the next feed of a host is submitted when one of its downloads
+        completes. Threads never wait for a busy host while feeds of
+        other hosts are queued.
+        """
+
+        queues = OrderedDict()
+        for feed in feeds:
+            queues.setdefault(urlsplit(feed.url).netloc.lower(), deque()).append(feed)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            running = {}
+
+            def submit(host):
+                feed = queues[host].popleft()
+                if not queues[host]:
+                    del queues[host]
+                running[pool.submit(self.fetch, feed)] = host
+
+            for host in list(queues):
+                for _ in range(min(self.per_host, len(queues[host]))):
+                    submit(host)
+
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    host = running.pop(future)
+                    if host in queues:
+                        submit(host)
+                    yield future.result()
@@ -0,0 +1,164 @@
+"""
+Scheduling stage of the feed synchronization.
+
+Each feed is downloaded again after a delay learned from the timestamps
+of its recent entries: a feed publishing every hour is checked about
+every half hour while a silent feed is checked a few times a day. Hints
+sent by the publisher, the ``ttl`` element of RSS and the
+``Cache-Control`` and ``Retry-After`` headers, are honored. Failing
+feeds back off and feeds followed by many users are checked more often.
+"""
+
+import math
+import re
+from calendar import timegm
+from datetime import timedelta
+from email.utils import parsedate_to_datetime
+from django.conf import settings
+from django.utils import timezone
+
+# Number of the newest entries used to learn the cadence of a feed
+RECENT_ENTRIES = 10
+
+MAX_AGE = re.compile(r'max-age\s*=\s*(\d+)')
+
+
+def posting_interval(entries, now):
+
+    """
+    Seconds between two posts of a feed, None if entries have no date
+
+    The median gap between the newest entries is used so that a burst of
+    posts does not hide the usual cadence. A feed silent for longer than
+    its usual gap is considered as publishing at the pace of its silence.
+    """
+
+    timestamps = sorted(
+        (timegm(entry.published_parsed) for entry in entries
+         if getattr(entry, 'published_parsed', None)),
+        reverse=True
+    )[:RECENT_ENTRIES]
+
+    if not timestamps:
+        return None
+
+    gaps = sorted(newer - older for newer, older in zip(timestamps, timestamps[1:]))
+    median = gaps[len(gaps) // 2] if gaps else 0
+    silence = timegm(now.utctimetuple()) - timestamps[0]
+
+    return int(max(median, silence, 0))
+
+
+def retry_after(headers, now):
+
+    """
+    Seconds to wait given by a Retry-After header, 0 if absent
+    """
+
+    value = headers.get('retry-after', '').strip()
+    if value.isdigit():
+        return int(value)
+
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return 0
+    if date is None or date.tzinfo is None:
+        return 0
+
+    return max(int((date - now).total_seconds()), 0)
+
+
+def publisher_delay(headers, online_feed, now):
+
+    """
+    Minimum delay in seconds before the next download asked by the publisher
+    """
+
+    delays = [retry_after(headers, now)]
+
+    max_age = MAX_AGE.search(headers.get('cache-control', ''))
+    if max_age:
+        delays.append(int(max_age.group(1)))
+
+    # The ttl element of RSS is given in minutes
+    ttl = str(getattr(online_feed, 'feed', {}).get('ttl', '')).strip()
+    if ttl.isdigit():
+        delays.append(int(ttl) * 60)
+
+    return max(delays)
+
+
+def next_fetch_delay(interval, subscribers, failures=0):
+
+    """
+    Delay in seconds before the next download of a feed
+
+    :param interval: Seconds between two posts, None if unknown
+    :param subscribers: Number of users following the feed
+    :param failures: Number of downloads failed in a row
+    """
+
+    min_interval = settings.FEED_POLL_MIN_INTERVAL
+
+    if failures:
+        delay = min_interval * 2 ** min(failures, 16)
+    elif interval is None:
+        delay = min_interval
+    else:
+        # Checked twice per post, more often for popular feeds
+        delay = interval / 2 / (1 + math.log10(max(subscribers, 1)))
+
+    return int(min(max(delay, min_interval), settings.FEED_POLL_MAX_INTERVAL))
+
+
+def publication_frequency(interval):
+
+    """
+    Publication frequency of a feed posting every interval seconds
+    """
+
+    from dashboard.models import Feed
+
+    if interval <= 24 * 60 * 60:
+        return Feed.DAILY
+    if interval <= 7 * 24 * 60 * 60:
+        return Feed.WEEKLY
+    return Feed.MONTHLY
+
+
+def schedule_feed(feed, result, online_feed=None, now=None):
+
+    """
+    Fields of a feed to update after a download to schedule the next one
+
+    :param feed: Feed, its subscribers_count shortens the delay
+    :param result: Result of the download
+    :param online_feed: Parsed document, None if it was not parsed
+    """
+
+    now = now or timezone.now()
+
+    failures = feed.fetch_failures + 1 if result.error else 0
+
+    interval = feed.post_interval
+    if online_feed is not None:
+        learned = posting_interval(online_feed.entries, now)
+        if learned is not None:
+            interval = learned
+
+    delay = next_fetch_delay(interval, feed.subscribers_count, failures)
+    delay = min(
+        max(delay, publisher_delay(result.headers, online_feed, now)),
+        settings.FEED_POLL_MAX_INTERVAL
+    )
+
+    fields = {
+        'next_fetch_at': now + timedelta(seconds=delay),
+        'fetch_failures': failures,
+        'post_interval': interval,
+    }
+    if interval is not None:
+        fields['publication_frequency'] = publication_frequency(interval)
+
+    return fields
@@ -38,7 +38,7 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'bootstrap4',
     'base.apps.BaseConfig',
-    'dashboard',
+    'dashboard.apps.DashboardConfig',
     'django_markup',
     'django_celery_results',
     'django_celery_beat'
@@ -91,6 +91,19 @@ DATABASES = {
     }
 }
 
+# Cache shared by web and celery workers
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': 'redis://redis:6379/1',
+    }
+}
+
+# Lifetime in seconds of the cached sidebar counters
+
+SIDEBAR_CACHE_TIMEOUT = 300
+
 # CELERY SETTINGS
 
 CELERY_BROKER_URL = 'redis://redis:6379/0'
@@ -138,6 +151,78 @@ USE_TZ = True
 
 RESULTS_PER_PAGE = 3
 
+# Feed discovery suggestions: minimum length of the typed term
+# and lifetime in seconds of the cached suggestions
+
+AUTOCOMPLETE_MIN_LENGTH = 2
+
+AUTOCOMPLETE_CACHE_TIMEOUT = 300
+
+# Feed onboarding: lifetime in seconds of a pending download, of the
+# status of a created feed and of a url which is not a feed
+
+ONBOARDING_PENDING_TIMEOUT = 60
+
+ONBOARDING_READY_TIMEOUT = 600
+
+ONBOARDING_INVALID_TIMEOUT = 3600
+
+# Maximum number of feeds returned by a search of the discover page
+
+DISCOVER_MAX_RESULTS = 50
+
+# Maximum number of posts returned by a search
+
+SEARCH_MAX_RESULTS = 1000
+
+# Maximum number of posts marked as read by a single batch, seen while scrolling
+
+READ_BATCH_MAX_POSTS = 500
+
+# Feed synchronization: concurrent downloads, connections per host
+# and timeout in seconds for each request
+
+FEED_FETCH_WORKERS = 20
+
+FEED_FETCH_PER_HOST = 2
+
+FEED_FETCH_TIMEOUT = 10
+
+# Feed synchronization: maximum size in bytes of a downloaded feed and
+# number of its first entries ingested
+
+FEED_FETCH_MAX_SIZE = 10 * 1024 * 1024
+
+FEED_MAX_ENTRIES = 500
+
+# Feed synchronization: number of shard tasks dispatched per cycle,
+# number of feeds leased and downloaded at once by a shard and lifetime
+# in seconds of the lease taken on a feed by a worker
+
+FEED_SYNC_SHARDS = 8
+
+FEED_SYNC_BATCH_SIZE = 100
+
+FEED_SYNC_LOCK_TIMEOUT = 300
+
+# Feed synchronization: bounds in seconds of the delay between two
+# downloads of a feed, learned from the cadence of its entries
+
+FEED_POLL_MIN_INTERVAL = 60
+
+FEED_POLL_MAX_INTERVAL = 6 * 60 * 60
+
+# Number of rows removed by each DELETE of a large removal, such as the
+# posts of a deleted feed, so locks are only held for a short time
+
+DELETE_BATCH_SIZE = 1000
+
+# Days posts are kept after the publication date of their entry, unless
+# they are favorite, to read later or commented. At least 1, feeds can
+# override it, None keeps posts forever
+
+POST_RETENTION_DAYS = None
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/2.0/howto/static-files/
 
@@ -149,3 +234,5 @@ STATIC_URL = '/static/'
 
 if 'test' in sys.argv or 'test_coverage' in sys.argv:
     DATABASES['default']['ENGINE'] = 'django.db.backends.sqlite3'
+    CELERY_TASK_ALWAYS_EAGER = True
+    CACHES['default'] = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
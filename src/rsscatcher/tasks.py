@@ -1,20 +1,42 @@
 from __future__ import absolute_import, unicode_literals
-from datetime import datetime
-from time import mktime
+import hashlib
+import resource
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from calendar import timegm
+from itertools import islice
 import pytz
+from celery import chord
 from celery.utils.log import get_task_logger
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
 from django.utils.text import slugify
 from .celery import app
+from .fetcher import FeedFetcher, NOT_MODIFIED
+from .scheduler import schedule_feed
 import feedparser
 
 logger = get_task_logger(__name__)
 
+# Totals of shards reported by their maximum instead of their sum
+PEAK_TOTALS = ('rss', 'rss_growth')
+
+# Number of entries of a feed ingested at once
+INGEST_BATCH_SIZE = 100
+
 app.conf.beat_schedule = {
     'synchronize-every-20-seconds': {
         'task': 'rsscatcher.tasks.synchronize_posts',
         'schedule': 20.0,
         'args': ()
     },
+    'prune-posts-every-day': {
+        'task': 'rsscatcher.tasks.prune_posts',
+        'schedule': 24 * 60 * 60.0,
+        'args': ()
+    },
 }
 
 
@@ -22,46 +44,511 @@ app.conf.beat_schedule = {
 def synchronize_posts():
 
     """
-        Synchronize posts for existing feeds
+        Dispatch the synchronization of due feeds over shards
+
+        Each shard is synchronized by its own task so the work is spread
+        over every celery worker. Only shards having due feeds are
+        dispatched. Totals of the cycle are reported once all shards are
+        done.
+    """
+
+    shard_count = settings.FEED_SYNC_SHARDS
+
+    shards = sorted(set(
+        due_feeds().annotate(shard=F('id') % shard_count).values_list('shard', flat=True)
+    ))
+    if not shards:
+        return None
+
+    return chord(
+        synchronize_shard.s(shard, shard_count) for shard in shards
+    )(report_synchronization.s())
+
+
+@app.task()
+def synchronize_shard(shard, shard_count):
+
+    """
+        Synchronize posts for the due feeds of a shard
+
+        A feed belongs to the shard ``Feed.id % shard_count``. Ids of the
+        due feeds are streamed, the most followed first, and feeds are
+        leased and downloaded by batches so the memory of a worker does
+        not grow with the number of feeds. Leases make sure two workers
+        never synchronize the same feed at once. A feed failing to be
+        ingested is counted as an error and backs off like a failed
+        download. The resident memory of the worker at the end of the
+        shard and its growth during the shard are reported with the
+        totals.
+    """
+
+    from dashboard.models import Feed
+
+    totals = {'feeds': 0, 'posts': 0, 'errors': 0, 'locked': 0, 'skipped': 0}
+    rss_before = current_rss()
+    batch_size = settings.FEED_SYNC_BATCH_SIZE
+
+    feed_ids = (
+        due_feeds().annotate(shard=F('id') % shard_count)
+        .filter(shard=shard).order_by('-subscribers_count')
+        .values_list('id', flat=True).iterator(chunk_size=batch_size)
+    )
+    fetcher = FeedFetcher()
+
+    while True:
+        batch = list(islice(feed_ids, batch_size))
+        if not batch:
+            break
+
+        token = acquire_feeds(due_feeds().filter(id__in=batch))
+        feeds = list(Feed.objects.filter(sync_lock=token).order_by('-subscribers_count'))
+        totals['locked'] += len(batch) - len(feeds)
+
+        try:
+            for result in fetcher.fetch_all(feeds):
+                try:
+                    synchronize_result(result, totals)
+                except Exception:
+                    # A broken feed must not stop the other feeds of the shard
+                    logger.exception("Cannot synchronize %s", result.feed.url)
+                    totals['errors'] += 1
+                    failed = result._replace(error="Synchronization failed")
+                    Feed.objects.filter(id=result.feed.id).update(
+                        **schedule_feed(result.feed, failed)
+                    )
+        finally:
+            Feed.objects.filter(sync_lock=token).update(sync_lock='', sync_locked_until=None)
+
+    totals['rss'] = current_rss()
+    totals['rss_growth'] = max(totals['rss'] - rss_before, 0)
+
+    return totals
+
+
+def current_rss():
+
+    """
+        Resident memory of the worker in kilobytes, 0 where /proc is missing
+
+        Unlike ru_maxrss, which is the peak over the life of the process,
+        it tells the memory used by a single cycle.
+    """
+
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0
+
+    return pages * resource.getpagesize() // 1024
+
+
+def synchronize_result(result, totals):
+
+    """
+        Ingest the download of a feed and schedule the next one
+
+        Feeds which did not change since the last download, either
+        answered by a 304 or by the same document, are counted as skipped
+        and not parsed.
     """
 
-    from dashboard.models import Feed, Post, UserPost
-    from django.contrib.auth.models import User
+    from dashboard.models import Feed
+
+    online_feed = None
+    updates = {}
+
+    if result.error:
+        logger.warning("Cannot fetch %s: %s", result.feed.url, result.error)
+        totals['errors'] += 1
+    elif result.status == NOT_MODIFIED:
+        totals['skipped'] += 1
+    else:
+        content_hash = hashlib.sha1(result.content).hexdigest()
+        if content_hash == result.feed.content_hash:
+            totals['skipped'] += 1
+        else:
+            online_feed = feedparser.parse(result.content)
+            totals['posts'] += synchronize_feed(result.feed, online_feed)
+            totals['feeds'] += 1
 
-    feeds = Feed.objects.all()
-    logger.info(feeds)
+            updates.update(
+                etag=result.headers.get('etag', '')[:255],
+                last_modified=result.headers.get('last-modified', '')[:64],
+                content_hash=content_hash
+            )
 
-    for feed in feeds:
+    updates.update(schedule_feed(result.feed, result, online_feed))
+    Feed.objects.filter(id=result.feed.id).update(**updates)
 
-        online_feed = feedparser.parse(feed.url)
 
-        entries = online_feed.entries
+@app.task()
+def onboard_feed(url):
+
+    """
+        Create the feed of an unknown url and ingest its first entries
+
+        The document is downloaded once, its entries are ingested right
+        away instead of waiting for the next synchronization. Urls which
+        cannot be downloaded or are not feeds are marked invalid, as well
+        as urls whose onboarding failed, so they are never left pending.
+        A url onboarded meanwhile keeps its feed.
+    """
 
-        for entry in entries:
+    from dashboard.models import Feed
+    from dashboard.onboarding import INVALID, READY, get_or_create_feed, set_onboarding_status
 
-            slug = slugify(entry.title)
-            content = entry.summary
+    status, data = INVALID, {'error': "Onboarding failed"}
 
-            entry_published_date = datetime.fromtimestamp(mktime(entry.published_parsed))
-            entry_published_date = entry_published_date.replace(tzinfo=pytz.utc)
+    try:
+        feed_id = Feed.objects.filter(url=url).values_list('id', flat=True).first()
+        if feed_id is not None:
+            status, data = READY, {'feed': feed_id}
+            return {'feed': feed_id, 'posts': 0}
 
-            existing_post_count = Post.objects.filter(slug=slug, feed=feed).count()
+        result = FeedFetcher().fetch(Feed(url=url))
+        if result.error or not result.content:
+            data = {'error': result.error or "Empty document"}
+            return None
 
-            if not existing_post_count:
+        online_feed = feedparser.parse(result.content)
+        title = online_feed.feed.get('title')
+        if not title or (online_feed.bozo and not online_feed.entries):
+            data = {'error': "Not a feed"}
+            return None
 
-                post = Post.objects.create(
-                    name=entry.title,
+        feed, _ = get_or_create_feed(
+            url, title,
+            etag=result.headers.get('etag', '')[:255],
+            last_modified=result.headers.get('last-modified', '')[:64],
+            content_hash=hashlib.sha1(result.content).hexdigest(),
+            **schedule_feed(Feed(url=url), result, online_feed)
+        )
+        posts = synchronize_feed(feed, online_feed)
+
+        status, data = READY, {'feed': feed.id}
+
+        return {'feed': feed.id, 'posts': posts}
+    finally:
+        set_onboarding_status(url, status, **data)
+
+
+@app.task()
+def forget_feed_states(user_id, feed_id):
+
+    """
+        Delete the states of the posts of a feed a user stopped following
+    """
+
+    from dashboard.services import delete_feed_states
+
+    return delete_feed_states(user_id, feed_id)
+
+
+@app.task()
+def remove_feed(feed_id):
+
+    """
+        Delete a feed with its posts in batches, off the request
+    """
+
+    from dashboard.services import delete_feed
+
+    deleted = delete_feed(feed_id)
+    logger.info("Feed %s removed with %s posts", feed_id, deleted)
+
+    return deleted
+
+
+@app.task()
+def prune_posts():
+
+    """
+        Delete the expired posts of every feed, feed by feed in batches
+    """
+
+    from dashboard.models import Feed
+    from dashboard import services
+
+    deleted = 0
+    for feed in Feed.objects.only('id', 'retention_days').iterator():
+        deleted += services.prune_posts(feed)
+
+    logger.info("%s expired posts deleted", deleted)
+
+    return deleted
+
+
+@app.task()
+def report_synchronization(shard_totals):
+
+    """
+        Sum and log the totals of every shard for a synchronization cycle
+
+        Memory values of workers are maximized instead
+    """
+
+    totals = {}
+    for shard_total in shard_totals:
+        for key, value in shard_total.items():
+            if key in PEAK_TOTALS:
+                totals[key] = max(totals.get(key, 0), value)
+            else:
+                totals[key] = totals.get(key, 0) + value
+
+    logger.info("Synchronization cycle: %s", totals)
+
+    return totals
+
+
+def due_feeds(now=None):
+
+    """
+        Feeds followed by at least one user whose next download is due
+    """
+
+    from dashboard.models import Feed, Subscription
+
+    now = now or timezone.now()
+
+    return Feed.objects.filter(
+        Q(next_fetch_at__isnull=True) | Q(next_fetch_at__lte=now),
+        id__in=Subscription.objects.values('feed_id')
+    )
+
+
+def acquire_feeds(feeds):
+
+    """
+        Lease the feeds which are not being synchronized by another worker
+
+        :param feeds: Queryset of feeds to lease
+        :return: Token identifying the leased feeds
+    """
+
+    now = timezone.now()
+    token = uuid.uuid4().hex
+
+    feeds.filter(
+        Q(sync_locked_until__isnull=True) | Q(sync_locked_until__lt=now)
+    ).update(
+        sync_lock=token,
+        sync_locked_until=now + timedelta(seconds=settings.FEED_SYNC_LOCK_TIMEOUT)
+    )
+
+    return token
+
+
+def entry_fields(entry):
+
+    """
+        Title, summary and link of an entry, empty when the entry has none
+    """
+
+    return (
+        getattr(entry, 'title', None) or '',
+        getattr(entry, 'summary', None) or '',
+        getattr(entry, 'link', None) or ''
+    )
+
+
+def entry_published_date(entry):
+
+    """
+        Publication date of an entry, its update date or now without one
+
+        Dates in the future are brought back to now
+    """
+
+    now = timezone.now()
+    parsed = getattr(entry, 'published_parsed', None) or getattr(entry, 'updated_parsed', None)
+    if not parsed:
+        return now
+
+    return min(datetime.fromtimestamp(timegm(parsed), pytz.utc), now)
+
+
+def entry_guid(entry):
+
+    """
+        Identifier of an entry in its feed: its id, its link or its title,
+        or the hash of its fields
+
+        Identifiers too long to be stored are replaced by their hash
+    """
+
+    title, _, link = entry_fields(entry)
+    guid = getattr(entry, 'id', None) or link or title or entry_hash(entry)
+    if len(guid) > 255:
+        guid = hashlib.sha1(guid.encode('utf-8')).hexdigest()
+
+    return guid
+
+
+def entry_hash(entry):
+
+    """
+        Hash of the fields of an entry stored in its post
+    """
+
+    return hashlib.sha1("\n".join(entry_fields(entry)).encode('utf-8')).hexdigest()
+
+
+def assign_unique_slugs(feed, posts, taken):
+
+    """
+        Suffix the slugs of new posts already taken in the feed by a number
+
+        :param taken: Slugs of the feed known to be taken, completed with
+            the suffixed slugs of the feed when a slug collides
+    """
+
+    from dashboard.models import Post
+
+    slugs = [post.slug for post in posts]
+    colliding = set(slug for slug in slugs if slug in taken or slugs.count(slug) > 1)
+
+    if colliding:
+        query = Q()
+        for slug in colliding:
+            query |= Q(slug__startswith=slug)
+        taken.update(Post.objects.filter(feed=feed).filter(query).values_list('slug', flat=True))
+
+    for post in posts:
+        slug, number = post.slug, 1
+        while slug in taken:
+            number += 1
+            slug = "{}-{}".format(post.slug[:190], number)
+        post.slug = slug
+        taken.add(slug)
+
+
+def synchronize_feed(feed, online_feed):
+
+    """
+        Create, update and tag the posts of the entries of a parsed feed
+
+        Only the first entries of the document, up to FEED_MAX_ENTRIES,
+        are ingested, by batches of INGEST_BATCH_SIZE entries. Tags of the
+        new entries are collected over every batch and turned into
+        keywords at once.
+
+        :return: Number of created posts
+    """
+
+    from dashboard.counters import invalidate_sidebar_counters
+    from dashboard.services import add_feed_keywords, refresh_keyword_counts
+
+    entries = online_feed.entries[:settings.FEED_MAX_ENTRIES]
+
+    created, tags = 0, set()
+    for start in range(0, len(entries), INGEST_BATCH_SIZE):
+        created += ingest_entries(feed, entries[start:start + INGEST_BATCH_SIZE], tags)
+
+    # New posts are unread for subscribers, no user post is stored
+    if created:
+        invalidate_sidebar_counters(feed.subscription_set.values_list('user_id', flat=True))
+
+    # Keywords are shared by feeds
+    keyword_ids = add_feed_keywords(feed, tags)
+    if keyword_ids:
+        refresh_keyword_counts(keyword_ids)
+
+    return created
+
+
+def ingest_entries(feed, online_entries, tags):
+
+    """
+        Create and update the posts of a batch of entries
+
+        Entries are identified by their guid. Posts of the entries are
+        loaded in one query: new entries are inserted in bulk, entries
+        whose hash changed are updated in place and unchanged entries are
+        not written. New entries older than the retention of the feed are
+        skipped. Posts created before entries were identified are
+        matched by slug and adopt the guid of their entry. The unique
+        (feed, guid) constraint drops posts inserted at the same time by
+        another worker.
+
+        :param tags: Set completed with the tags of the new entries
+        :return: Number of created posts
+    """
+
+    from dashboard.models import Post
+    from dashboard.sanitize import sanitize
+    from dashboard.services import bulk_create_ignoring_duplicates, retention_cutoff
+
+    entries = OrderedDict()
+    for entry in online_entries:
+        entries.setdefault(entry_guid(entry), entry)
+
+    slugs = dict(
+        (guid, slugify(entry_fields(entry)[0])[:200] or 'post') for guid, entry in entries.items()
+    )
+
+    existing, legacy, taken = {}, {}, set()
+    rows = Post.objects.filter(feed=feed).filter(
+        Q(guid__in=entries) | Q(slug__in=slugs.values())
+    ).values_list('id', 'guid', 'slug', 'content_hash')
+    for post_id, guid, slug, content_hash in rows:
+        taken.add(slug)
+        if guid is not None:
+            existing[guid] = (post_id, content_hash)
+        else:
+            legacy[slug] = (post_id, content_hash)
+
+    posts = []
+    cutoff = retention_cutoff(feed)
+
+    for guid, entry in entries.items():
+
+        title, entry_summary, link = entry_fields(entry)
+        content_hash = entry_hash(entry)
+        post_id, stored_hash = existing.get(guid) or legacy.pop(slugs[guid], (None, None))
+
+        if post_id is not None:
+            if stored_hash != content_hash:
+                content, summary = sanitize(entry_summary)
+                Post.objects.filter(id=post_id).update(
+                    name=title[:200],
                     content=content,
-                    feed=feed,
-                    published_date=entry_published_date,
-                    slug=slug,
-                    url=entry.link
+                    summary=summary,
+                    url=link[:200],
+                    guid=guid,
+                    content_hash=content_hash,
+                    sanitized=True
                 )
-                # for each subscriber, create a user post
-                for user in User.objects.filter(subscription__feed=feed):
-                    UserPost.objects.create(post=post, user=user)
-
-                tags = set([tag['term'] for tag in entry.tags if entry.tags])
-                for tag in tags:
-                    formatted_tag = slugify(tag)
-                    feed.keywords.get_or_create(name=formatted_tag)
+            continue
+
+        published_date = entry_published_date(entry)
+
+        # Expired entries still listed by the feed would be created again once pruned
+        if cutoff is not None and published_date < cutoff:
+            continue
+
+        content, summary = sanitize(entry_summary)
+
+        posts.append(Post(
+            name=title[:200],
+            content=content,
+            summary=summary,
+            feed=feed,
+            published_date=published_date,
+            slug=slugs[guid],
+            url=link[:200],
+            guid=guid,
+            content_hash=content_hash,
+            sanitized=True
+        ))
+        tags.update(
+            tag.get('term') for tag in getattr(entry, 'tags', None) or [] if tag.get('term')
+        )
+
+    if not posts:
+        return 0
+
+    assign_unique_slugs(feed, posts, taken)
+
+    # Entries inserted meanwhile by another worker are not counted
+    return bulk_create_ignoring_duplicates(Post, posts)
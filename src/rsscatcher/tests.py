@@ -1,8 +1,22 @@
+import gzip
+import threading
+import time
 from time import gmtime
-from datetime import datetime
-from django.test import TestCase
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
-from .tasks import synchronize_posts
+from .fetcher import FeedFetcher, FetchResult
+from .scheduler import next_fetch_delay, posting_interval, publisher_delay, schedule_feed
+from django.utils import timezone
+from . import tasks
+from .tasks import (
+    forget_feed_states, prune_posts, remove_feed, synchronize_posts, synchronize_shard, synchronize_feed,
+    report_synchronization
+)
 from dashboard.models import Feed, Post, Subscription, UserPost, Keyword
 from unittest.mock import patch
 
@@ -18,10 +32,20 @@ class FakeEntry(object):
     published_parsed = gmtime(500000)
     link = "http://upidev.fr/super-post"
 
-    def __init__(self, title, slug="", tags=[]):
+    def __init__(self, title, slug="", tags=[], published_parsed=None, id=None):
+        self.id = id or title
         self.title = title
         self.slug = slug
         self.tags = tags
+        if published_parsed is not None:
+            self.published_parsed = published_parsed
+
+
+class BareEntry(object):
+
+    """
+    Mock an entry without any optional field
+    """
 
 
 class FakeParse(object):
@@ -40,6 +64,16 @@ class FakeParse(object):
         ]
 
 
+def fake_fetch_all(self, feeds):
+
+    """
+    Fake downloads for running tests without network
+    """
+
+    for feed in feeds:
+        yield FetchResult(feed, 200, b"", {}, None)
+
+
 class SynchronizePostMethodTests(TestCase):
 
     """
@@ -71,6 +105,7 @@ class SynchronizePostMethodTests(TestCase):
 
         self.user = User.objects.create_user("john", email="john@upidev.fr", password="toto")
         UserPost.objects.create(user=self.user,post=self.post)
+        Subscription.objects.create(user=self.user, feed=self.feed)
 
     @patch("feedparser.parse")
     def test_entry_has_a_property_called_tags(self, parse):
@@ -84,6 +119,7 @@ class SynchronizePostMethodTests(TestCase):
         self.assertTrue(fakeparser_obj.entries)
         self.assertTrue(fakeparser_obj.entries[0].tags)
 
+    @patch("rsscatcher.tasks.FeedFetcher.fetch_all", fake_fetch_all)
     @patch("feedparser.parse", get_fakeparser)
     def test_can_synchronize_posts(self):
         """
@@ -94,6 +130,7 @@ class SynchronizePostMethodTests(TestCase):
 
         self.assertEqual(Post.objects.count(), 3)
 
+    @patch("rsscatcher.tasks.FeedFetcher.fetch_all", fake_fetch_all)
     @patch("feedparser.parse", get_fakeparser)
     def test_create_a_new_post_if_no_existing(self):
         """
@@ -108,20 +145,21 @@ class SynchronizePostMethodTests(TestCase):
 
         self.assertEqual(expected_count + 2, actual_count)
 
+    @patch("rsscatcher.tasks.FeedFetcher.fetch_all", fake_fetch_all)
     @patch("feedparser.parse", get_fakeparser)
-    def test_create_userpost_for_subscriber(self):
+    def test_new_posts_are_unread_for_subscriber(self):
         """
-        Create a userpost for feed subscribers
+        New posts are unread for feed subscribers without creating user posts
         """
 
-        Subscription.objects.create(user=self.user, feed=self.feed)
-
         synchronize_posts()
 
-        userpost_count = UserPost.objects.filter(user=self.user).count()
+        unread_count = Post.objects.for_user(self.user, UserPost.UNREAD).count()
 
-        self.assertEqual(3, userpost_count)
+        self.assertEqual(3, unread_count)
+        self.assertEqual(1, UserPost.objects.filter(user=self.user).count())
 
+    @patch("rsscatcher.tasks.FeedFetcher.fetch_all", fake_fetch_all)
     @patch("feedparser.parse", get_fakeparser)
     def test_create_keywords_for_a_feed(self):
         """
@@ -139,14 +177,805 @@ class SynchronizePostMethodTests(TestCase):
         # Keywords should not be duplicated
         self.assertEqual(actual_keywords_count, 2)
 
+    @patch("rsscatcher.tasks.FeedFetcher.fetch_all", fake_fetch_all)
+    @patch("feedparser.parse", get_fakeparser)
+    def test_keywords_are_shared_by_feeds(self):
+        """
+        A tag already used by another feed links its keyword
+        """
+
+        other_feed = Feed.objects.create(name="Other", slug="other", url="http://upidev.fr")
+        synchronize_posts()
+        names = list(Keyword.objects.filter(feed=self.feed).values_list('name', flat=True))
+        other_feed.keywords.add(*Keyword.objects.filter(name__in=names))
+        Feed.objects.filter(id=self.feed.id).update(content_hash='', next_fetch_at=None)
+        Post.objects.filter(feed=self.feed).delete()
+        self.feed.keywords.clear()
+
+        synchronize_posts()
+
+        self.assertEqual(Keyword.objects.count(), len(names))
+        self.assertEqual(
+            set(Keyword.objects.values_list('feeds_count', flat=True)), {2}
+        )
+
+
+
+
+
+
+
+
+
+
 
 
 
 
+    @patch("rsscatcher.tasks.FeedFetcher.fetch_all", fake_fetch_all)
+    @patch("feedparser.parse", get_fakeparser)
+    def test_report_totals_of_a_cycle(self):
+        """
+        The cycle reports totals summed over every shard
+        """
+
+        totals = synchronize_posts().get()
+
+        self.assertEqual(totals['feeds'], 1)
+        self.assertEqual(totals['posts'], 2)
+        self.assertEqual(totals['errors'], 0)
+
+    @patch("rsscatcher.tasks.FeedFetcher.fetch_all", fake_fetch_all)
+    @patch("feedparser.parse", get_fakeparser)
+    def test_shard_only_synchronizes_its_feeds(self):
+        """
+        A shard only synchronizes feeds whose id maps to it
+        """
+
+        shard = self.feed.id % 2
+
+        self.assertEqual(synchronize_shard(1 - shard, 2)['feeds'], 0)
+        self.assertEqual(synchronize_shard(shard, 2)['feeds'], 1)
+
+    @patch("feedparser.parse", get_fakeparser)
+    def test_synchronize_the_most_followed_feeds_first(self):
+        """
+        Feeds are ordered by their denormalized number of subscribers
+        """
+
+        popular = Feed.objects.create(
+            name="Popular", slug="popular", url="http://popular.fr", subscribers_count=5
+        )
+        Subscription.objects.create(user=self.user, feed=popular)
+        Feed.objects.filter(id=self.feed.id).update(subscribers_count=1)
+        downloaded = []
+
+        def record_fetch_all(fetcher, feeds):
+            downloaded.extend(feed.id for feed in feeds)
+            return fake_fetch_all(fetcher, feeds)
+
+        with patch("rsscatcher.tasks.FeedFetcher.fetch_all", record_fetch_all):
+            synchronize_shard(0, 1)
+
+        self.assertEqual(downloaded, [popular.id, self.feed.id])
+
+    @patch("rsscatcher.tasks.FeedFetcher.fetch_all", fake_fetch_all)
+    @patch("feedparser.parse", get_fakeparser)
+    def test_do_not_synchronize_a_locked_feed(self):
+        """
+        A feed leased by another worker is skipped and kept locked
+        """
+
+        Feed.objects.filter(id=self.feed.id).update(
+            sync_lock="other", sync_locked_until=timezone.now() + timedelta(minutes=5)
+        )
+
+        totals = synchronize_shard(0, 1)
+
+        self.assertEqual(totals['locked'], 1)
+        self.assertEqual(Post.objects.count(), 1)
+        self.assertEqual(Feed.objects.get(id=self.feed.id).sync_lock, "other")
+
+    @patch("rsscatcher.tasks.FeedFetcher.fetch_all", fake_fetch_all)
+    @patch("feedparser.parse", get_fakeparser)
+    def test_release_feeds_after_synchronization(self):
+        """
+        Leases are released once the shard is synchronized
+        """
+
+        synchronize_shard(0, 1)
+
+        feed = Feed.objects.get(id=self.feed.id)
+        self.assertEqual(feed.sync_lock, "")
+        self.assertIsNone(feed.sync_locked_until)
+
+    @patch("rsscatcher.tasks.FeedFetcher.fetch_all", fake_fetch_all)
+    @patch("feedparser.parse", get_fakeparser)
+    def test_a_failing_feed_does_not_stop_its_shard(self):
+        """
+        A feed raising while it is ingested is counted as an error and backs off
+        """
+
+        broken = Feed.objects.create(name="Broken", slug="broken", url="http://broken.fr")
+        Subscription.objects.create(user=self.user, feed=broken)
+
+        def synchronize_or_raise(feed, online_feed):
+            if feed.id == broken.id:
+                raise AttributeError("published_parsed")
+            return synchronize_feed(feed, online_feed)
+
+        with patch("rsscatcher.tasks.synchronize_feed", synchronize_or_raise):
+            totals = synchronize_shard(0, 1)
+
+        self.assertEqual(totals['errors'], 1)
+        self.assertEqual(totals['feeds'], 1)
+        self.assertEqual(Post.objects.filter(feed=self.feed).count(), 3)
+
+        broken.refresh_from_db()
+        self.assertEqual(broken.fetch_failures, 1)
+        self.assertGreater(broken.next_fetch_at, timezone.now())
+        self.assertEqual(broken.sync_lock, "")
+
+    def test_ingest_entries_without_optional_fields(self):
+        """
+        Entries without date, title, link or summary are ingested
+        """
+
+        parsed = FakeParse()
+        parsed.entries = [BareEntry()]
+
+        self.assertEqual(synchronize_feed(self.feed, parsed), 1)
+
+        post = Post.objects.get(feed=self.feed, slug="post")
+        self.assertEqual((post.name, post.url, post.content), ("", "", ""))
+        self.assertTrue(post.guid)
+
+    @patch("feedparser.parse")
+    def test_skip_not_modified_feeds(self, parse):
+        """
+        A feed answered by a 304 is skipped without being parsed
+        """
+
+        def not_modified(fetcher, feeds):
+            for feed in feeds:
+                yield FetchResult(feed, 304, None, {}, None)
+
+        with patch("rsscatcher.tasks.FeedFetcher.fetch_all", not_modified):
+            totals = synchronize_shard(0, 1)
+
+        self.assertEqual(totals['skipped'], 1)
+        self.assertFalse(parse.called)
+
+    @patch("rsscatcher.tasks.FeedFetcher.fetch_all", fake_fetch_all)
+    @patch("feedparser.parse", get_fakeparser)
+    def test_store_validators_and_skip_unchanged_documents(self):
+        """
+        A document identical to the last one is skipped without being parsed
+        """
+
+        synchronize_shard(0, 1)
+        self.assertTrue(Feed.objects.get(id=self.feed.id).content_hash)
+        Feed.objects.filter(id=self.feed.id).update(next_fetch_at=None)
+
+        with patch("feedparser.parse") as parse:
+            totals = synchronize_shard(0, 1)
+
+        self.assertEqual(totals['skipped'], 1)
+        self.assertFalse(parse.called)
+
+    def test_ingest_entries_with_a_constant_number_of_queries(self):
+        """
+        The number of queries does not grow with the number of entries
+        """
+
+        def online_feed(count, prefix):
+            parsed = FakeParse()
+            parsed.entries = [
+                FakeEntry("{} {}".format(prefix, i)) for i in range(count)
+            ]
+            return parsed
+
+        with CaptureQueriesContext(connection) as few:
+            synchronize_feed(self.feed, online_feed(2, "few"))
+
+        with CaptureQueriesContext(connection) as many:
+            synchronize_feed(self.feed, online_feed(40, "many"))
+
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(Post.objects.filter(feed=self.feed).count(), 43)
+
+    def test_tag_entries_with_a_constant_number_of_queries(self):
+        """
+        The number of queries does not grow with the number of tags
+        """
+
+        def online_feed(count, prefix):
+            parsed = FakeParse()
+            parsed.entries = [
+                FakeEntry("{} {}".format(prefix, i), tags=[{'term': "{} {}".format(prefix, i)}])
+                for i in range(count)
+            ]
+            parsed.entries.append(FakeEntry("{} untagged".format(prefix), tags=None))
+            return parsed
+
+        with CaptureQueriesContext(connection) as few:
+            synchronize_feed(self.feed, online_feed(2, "few"))
+
+        with CaptureQueriesContext(connection) as many:
+            synchronize_feed(self.feed, online_feed(40, "many"))
+
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(self.feed.keywords.count(), 42)
+        self.assertEqual(set(Keyword.objects.values_list('feeds_count', flat=True)), {1})
+
+    def test_skip_duplicated_entries(self):
+        """
+        Entries with an existing guid are not inserted again
+        """
+
+        parsed = FakeParse()
+        parsed.entries = [FakeEntry("oooo"), FakeEntry("New"), FakeEntry("New")]
+
+        self.assertEqual(synchronize_feed(self.feed, parsed), 1)
+        self.assertEqual(Post.objects.filter(feed=self.feed).count(), 2)
+
+    def test_keep_entries_with_the_same_title(self):
+        """
+        Entries with the same title get their own post and slug
+        """
+
+        parsed = FakeParse()
+        parsed.entries = [FakeEntry("Same", id="1"), FakeEntry("Same", id="2")]
+
+        self.assertEqual(synchronize_feed(self.feed, parsed), 2)
+        self.assertEqual(
+            set(Post.objects.filter(feed=self.feed, name="Same").values_list('slug', flat=True)),
+            {"same", "same-2"}
+        )
+
+    def test_update_changed_entries_in_place(self):
+        """
+        An entry whose title or summary changed updates its post
+        """
+
+        parsed = FakeParse()
+        parsed.entries = [FakeEntry("Draft", id="1")]
+        synchronize_feed(self.feed, parsed)
+
+        parsed.entries[0].title = "Final"
+        parsed.entries[0].summary = "Edited"
+
+        self.assertEqual(synchronize_feed(self.feed, parsed), 0)
+
+        post = Post.objects.get(feed=self.feed, guid="1")
+        self.assertEqual((post.name, post.content, post.slug), ("Final", "Edited", "draft"))
+        self.assertEqual(Post.objects.filter(feed=self.feed).count(), 2)
+
+    def test_do_not_write_unchanged_entries(self):
+        """
+        Unchanged entries are skipped after a single query
+        """
+
+        parsed = FakeParse()
+        synchronize_feed(self.feed, parsed)
+
+        with self.assertNumQueries(1):
+            self.assertEqual(synchronize_feed(self.feed, parsed), 0)
+
+    def test_count_only_inserted_posts(self):
+        """
+        Entries inserted meanwhile by another worker are not counted
+        """
+
+        parsed = FakeParse()
+        parsed.entries = [FakeEntry("A", id="a"), FakeEntry("B", id="b")]
+        assign_unique_slugs = tasks.assign_unique_slugs
+
+        def insert_meanwhile(feed, posts, taken):
+            assign_unique_slugs(feed, posts, taken)
+            Post.objects.create(name="A", slug="other", content="", feed=feed, url="", guid="a")
+
+        with patch("rsscatcher.tasks.assign_unique_slugs", insert_meanwhile):
+            self.assertEqual(synchronize_feed(self.feed, parsed), 1)
+
+        self.assertEqual(Post.objects.filter(feed=self.feed, guid__in=["a", "b"]).count(), 2)
+
+    def test_store_sanitized_contents_and_summaries(self):
+        """
+        Entries are sanitized and summarized once at ingest
+        """
+
+        parsed = FakeParse()
+        parsed.entries = [FakeEntry("Html", id="1")]
+        parsed.entries[0].summary = "<p>Safe</p><script>alert(1)</script>"
+
+        synchronize_feed(self.feed, parsed)
+
+        post = Post.objects.get(feed=self.feed, guid="1")
+        self.assertEqual((post.content, post.summary), ("<p>Safe</p>", "Safe"))
+        self.assertTrue(post.sanitized)
+
+    def test_posts_without_guid_adopt_their_entry(self):
+        """
+        A post created before entries were identified is matched by slug
+        """
+
+        parsed = FakeParse()
+        parsed.entries = [FakeEntry("oooo", id="urn:oooo")]
+
+        self.assertEqual(synchronize_feed(self.feed, parsed), 0)
+
+        post = Post.objects.get(id=self.post.id)
+        self.assertEqual((post.guid, post.content), ("urn:oooo", "summary"))
+
+    @patch("rsscatcher.tasks.FeedFetcher.fetch_all", fake_fetch_all)
+    @patch("feedparser.parse", get_fakeparser)
+    @override_settings(FEED_SYNC_BATCH_SIZE=1)
+    def test_synchronize_feeds_by_batches(self):
+        """
+        Every due feed is synchronized whatever the size of the batches
+        """
+
+        for name in ("First", "Second"):
+            feed = Feed.objects.create(name=name, slug=name, url="http://upidev.fr")
+            Subscription.objects.create(user=self.user, feed=feed)
+
+        totals = synchronize_shard(0, 1)
+
+        self.assertEqual(totals['feeds'], 3)
+        self.assertEqual(totals['locked'], 0)
+        self.assertGreater(totals['rss'], 0)
+        self.assertGreaterEqual(totals['rss_growth'], 0)
+
+    @override_settings(FEED_MAX_ENTRIES=2)
+    def test_only_ingest_the_first_entries(self):
+        """
+        Entries after the maximum number of entries are ignored
+        """
+
+        parsed = FakeParse()
+        parsed.entries = [FakeEntry("Entry {}".format(i)) for i in range(5)]
+
+        self.assertEqual(synchronize_feed(self.feed, parsed), 2)
+        self.assertTrue(Post.objects.filter(name="Entry 1").exists())
+        self.assertFalse(Post.objects.filter(name="Entry 2").exists())
+
+    @override_settings(POST_RETENTION_DAYS=30)
+    def test_skip_expired_entries(self):
+        """
+        Entries older than the retention are not created again once pruned
+        """
+
+        parsed = FakeParse()
+        parsed.entries = [
+            FakeEntry("Old"), FakeEntry("New", published_parsed=gmtime(time.time()))
+        ]
+
+        self.assertEqual(synchronize_feed(self.feed, parsed), 1)
+        self.assertFalse(Post.objects.filter(name="Old").exists())
+
+    def test_report_the_peak_memory_of_workers(self):
+        """
+        The memory of workers is maximized instead of being summed
+        """
 
+        totals = report_synchronization([
+            {'feeds': 1, 'rss': 2000, 'rss_growth': 500},
+            {'feeds': 1, 'rss': 3000, 'rss_growth': 100}
+        ])
 
+        self.assertEqual(totals, {'feeds': 2, 'rss': 3000, 'rss_growth': 500})
 
+    def test_sum_shard_totals(self):
+        """
+        Totals of shards are summed
+        """
+
+        totals = report_synchronization([
+            {'feeds': 1, 'posts': 2, 'errors': 0, 'locked': 0},
+            {'feeds': 3, 'posts': 4, 'errors': 1, 'locked': 2}
+        ])
+
+        self.assertEqual(totals, {'feeds': 4, 'posts': 6, 'errors': 1, 'locked': 2})
+
+    @patch("rsscatcher.tasks.FeedFetcher.fetch_all", fake_fetch_all)
+    @patch("feedparser.parse", get_fakeparser)
+    def test_skip_feeds_nobody_follows(self):
+        """
+        Feeds without subscribers are not downloaded
+        """
+
+        Subscription.objects.all().delete()
+
+        self.assertIsNone(synchronize_posts())
+        self.assertEqual(synchronize_shard(0, 1)['feeds'], 0)
+
+    @patch("rsscatcher.tasks.FeedFetcher.fetch_all", fake_fetch_all)
+    @patch("feedparser.parse", get_fakeparser)
+    def test_schedule_the_next_download(self):
+        """
+        A downloaded feed is not downloaded again before it is due
+        """
+
+        synchronize_shard(0, 1)
+
+        feed = Feed.objects.get(id=self.feed.id)
+        self.assertGreater(feed.next_fetch_at, timezone.now())
+        self.assertEqual(synchronize_shard(0, 1)['skipped'], 0)
+        self.assertIsNone(synchronize_posts())
+
+    def test_back_off_failing_feeds(self):
+        """
+        Each failed download doubles the delay before the next one
+        """
+
+        def failing(fetcher, feeds):
+            for feed in feeds:
+                yield FetchResult(feed, 500, None, {}, "HTTP Error 500")
+
+        delays = []
+        with patch("rsscatcher.tasks.FeedFetcher.fetch_all", failing):
+            for i in range(2):
+                Feed.objects.filter(id=self.feed.id).update(next_fetch_at=None)
+                synchronize_shard(0, 1)
+                feed = Feed.objects.get(id=self.feed.id)
+                delays.append((feed.next_fetch_at - timezone.now()).total_seconds())
+
+        self.assertEqual(feed.fetch_failures, 2)
+        self.assertAlmostEqual(delays[1] / delays[0], 2, places=1)
+
+
+class DeletionTaskTests(TestCase):
+
+    """
+    Tests large removals run by background tasks
+    """
+
+    def setUp(self):
+
+        self.feed = Feed.objects.create(name="Upidev", slug="upidev", url="http://upidev.fr")
+        self.post = Post.objects.create(name="oooo", slug="oooo", feed=self.feed, content="")
+        self.user = User.objects.create_user("john", email="john@upidev.fr", password="toto")
+        UserPost.objects.create(user=self.user, post=self.post, state=UserPost.FAVORITE)
+
+    def test_remove_feed(self):
+
+        Subscription.objects.create(user=self.user, feed=self.feed)
+
+        self.assertEqual(remove_feed(self.feed.id), 1)
+
+        self.assertFalse(Feed.objects.exists())
+        self.assertFalse(UserPost.objects.exists())
+
+    @override_settings(POST_RETENTION_DAYS=30)
+    def test_prune_posts(self):
+
+        Post.objects.update(published_date=timezone.now() - timedelta(days=31))
+        Post.objects.create(name="new", slug="new", feed=self.feed, content="")
+
+        # The favorite post is kept
+        self.assertEqual(prune_posts(), 0)
+
+        UserPost.objects.update(state=UserPost.READ)
+
+        self.assertEqual(prune_posts(), 1)
+        self.assertEqual(Post.objects.get().slug, "new")
+
+    def test_forget_feed_states_unless_followed_again(self):
+
+        Subscription.objects.create(user=self.user, feed=self.feed)
+        self.assertEqual(forget_feed_states(self.user.id, self.feed.id), 0)
+
+        Subscription.objects.all().delete()
+        self.assertEqual(forget_feed_states(self.user.id, self.feed.id), 1)
+
+        self.assertFalse(UserPost.objects.exists())
+
+
+class SchedulerTests(SimpleTestCase):
+
+    """
+    Delay between two downloads of a feed
+    """
+
+    now = datetime(2018, 6, 1, 12, tzinfo=timezone.utc)
+
+    def entries(self, *hours_ago):
+        return [
+            FakeEntry("Post", published_parsed=(self.now - timedelta(hours=hours)).utctimetuple())
+            for hours in hours_ago
+        ]
+
+    def test_learn_the_posting_interval_from_entries(self):
+        """
+        The interval is the median gap between the newest entries
+        """
+
+        entries = self.entries(0, 1, 2, 3, 3.1, 10)
+
+        self.assertEqual(posting_interval(entries, self.now), 3600)
+        self.assertIsNone(posting_interval([], self.now))
+
+    def test_silent_feeds_are_checked_less_often(self):
+        """
+        A feed silent for longer than its usual gap slows down
+        """
+
+        entries = self.entries(48, 49, 50)
+
+        self.assertEqual(posting_interval(entries, self.now), 48 * 3600)
+
+    def test_popular_feeds_are_checked_more_often(self):
+        """
+        The delay shrinks with the number of subscribers
+        """
+
+        alone = next_fetch_delay(4 * 3600, 1)
+        popular = next_fetch_delay(4 * 3600, 100)
+
+        self.assertEqual(alone, 2 * 3600)
+        self.assertLess(popular, alone)
+
+    @override_settings(FEED_POLL_MIN_INTERVAL=60, FEED_POLL_MAX_INTERVAL=3600)
+    def test_delay_is_bounded(self):
+        """
+        The delay stays between the minimum and maximum intervals
+        """
+
+        self.assertEqual(next_fetch_delay(0, 1), 60)
+        self.assertEqual(next_fetch_delay(None, 1), 60)
+        self.assertEqual(next_fetch_delay(10 * 24 * 3600, 1), 3600)
+        self.assertEqual(next_fetch_delay(None, 1, failures=20), 3600)
+
+    def test_honor_publisher_hints(self):
+        """
+        The ttl element and the Cache-Control and Retry-After headers are honored
+        """
+
+        online_feed = FakeParse()
+        online_feed.feed = {'ttl': '30'}
+
+        self.assertEqual(publisher_delay({}, online_feed, self.now), 1800)
+        self.assertEqual(
+            publisher_delay({'cache-control': 'public, max-age=7200'}, None, self.now), 7200
+        )
+        self.assertEqual(publisher_delay({'retry-after': '120'}, None, self.now), 120)
+        self.assertEqual(
+            publisher_delay({'retry-after': 'Fri, 01 Jun 2018 13:00:00 GMT'}, None, self.now),
+            3600
+        )
+        self.assertEqual(publisher_delay({'retry-after': 'soon'}, None, self.now), 0)
+
+    def test_schedule_a_feed_after_a_download(self):
+        """
+        The next download is scheduled from the learned interval
+        """
+
+        online_feed = FakeParse()
+        online_feed.entries = self.entries(0, 2, 4)
+        result = FetchResult(Feed(), 200, b"", {}, None)
+
+        fields = schedule_feed(Feed(), result, online_feed, now=self.now)
+
+        self.assertEqual(fields['post_interval'], 2 * 3600)
+        self.assertEqual(fields['next_fetch_at'], self.now + timedelta(hours=1))
+        self.assertEqual(fields['publication_frequency'], Feed.DAILY)
+        self.assertEqual(fields['fetch_failures'], 0)
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+
+    """
+    Serve slow and fast feeds
+    """
+
+    active = 0
+    max_active = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with FeedHandler.lock:
+            FeedHandler.active += 1
+            FeedHandler.max_active = max(FeedHandler.max_active, FeedHandler.active)
+
+        if self.path.startswith('/slow'):
+            time.sleep(0.5)
+
+        with FeedHandler.lock:
+            FeedHandler.active -= 1
+
+        if self.path.startswith('/gzip'):
+            body = gzip.compress(b"<rss>" + b" " * 100000 + b"</rss>")
+            self.send_response(200)
+            self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        if self.path.startswith('/missing'):
+            self.send_response(404)
+            self.end_headers()
+            return
+
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = b"<rss><channel><title>Feed</title></channel></rss>"
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/rss+xml')
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients timing out close the connection before the answer
+        pass
+
+
+class FeedFetcherTests(SimpleTestCase):
+
+    """
+    Tests the download stage against a local HTTP server
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingServer(('127.0.0.1', 0), FeedHandler)
+        cls.base_url = "http://127.0.0.1:{}".format(cls.server.server_port)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        FeedHandler.max_active = 0
+
+    def make_feeds(self, *paths):
+        return [Feed(id=i, url=self.base_url + path) for i, path in enumerate(paths)]
+
+    def test_download_feeds_concurrently(self):
+
+        """
+        Slow feeds are downloaded at the same time
+        """
+
+        feeds = self.make_feeds('/slow/1', '/slow/2', '/slow/3', '/slow/4')
+        fetcher = FeedFetcher(max_workers=4, per_host=4, timeout=5)
+
+        started = time.time()
+        results = list(fetcher.fetch_all(feeds))
+
+        self.assertLess(time.time() - started, 1.5)
+        self.assertEqual(len(results), 4)
+        for result in results:
+            self.assertEqual(result.status, 200)
+            self.assertIn(b"<rss>", result.content)
+
+    def test_fast_feeds_are_not_blocked_by_slow_feeds(self):
+
+        """
+        Results are yielded in completion order
+        """
+
+        feeds = self.make_feeds('/slow/1', '/fast/1')
+        fetcher = FeedFetcher(max_workers=2, per_host=2, timeout=5)
+
+        results = list(fetcher.fetch_all(feeds))
+
+        self.assertEqual(results[0].feed.url, self.base_url + '/fast/1')
+
+    def test_limit_connections_per_host(self):
+
+        """
+        No more than per_host connections are opened on the same host
+        """
+
+        feeds = self.make_feeds(*['/slow/{}'.format(i) for i in range(4)])
+        fetcher = FeedFetcher(max_workers=4, per_host=2, timeout=5)
+
+        list(fetcher.fetch_all(feeds))
+
+        self.assertEqual(FeedHandler.max_active, 2)
+
+    def test_busy_host_does_not_hold_workers(self):
+
+        """
+        Feeds of another host are downloaded while a host is at its limit
+        """
+
+        feeds = self.make_feeds(*['/slow/{}'.format(i) for i in range(4)])
+        other_host = Feed(id=4, url=self.base_url.replace('127.0.0.1', 'localhost') + '/fast/1')
+        fetcher = FeedFetcher(max_workers=2, per_host=1, timeout=5)
+
+        started = time.time()
+        results = fetcher.fetch_all(feeds + [other_host])
+
+        self.assertEqual(next(results).feed, other_host)
+        self.assertLess(time.time() - started, 0.4)
+        self.assertEqual(len(list(results)), 4)
+
+    def test_timeout_returns_an_error(self):
+
+        """
+        A feed slower than the timeout is reported as an error
+        """
+
+        feeds = self.make_feeds('/slow/1')
+        fetcher = FeedFetcher(max_workers=1, per_host=1, timeout=0.1)
+
+        result = list(fetcher.fetch_all(feeds))[0]
+
+        self.assertIsNone(result.content)
+        self.assertTrue(result.error)
+
+    def test_http_error_returns_the_status(self):
+
+        """
+        An HTTP error is reported with its status
+        """
+
+        result = FeedFetcher(timeout=5).fetch(self.make_feeds('/missing')[0])
+
+        self.assertEqual(result.status, 404)
+        self.assertIsNone(result.content)
+
+    def test_response_larger_than_the_maximum_size_is_an_error(self):
+
+        """
+        A response announced larger than the maximum size is not read
+        """
+
+        fetcher = FeedFetcher(timeout=5, max_size=10)
+
+        result = fetcher.fetch(self.make_feeds('/fast/1')[0])
+
+        self.assertIsNone(result.content)
+        self.assertIn("larger than 10 bytes", result.error)
+
+    def test_decompressed_response_is_bounded(self):
+
+        """
+        A small gzip response inflating past the maximum size is an error
+        """
+
+        feed = self.make_feeds('/gzip')[0]
+
+        result = FeedFetcher(timeout=5, max_size=1000).fetch(feed)
+        self.assertIn("larger than 1000 bytes", result.error)
+
+        result = FeedFetcher(timeout=5).fetch(feed)
+        self.assertEqual(len(result.content), 100011)
+
+    def test_send_conditional_requests(self):
+
+        """
+        Stored validators are sent and a 304 is not an error
+        """
 
+        feed = self.make_feeds('/fast/1')[0]
+        fetcher = FeedFetcher(timeout=5)
 
+        result = fetcher.fetch(feed)
+        self.assertEqual(result.headers['etag'], '"v1"')
 
+        feed.etag = result.headers['etag']
+        result = fetcher.fetch(feed)
 
+        self.assertEqual(result.status, 304)
+        self.assertIsNone(result.content)
+        self.assertIsNone(result.error)